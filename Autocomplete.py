@@ -0,0 +1,127 @@
+import bisect
+import heapq
+from collections import Counter
+
+# Prefixes up to this length have their best completions precomputed
+PRECOMPUTED_PREFIX_LENGTH = 3
+# Number of completions precomputed for every short prefix, i.e. the maximum limit they can answer
+PRECOMPUTED_COMPLETIONS = 20
+# Number of trigram candidates that are checked with the edit distance
+FUZZY_CANDIDATES = 20
+# Only the trigrams starting in the first characters of a name are indexed
+INDEXED_TRIGRAM_POSITIONS = 16
+# A trigram of the query matches the same trigram of a name shifted by at most this many characters
+TRIGRAM_SHIFT = 2
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def _trigrams(text):
+    """Positioned trigrams of the text, padded at the start only so that a prefix shares the trigrams of the full word."""
+    padded = "$$" + text
+    return [(position, padded[position:position + 3])
+            for position in range(min(len(padded) - 2, INDEXED_TRIGRAM_POSITIONS))]
+
+
+def _prefixDistance(query, name, maxDistance):
+    """Edit distance between the query and the closest prefix of the name, or None if above maxDistance."""
+    previous = list(range(len(name) + 1))
+    for i, char in enumerate(query, 1):
+        current = [i]
+        for j, other in enumerate(name, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > maxDistance:
+            return None
+        previous = current
+    distance = min(previous)
+    return distance if distance <= maxDistance else None
+
+
+class IngredientAutocomplete:
+    """Autocomplete of ingredient names, ranked by the number of recipes that use each ingredient.
+
+    Prefix lookups use a sorted array of the normalized names, with the completions of the short (and
+    therefore very common) prefixes precomputed. Typos are handled with an index of positioned trigrams
+    whose candidates are ranked by the edit distance between the query and a prefix of the name.
+    """
+
+    def __init__(self, names, recipeCounts):
+        """
+        Args:
+            names: list of the ingredient names.
+            recipeCounts: list with, for each ingredient, the number of recipes that contain it.
+        """
+        self.names = set(names)
+        entries = sorted((_normalize(name), -count, name) for name, count in zip(names, recipeCounts))
+        self.keys = [key for key, _, _ in entries]
+        self.entries = [(name, -count) for _, count, name in entries]
+
+        self.completions = {}
+        for position, key in enumerate(self.keys):
+            for length in range(1, min(len(key), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                self.completions.setdefault(key[:length], []).append(position)
+        for prefix, positions in self.completions.items():
+            self.completions[prefix] = self._best(positions, PRECOMPUTED_COMPLETIONS)
+
+        self.trigrams = {}
+        for position, key in enumerate(self.keys):
+            for trigram in _trigrams(key):
+                self.trigrams.setdefault(trigram, []).append(position)
+
+    def exists(self, name):
+        """Whether an ingredient with exactly this name exists."""
+        return name in self.names
+
+    def complete(self, prefix, limit=10):
+        """Find the ingredients whose name starts with the prefix.
+
+        Returns:
+            A list of (name, recipeCount) pairs, the most used ingredients first.
+        """
+        key = _normalize(prefix)
+        if limit <= 0:
+            return []
+        if len(key) <= PRECOMPUTED_PREFIX_LENGTH and limit <= PRECOMPUTED_COMPLETIONS:
+            return [self.entries[position] for position in self.completions.get(key, [])[:limit]]
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_left(self.keys, key + "\U0010ffff", start)
+        return [self.entries[position] for position in self._best(range(start, end), limit)]
+
+    def suggest(self, text, limit=10, exclude=()):
+        """Find the ingredients whose name starts with a misspelling of the text.
+
+        Returns:
+            A list of (name, recipeCount) pairs, sorted by edit distance and then by recipe count.
+        """
+        key = _normalize(text)
+        if len(key) < 4 or limit <= 0:
+            return []
+        maxDistance = 1 if len(key) < 6 else 2
+        # Typos shift the following characters, so each trigram is also looked up at nearby positions
+        overlaps = Counter()
+        for start, trigram in _trigrams(key):
+            for shift in range(max(0, start - TRIGRAM_SHIFT), start + TRIGRAM_SHIFT + 1):
+                overlaps.update(self.trigrams.get((shift, trigram), ()))
+
+        # Each edit changes at most three trigrams (q-gram lemma), names sharing fewer cannot be close enough.
+        # Only the first INDEXED_TRIGRAM_POSITIONS trigrams of the query are looked up
+        minOverlap = min(len(key), INDEXED_TRIGRAM_POSITIONS) - 3 * maxDistance
+        suggestions = []
+        for position, overlap in overlaps.most_common(FUZZY_CANDIDATES):
+            if overlap < minOverlap:
+                break
+            name, count = self.entries[position]
+            if name in exclude:
+                continue
+            # Only the prefix of the name that can be aligned with the query matters
+            distance = _prefixDistance(key, self.keys[position][:len(key) + maxDistance], maxDistance)
+            if distance is not None:
+                suggestions.append((distance, -count, name))
+        suggestions.sort()
+        return [(name, -count) for _, count, name in suggestions[:limit]]
+
+    def _best(self, positions, limit):
+        """The positions of the `limit` ingredients with the most recipes, in ranking order."""
+        return heapq.nsmallest(limit, positions, key=lambda position: (-self.entries[position][1], position))
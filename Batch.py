@@ -0,0 +1,247 @@
+from ElasticQueries import cannedQuery, elasticQueries
+from Neo4jQueries import CHECK_INGREDIENTS, GET_RECIPES_INGREDIENTS
+from Projection import parseProjection
+
+MAX_BATCH_SIZE = 500
+
+
+def checkIngredients(driver, ingredients):
+    """Check which ingredients exist in the database with a single query.
+
+    Returns:
+        A dictionary from ingredient name to True if the ingredient exists.
+    """
+    with driver.session() as session:
+        result = session.run(CHECK_INGREDIENTS, items=list(ingredients))
+        return {record['ingredient']: record['exists'] for record in result.data()}
+
+
+def getRecipesIngredients(driver, recipeIds):
+    """Get the ingredients of several recipes with a single query.
+
+    Returns:
+        A dictionary from recipe id to the list of its ingredients.
+    """
+    with driver.session() as session:
+        result = session.run(GET_RECIPES_INGREDIENTS, items=list(recipeIds))
+        return {record['recipe']: record['ingredients'] for record in result.data()}
+
+
+def cannedQueryResponse(result):
+    """Build the response of /api/elasticsearch/queries from an ElasticSearch result."""
+    if 'aggregations' not in result:
+        return {"recipes": [{"matchingScore": record['_score'], "recipe": record['_source']}
+                            for record in result['hits']['hits']]}
+    return {"aggregations": result['aggregations']}
+
+
+def runCannedQueries(es, queries):
+    """Run several canned queries with a single msearch request.
+
+    Args:
+        es: an ElasticSearch client.
+        queries: list of (body, limit) pairs, the bodies built by ElasticQueries.cannedQuery.
+
+    Returns:
+        The list of responses, in the same order. A failed query gets an object with the key "error".
+    """
+    return _cannedQueriesResponses(es.msearch(body=_cannedQueriesBody(queries)))
+
+
+async def checkIngredientsAsync(driver, ingredients):
+    """Async version of checkIngredients, for an AsyncDriver."""
+    async with driver.session() as session:
+        result = await session.run(CHECK_INGREDIENTS, items=list(ingredients))
+        return {record['ingredient']: record['exists'] for record in await result.data()}
+
+
+async def getRecipesIngredientsAsync(driver, recipeIds):
+    """Async version of getRecipesIngredients, for an AsyncDriver."""
+    async with driver.session() as session:
+        result = await session.run(GET_RECIPES_INGREDIENTS, items=list(recipeIds))
+        return {record['recipe']: record['ingredients'] for record in await result.data()}
+
+
+async def runCannedQueriesAsync(es, queries):
+    """Async version of runCannedQueries, for an AsyncElasticsearch client."""
+    return _cannedQueriesResponses(await es.msearch(body=_cannedQueriesBody(queries)))
+
+
+def _cannedQueriesBody(queries):
+    body = []
+    for query, limit in queries:
+        body.append({"index": "recipeswithreviews"})
+        body.append({**query, "size": limit})
+    return body
+
+
+def _cannedQueriesResponses(result):
+    return [{"error": str(response['error'])} if 'error' in response else cannedQueryResponse(response)
+            for response in result['responses']]
+
+
+def _validate(operation):
+    """Returns an error message if the operation is malformed, None otherwise."""
+    if not isinstance(operation, dict):
+        return "An operation should be a JSON object"
+    kind = operation.get("op")
+    if kind == "checkIngredient":
+        if "ingredient" not in operation:
+            return "No ingredient found"
+        if not isinstance(operation["ingredient"], str):
+            return "The ingredient should be a string"
+    elif kind == "getIngredients":
+        if "recipeId" not in operation:
+            return "No recipeId found"
+        if not isinstance(operation["recipeId"], int) or isinstance(operation["recipeId"], bool):
+            return "The recipeId should be an integer"
+    elif kind == "elasticQuery":
+        if "queryNumber" not in operation:
+            return "No query number found"
+        if "limit" not in operation:
+            return "No limit found"
+        queryNumber = operation["queryNumber"]
+        limit = operation["limit"]
+        if not isinstance(queryNumber, int) or queryNumber < 0 or queryNumber >= len(elasticQueries):
+            return f"Invalid query number, it should be between 0 and {len(elasticQueries) - 1}"
+        if not isinstance(limit, int) or limit < 0:
+            return "Limit should be greater than 0"
+        if not isinstance(operation.get("params", {}), dict):
+            return "The params should be a JSON object"
+    else:
+        return "Unknown operation, it should be one of checkIngredient, getIngredients, elasticQuery"
+    return None
+
+
+def runBatch(operations, driver, es, queryCache=None, materializedQueries=None):
+    """Execute a list of heterogeneous operations with one database round trip per operation type.
+
+    Operations of the same type are collapsed: all the checkIngredient operations run as one UNWIND
+    query, all the getIngredients operations as another one, and all the elasticQuery operations as a
+    single msearch request.
+
+    Args:
+        operations: list of objects with the key "op" and the parameters of the operation:
+            {"op": "checkIngredient", "ingredient": ...}
+            {"op": "getIngredients", "recipeId": ...}
+            {"op": "elasticQuery", "queryNumber": ..., "limit": ..., "params": {...}}
+            where the elasticQuery operations can also have the keys "fields" or "view", see Projection.
+        driver: a Neo4j driver.
+        es: an ElasticSearch client.
+        queryCache: optional CannedQueryCache used for the elasticQuery operations.
+        materializedQueries: optional MaterializedQueries answering the aggregation queries.
+
+    Returns:
+        The list of results, in the same order as the operations. Each result is the JSON object the
+        corresponding single endpoint would return, or an object with the key "error".
+    """
+    batch = _Batch(operations, queryCache, materializedQueries)
+    for kind, positions in batch.groups.items():
+        if not positions:
+            continue
+        try:
+            if kind == "checkIngredient":
+                batch.setExists(positions, checkIngredients(driver, batch.keys(positions, "ingredient")))
+            elif kind == "getIngredients":
+                batch.setIngredients(positions, getRecipesIngredients(driver, batch.keys(positions, "recipeId")))
+            else:
+                pending = batch.cachedQueries(positions)
+                if pending:
+                    batch.setQueries(pending, runCannedQueries(es, batch.queries(pending)))
+        except Exception as e:
+            batch.setError(positions, e)
+    return batch.results
+
+
+async def runBatchAsync(operations, driver, es, queryCache=None, materializedQueries=None):
+    """Async version of runBatch, for an AsyncDriver and an AsyncElasticsearch client.
+
+    The three operation types are executed concurrently.
+    """
+    import asyncio  # Only the async app pays for importing asyncio
+
+    batch = _Batch(operations, queryCache, materializedQueries)
+
+    async def runGroup(kind, positions):
+        try:
+            if kind == "checkIngredient":
+                batch.setExists(positions, await checkIngredientsAsync(driver, batch.keys(positions, "ingredient")))
+            elif kind == "getIngredients":
+                batch.setIngredients(positions, await getRecipesIngredientsAsync(driver, batch.keys(positions, "recipeId")))
+            else:
+                pending = batch.cachedQueries(positions)
+                if pending:
+                    batch.setQueries(pending, await runCannedQueriesAsync(es, batch.queries(pending)))
+        except Exception as e:
+            batch.setError(positions, e)
+
+    await asyncio.gather(*(runGroup(kind, positions) for kind, positions in batch.groups.items() if positions))
+    return batch.results
+
+
+class _Batch:
+    """The results of a batch, filled group by group. The I/O is left to runBatch and runBatchAsync."""
+
+    def __init__(self, operations, queryCache, materializedQueries=None):
+        self.operations = operations
+        self.queryCache = queryCache
+        self.materializedQueries = materializedQueries
+        self.results = [None] * len(operations)
+        self.groups = {"checkIngredient": [], "getIngredients": [], "elasticQuery": []}
+        # Search body and cache variant of each elasticQuery operation
+        self.cannedQueries = {}
+        for position, operation in enumerate(operations):
+            error = _validate(operation)
+            if error is None and operation["op"] == "elasticQuery":
+                try:
+                    projection = parseProjection(operation.get("fields"), operation.get("view"))
+                    self.cannedQueries[position] = cannedQuery(operation["queryNumber"], operation.get("params"), projection)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                self.results[position] = {"error": error}
+            else:
+                self.groups[operation["op"]].append(position)
+
+    def keys(self, positions, key):
+        """The distinct values of a parameter of the operations."""
+        return list(dict.fromkeys(self.operations[position][key] for position in positions))
+
+    def setExists(self, positions, exists):
+        for position in positions:
+            self.results[position] = {"exists": exists.get(self.operations[position]["ingredient"], False)}
+
+    def setIngredients(self, positions, ingredients):
+        for position in positions:
+            self.results[position] = {"ingredients": ingredients.get(self.operations[position]["recipeId"], [])}
+
+    def cachedQueries(self, positions):
+        """Answer the canned queries from their snapshot or from the cache, and return the positions of the ones still to run."""
+        pending = []
+        for position in positions:
+            operation = self.operations[position]
+            _, variant = self.cannedQueries[position]
+            cached = (self.materializedQueries.response(operation["queryNumber"])
+                      if self.materializedQueries is not None and variant is None else None)
+            if cached is None and self.queryCache is not None:
+                cached = self.queryCache.get(operation["queryNumber"], operation["limit"], variant)
+            if cached is not None:
+                self.results[position] = cached
+            else:
+                pending.append(position)
+        return pending
+
+    def queries(self, positions):
+        return [(self.cannedQueries[position][0], self.operations[position]["limit"]) for position in positions]
+
+    def setQueries(self, positions, responses):
+        for position, response in zip(positions, responses):
+            self.results[position] = response
+            if self.queryCache is not None and "error" not in response:
+                operation = self.operations[position]
+                self.queryCache.put(operation["queryNumber"], operation["limit"], response, self.cannedQueries[position][1])
+
+    def setError(self, positions, error):
+        for position in positions:
+            if self.results[position] is None:
+                self.results[position] = {"error": str(error)}
@@ -0,0 +1,50 @@
+"""Database clients of the Flask app, created on their first use.
+
+On Vercel every cold start imports the app. Importing the neo4j and elasticsearch packages and building
+their clients takes a large part of that time, so it is deferred to the first request that needs the
+backend: a route that only reads ElasticSearch never loads the Neo4j driver.
+"""
+import threading
+
+from Settings import uri, username, password, bonsai_url
+
+
+class LazyClient:
+    """Proxy of a client built by factory() on the first attribute access.
+
+    It stands for the client wherever one is expected, e.g. `driver.session()` builds the driver and
+    opens a session.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.client = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Returns the client, building it if needed."""
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = self.factory()
+        return self.client
+
+    @property
+    def initialized(self):
+        return self.client is not None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def neo4jDriver():
+    from neo4j import GraphDatabase
+
+    return GraphDatabase.driver(uri, auth=(username, password))
+
+
+def elasticsearchClient():
+    from elasticsearch import Elasticsearch
+
+    return Elasticsearch(bonsai_url,
+                         verify_certs=True)
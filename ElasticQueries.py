@@ -1,10 +1,94 @@
 import json
+import os
+
+from Projection import projectionKey, withSourceFilter
+from QueryTemplates import loadQueryTemplates
+
+# Next to this module, so that the app does not depend on the working directory of the server
+ELASTIC_QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ElasticQueries.json')
 
 
 def loadElasticQueries():
-    with open('./ElasticQueries.json', 'r') as f:
+    with open(ELASTIC_QUERIES_PATH, 'r') as f:
         elasticQueries = json.load(f)
     return elasticQueries
 
 
-elasticQueries = [q['query'] for q in loadElasticQueries()]
+# The canned queries, compiled from their templates
+queryTemplates = loadQueryTemplates(loadElasticQueries())
+
+# The bodies of the canned queries with the default values of their parameters
+elasticQueries = [template.defaultBody for template in queryTemplates]
+
+
+def cannedQuery(queryNumber, arguments=None, projection=None):
+    """Build the search body of a canned query.
+
+    Args:
+        queryNumber: index of the query in ElasticQueries.json.
+        arguments: optional dictionary (or query string arguments) with values of the parameters of the query.
+        projection: optional projection of the recipes, see Projection.
+
+    Returns:
+        The search body and the variant of the query for the cache (None for the default parameters and the
+          whole recipes).
+
+    Raises:
+        ValueError: if the query number or a parameter value is invalid.
+    """
+    if queryNumber < 0 or queryNumber >= len(queryTemplates):
+        raise ValueError(f"Invalid query number, it should be between 0 and {len(queryTemplates) - 1}")
+    template = queryTemplates[queryNumber]
+    values = template.values(arguments)
+    body = withSourceFilter(template.build(values), projection)
+    # Aggregations do not return recipes, their response does not depend on the projection
+    variant = projectionKey(projection) if 'aggs' not in body else None
+    parametersKey = template.key(values)
+    if parametersKey is not None:
+        variant = f"parameters={parametersKey}" + (f";projection={variant}" if variant is not None else "")
+    return body, variant
+
+
+def matchIngredientsBody(ingredients):
+    """Body of the query of /api/elasticsearch/matchIngredients: recipes with at least one of the ingredients."""
+    return {
+        "query": {
+            "bool": {
+                "should": [{
+                    "match": {
+                        "RecipeIngredientParts": {
+                            "query": " ".join(ingredients),
+                            "operator": "or"
+                        }
+                    }
+                }]
+            }
+        }
+    }
+
+
+def matchIngredientsAndBody(ingredients):
+    """Body of the query of /api/elasticsearch/matchIngredientsAnd: recipes with the last ingredient and at least one other."""
+    return {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"match":
+                     {
+                         "RecipeIngredientParts": ingredients[-1]
+                     }
+                     }
+                ],
+                "must": [
+                    {
+                        "match": {
+                            "RecipeIngredientParts": {
+                                "query": " ".join(ingredients[:-1]),
+                                "operator": "or"
+                            }
+                        }
+                    }
+                ]
+            }
+        }
+    }
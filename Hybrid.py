@@ -0,0 +1,259 @@
+"""Hybrid recipe search: the Neo4j and ElasticSearch ingredient matching run concurrently and their rankings
+are merged into one.
+
+The recipes are joined by id (the id property of the Neo4j recipes, the RecipeId field of the ElasticSearch
+documents). A backend that misses the deadline or fails is left out, and the response is marked as partial,
+so the latency is the one of the slowest backend within the deadline instead of the sum of the two.
+"""
+import contextvars
+import math
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from ElasticQueries import matchIngredientsBody, matchIngredientsAndBody
+from Neo4jQueries import MATCH_INGREDIENTS
+from Projection import withRecipeProjection, withSourceFilter
+
+BACKENDS = ("neo4j", "elasticsearch")
+FUSIONS = ("rrf", "weighted")
+
+# Constant of the reciprocal rank fusion, it damps the weight of the first ranks
+RRF_K = 60
+
+# Outcome of a backend still running at the deadline
+MISSED_DEADLINE = object()
+
+# Threads running the backend queries of the synchronous app, shared by all the requests. A thread can not be
+# cancelled, so the queries are given the deadline as timeout to free their thread soon after it
+executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hybrid")
+
+
+def neo4jCandidates(driver, ingredients, limit, projection=None, timeout=None):
+    """The best matches of the graph, as returned by /api/neo4j/matchIngredients.
+
+    The optional timeout, in seconds, is the timeout of the transaction: the server aborts the query after it.
+    """
+    query = _neo4jQuery(limit, projection)
+    if timeout is not None:
+        from neo4j import Query  # The driver package is loaded with the client, see Clients
+
+        query = Query(query, timeout=timeout)
+    with driver.session() as session:
+        result = session.run(query, ingredients=ingredients)
+        return [_neo4jCandidate(record) for record in result.data()]
+
+
+def elasticCandidates(es, ingredients, limit, matchAll=False, projection=None, timeout=None):
+    """The best matches of ElasticSearch, as returned by /api/elasticsearch/matchIngredients (or matchIngredientsAnd).
+
+    The optional timeout, in seconds, is the timeout of the HTTP request.
+    """
+    kwargs = {} if timeout is None else {"request_timeout": timeout}
+    result = es.search(index="recipeswithreviews", body=_elasticBody(ingredients, matchAll, projection), size=limit,
+                       **kwargs)
+    return [_elasticCandidate(hit) for hit in result['hits']['hits']]
+
+
+async def neo4jCandidatesAsync(driver, ingredients, limit, projection=None):
+    """Async version of neo4jCandidates, for an AsyncDriver."""
+    async with driver.session() as session:
+        result = await session.run(_neo4jQuery(limit, projection), ingredients=ingredients)
+        return [_neo4jCandidate(record) for record in await result.data()]
+
+
+async def elasticCandidatesAsync(es, ingredients, limit, matchAll=False, projection=None):
+    """Async version of elasticCandidates, for an AsyncElasticsearch client."""
+    result = await es.search(index="recipeswithreviews", body=_elasticBody(ingredients, matchAll, projection), size=limit)
+    return [_elasticCandidate(hit) for hit in result['hits']['hits']]
+
+
+def _neo4jCandidate(record):
+    return {"recipeId": record['r']['id'], "score": record['matchingScore'], "recipe": record['r'],
+            "matchingIngredients": record['matchingIngredients']}
+
+
+def _elasticCandidate(hit):
+    return {"recipeId": hit['_source']['RecipeId'], "score": hit['_score'], "recipe": hit['_source']}
+
+
+def _neo4jQuery(limit, projection):
+    return withRecipeProjection(MATCH_INGREDIENTS, projection) + f" LIMIT {int(limit)}"
+
+
+def _elasticBody(ingredients, matchAll, projection):
+    body = matchIngredientsAndBody(ingredients) if matchAll else matchIngredientsBody(ingredients)
+    return withSourceFilter(body, projection)
+
+
+def fuseRankings(rankings, limit, fusion="rrf", weights=None):
+    """Merge the rankings of several backends into one.
+
+    Args:
+        rankings: dictionary from backend name to its list of candidates, best first. A candidate has the keys
+            "recipeId", "score" and "recipe".
+        limit: number of recipes to return.
+        fusion: "rrf" sums weight / (RRF_K + rank) over the backends that found the recipe, "weighted" sums
+            weight * score / best score of the backend.
+        weights: optional dictionary from backend name to its weight, 1 by default.
+
+    Returns:
+        The list of the fused matches, best first. Each match has the keys "recipeId", "fusedScore", "recipe"
+        (taken from the first backend in BACKENDS order that found it), "ranks" and "scores" (dictionaries from
+        backend name to the rank and the score of the recipe in that backend), and "matchingIngredients" when
+        the graph found the recipe.
+    """
+    weights = weights or {}
+    matches = {}
+    for backend in BACKENDS:
+        candidates = rankings.get(backend)
+        if not candidates:
+            continue
+        weight = weights.get(backend, 1)
+        bestScore = max(candidate['score'] for candidate in candidates) or 1
+        for rank, candidate in enumerate(candidates, start=1):
+            match = matches.get(candidate['recipeId'])
+            if match is None:
+                match = matches[candidate['recipeId']] = {"recipeId": candidate['recipeId'], "fusedScore": 0.0,
+                                                          "recipe": candidate['recipe'], "ranks": {}, "scores": {}}
+            if fusion == "rrf":
+                match['fusedScore'] += weight / (RRF_K + rank)
+            else:
+                match['fusedScore'] += weight * candidate['score'] / bestScore
+            match['ranks'][backend] = rank
+            match['scores'][backend] = candidate['score']
+            if "matchingIngredients" in candidate:
+                match['matchingIngredients'] = candidate['matchingIngredients']
+
+    fused = sorted(matches.values(), key=lambda match: (-match['fusedScore'], min(match['ranks'].values())))
+    return fused[:limit]
+
+
+def validateHybridRequest(body):
+    """Read the parameters of a hybrid search request.
+
+    Returns:
+        The keyword arguments of hybridSearch, without the clients and the deadline.
+
+    Raises:
+        ValueError: if a parameter is missing or invalid.
+    """
+    if not isinstance(body, dict) or not isinstance(body.get('ingredients'), list):
+        raise ValueError("No ingredients found")
+    limit = int(body.get('limit', 10))
+    if limit < 0:
+        raise ValueError("Limit should be greater than 0")
+    candidates = int(body.get('candidates', limit))
+    fusion = body.get('fusion', "rrf")
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion, it should be one of {', '.join(FUSIONS)}")
+    weights = body.get('weights') or {}
+    if not isinstance(weights, dict) or any(backend not in BACKENDS or not isinstance(weight, (int, float))
+                                            for backend, weight in weights.items()):
+        raise ValueError(f"The weights should be numbers keyed by backend, one of {', '.join(BACKENDS)}")
+    return {"ingredients": body['ingredients'], "limit": limit, "candidates": max(candidates, limit),
+            "fusion": fusion, "weights": weights, "matchAll": bool(body.get('matchAll', False))}
+
+
+def parseDeadline(value, maximum):
+    """Read the deadline of a hybrid search request, in seconds, capped at maximum.
+
+    Raises:
+        ValueError: if the deadline is not a positive finite number. It is the timeout of the backend queries, and
+          a timeout of 0 means no timeout to Neo4j.
+    """
+    if value is None:
+        return maximum
+    try:
+        deadline = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("The deadline should be a number")
+    if not math.isfinite(deadline) or deadline <= 0:
+        raise ValueError("The deadline should be a positive number")
+    return min(deadline, maximum)
+
+
+def hybridSearch(driver, es, ingredients, limit=10, deadline=2.0, candidates=None, fusion="rrf", weights=None,
+                 matchAll=False, projection=None):
+    """Run the graph and the full-text ingredient matching concurrently and fuse their rankings.
+
+    Args:
+        driver: a Neo4j driver.
+        es: an ElasticSearch client.
+        ingredients: list of ingredient names.
+        limit: number of recipes to return.
+        deadline: seconds to wait for the backends. The ones still running are left out of the response, and
+          their queries are aborted by the timeout they were given, so that they do not hold their thread of
+          the shared executor after the deadline.
+        candidates: number of recipes asked to each backend, limit by default.
+        fusion: "rrf" or "weighted", see fuseRankings.
+        weights: optional dictionary from backend name to its weight.
+        matchAll: rank the ElasticSearch matches like /api/elasticsearch/matchIngredientsAnd.
+        projection: optional projection of the recipes, see Projection.
+
+    Returns:
+        A JSON object with the keys "recipes" (the fused matches), "partial" (True when a backend is missing)
+          and "backends" (for each backend, the number of candidates it returned or the error that left it out).
+    """
+    candidates = candidates or limit
+    # The queries run in the context of the request, so that their time is added to its Server-Timing phases
+    futures = {
+        executor.submit(contextvars.copy_context().run, neo4jCandidates, driver, ingredients, candidates,
+                        projection, deadline): "neo4j",
+        executor.submit(contextvars.copy_context().run, elasticCandidates, es, ingredients, candidates, matchAll,
+                        projection, deadline): "elasticsearch",
+    }
+    done, _ = wait(futures, timeout=deadline)
+    outcomes = {}
+    for future, backend in futures.items():
+        if future not in done:
+            # Only a query still waiting for a thread is cancelled, a running one stops at its timeout
+            future.cancel()
+            outcomes[backend] = MISSED_DEADLINE
+        elif future.exception() is not None:
+            outcomes[backend] = future.exception()
+        else:
+            outcomes[backend] = future.result()
+    return _hybridResponse(outcomes, limit, fusion, weights)
+
+
+async def hybridSearchAsync(driver, es, ingredients, limit=10, deadline=2.0, candidates=None, fusion="rrf",
+                            weights=None, matchAll=False, projection=None):
+    """Async version of hybridSearch, for an AsyncDriver and an AsyncElasticsearch client.
+
+    The backend queries still running at the deadline are cancelled.
+    """
+    import asyncio  # Only the async app pays for importing asyncio
+
+    candidates = candidates or limit
+    tasks = {
+        asyncio.ensure_future(neo4jCandidatesAsync(driver, ingredients, candidates, projection)): "neo4j",
+        asyncio.ensure_future(elasticCandidatesAsync(es, ingredients, candidates, matchAll, projection)): "elasticsearch",
+    }
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    outcomes = {}
+    for task, backend in tasks.items():
+        if task in pending:
+            outcomes[backend] = MISSED_DEADLINE
+        elif task.exception() is not None:
+            outcomes[backend] = task.exception()
+        else:
+            outcomes[backend] = task.result()
+    return _hybridResponse(outcomes, limit, fusion, weights)
+
+
+def _hybridResponse(outcomes, limit, fusion, weights):
+    rankings = {}
+    backends = {}
+    for backend, outcome in outcomes.items():
+        if outcome is MISSED_DEADLINE:
+            backends[backend] = {"error": "The deadline was exceeded"}
+        elif isinstance(outcome, BaseException):
+            backends[backend] = {"error": str(outcome)}
+        else:
+            rankings[backend] = outcome
+            backends[backend] = {"candidates": len(outcome)}
+    if not rankings:
+        raise RuntimeError("; ".join(f"{backend}: {status['error']}" for backend, status in backends.items()))
+    return {"recipes": fuseRankings(rankings, limit, fusion, weights), "partial": len(rankings) < len(outcomes),
+            "backends": backends}
@@ -0,0 +1,26 @@
+from RecipeGraph import exportRecipeGraph, exportIngredientCounts
+from MixAndMax import MixAndMaxIndex
+from MatchIngredients import IngredientMatchIndex
+from Autocomplete import IngredientAutocomplete
+from RecipeSimilarity import RecipeSimilarityIndex
+
+
+def buildLocalIndexes(driver):
+    """Export the recipe graph from Neo4j and build all the in-memory indexes on top of it."""
+    graph = exportRecipeGraph(driver)
+    return {
+        "graph": graph,
+        "mixAndMax": MixAndMaxIndex(graph),
+        "matchIngredients": IngredientMatchIndex(graph),
+    }
+
+
+def buildSimilarityIndex(driver, localIndexes):
+    """Build the MinHash index of the similar recipes, on the graph of the local indexes when they are already built."""
+    graph = localIndexes.value["graph"] if localIndexes.value is not None else exportRecipeGraph(driver)
+    return RecipeSimilarityIndex(graph)
+
+
+def buildAutocompleteIndex(driver):
+    """Build the index of the ingredient names used by the autocomplete."""
+    return IngredientAutocomplete(*exportIngredientCounts(driver))
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class IngredientMatchIndex:
+    """Inverted index that answers /api/neo4j/matchIngredients from a RecipeGraph.
+
+    The matching score of a recipe is the number of query ingredients it contains, computed by merging
+    the posting lists (sorted recipe positions) of the query ingredients. Only the ids of the best recipes
+    are returned, so that the database has to hydrate just those.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def topK(self, ingredients, limit=None):
+        """Find the recipes that contain at least one of the ingredients.
+
+        Args:
+            ingredients: list of ingredient names.
+            limit: maximum number of results. None returns every matching recipe.
+
+        Returns:
+            A list of objects with the keys "recipeId", "matchingScore" and "matchingIngredients", sorted by
+            matchingScore descending (ties by recipe position).
+        """
+        graph = self.graph
+        provided = graph.toPositions(ingredients)
+        if len(provided) == 0:
+            return []
+
+        postings = np.concatenate([graph.postings(position) for position in provided])
+        recipes, scores = np.unique(postings, return_counts=True)
+
+        # Rank by score, then by recipe position, with a single integer key
+        keys = scores.astype(np.int64) * (graph.numRecipes + 1) - recipes
+        if limit is not None and limit < len(recipes):
+            if limit <= 0:
+                return []
+            # Select the best `limit` recipes without sorting all of them
+            candidates = np.argpartition(-keys, limit - 1)[:limit]
+        else:
+            candidates = np.arange(len(recipes))
+        winners = candidates[np.argsort(-keys[candidates])]
+
+        # Matching ingredients of the winners, gathered in one pass and split by recipe
+        winnerRecipes = recipes[winners]
+        winnerScores = scores[winners]
+        isProvided = np.zeros(graph.numIngredients, dtype=bool)
+        isProvided[provided] = True
+        _, cols = graph.gatherIngredients(winnerRecipes)
+        names = [graph.ingredientNames[position] for position in cols[isProvided[cols]].tolist()]
+        ends = np.cumsum(winnerScores).tolist()
+
+        return [{"recipeId": graph.recipeIds[recipe],
+                 "matchingScore": score,
+                 "matchingIngredients": names[end - score:end]}
+                for recipe, score, end in zip(winnerRecipes.tolist(), winnerScores.tolist(), ends)]
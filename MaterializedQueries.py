@@ -0,0 +1,638 @@
+"""Materialized snapshots of the canned aggregation queries.
+
+The aggregations of the canned queries 6 and 8 read the whole recipeswithreviews index on every call, but
+their inputs only change when recipes or reviews are ingested. A snapshot keeps, for every recipe matching
+the query, the few fields its aggregations read, as compact numpy columns, together with the aggregation
+state (document counts, sums) built from them. The responses are rendered from that state in the format of
+the ElasticSearch aggregations.
+
+The query filter itself is evaluated by ElasticSearch: the snapshot is exported with a search restricted to
+the recipes matching the query. A refresh re-exports only the changed recipes: each of them has its old
+contribution removed from the buckets and terms it was counted in, and its new one added, and a deleted one
+is only removed. The changed recipes are pushed by the ingestion, with their ids, or found by the timestamp
+field the ingestion sets on every document it indexes (the content dates, like DatePublished, are not when
+a recipe was indexed). Applying a recipe twice gives the same state, so the refreshes by timestamp overlap a
+little to not miss a change. A periodic full rebuild catches the changes that were not pushed, e.g. the
+deleted recipes when only the timestamps are used.
+
+The supported aggregations are range (with range or metric sub-aggregations), terms (with metric
+sub-aggregations, on numeric fields) and avg, sum, min, max.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from Projection import ELASTIC_ID_FIELD
+
+INDEX = "recipeswithreviews"
+
+# Seconds by which a refresh looks further back than the previous one, for the clock skew with the ingestion
+REFRESH_OVERLAP_SECONDS = 300
+
+EXPORT_PAGE_SIZE = 5000
+# Timeout of the search of one export page, overriding the short one of the fallback to the search replica
+EXPORT_REQUEST_TIMEOUT_SECONDS = 120
+# Number of changed recipes re-exported per search
+REFRESH_BATCH_SIZE = 1000
+
+TERMS_DEFAULT_SIZE = 10
+
+# Maximum number of recipes pushed by the ingestion in one request
+MAX_PUSHED_RECIPES = 10000
+
+
+class MetricAggregation:
+    """avg, sum, min or max of a numeric field. The state is a [count, sum, min, max] list.
+
+    A removed value may have been the minimum or the maximum: min and max are only exact again after a rebuild.
+    """
+
+    KINDS = ("avg", "sum", "min", "max")
+
+    def __init__(self, name, kind, spec):
+        self.name = name
+        self.kind = kind
+        self.field = spec["field"]
+
+    @property
+    def fields(self):
+        return {self.field}
+
+    @staticmethod
+    def emptyState():
+        return [0, 0.0, None, None]
+
+    def state(self, columns, mask):
+        values = columns[self.field][mask]
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self.emptyState()
+        return [len(values), float(values.sum()), float(values.min()), float(values.max())]
+
+    def groupedStates(self, columns, mask, groups, numGroups):
+        """The states of the documents of the mask grouped by groups (the group of each document of the mask)."""
+        values = columns[self.field][mask]
+        valid = ~np.isnan(values)
+        counts = np.bincount(groups[valid], minlength=numGroups)
+        sums = np.bincount(groups[valid], weights=values[valid], minlength=numGroups)
+        minimums = np.full(numGroups, np.inf)
+        np.minimum.at(minimums, groups[valid], values[valid])
+        maximums = np.full(numGroups, -np.inf)
+        np.maximum.at(maximums, groups[valid], values[valid])
+        return [[int(count), float(total), float(low) if count else None, float(high) if count else None]
+                for count, total, low, high in zip(counts, sums, minimums, maximums)]
+
+    def update(self, state, values, sign):
+        value = values[self.field]
+        if np.isnan(value):
+            return
+        state[0] += sign
+        state[1] += sign * value
+        if sign > 0:
+            state[2] = value if state[2] is None else min(state[2], value)
+            state[3] = value if state[3] is None else max(state[3], value)
+        elif state[0] == 0:
+            state[2] = state[3] = None
+
+    def render(self, state):
+        count, total, minimum, maximum = state
+        if self.kind == "avg":
+            return {"value": total / count if count else None}
+        if self.kind == "sum":
+            return {"value": total}
+        return {"value": minimum if self.kind == "min" else maximum}
+
+
+class RangeAggregation:
+    """range aggregation: from is inclusive and to exclusive, a document can be in several buckets.
+    The state is, for each range, [doc_count, sub-aggregation states]."""
+
+    def __init__(self, name, spec, children):
+        self.name = name
+        self.field = spec["field"]
+        self.ranges = [(bucket.get("key"), bucket.get("from"), bucket.get("to")) for bucket in spec["ranges"]]
+        self.children = children
+
+    @property
+    def fields(self):
+        return {self.field}.union(*(child.fields for child in self.children))
+
+    def state(self, columns, mask):
+        values = columns[self.field]
+        states = []
+        for _, start, end in self.ranges:
+            bucket = mask & self._inRange(values, start, end)
+            states.append([int(bucket.sum()), [child.state(columns, bucket) for child in self.children]])
+        return states
+
+    def update(self, state, values, sign):
+        value = values[self.field]
+        for (_, start, end), bucket in zip(self.ranges, state):
+            if self._inRange(value, start, end):
+                bucket[0] += sign
+                for child, childState in zip(self.children, bucket[1]):
+                    child.update(childState, values, sign)
+
+    def render(self, state):
+        buckets = []
+        for (key, start, end), (docCount, childStates) in zip(self.ranges, state):
+            bucket = {"key": key if key is not None else _rangeKey(start, end)}
+            if start is not None:
+                bucket["from"] = float(start)
+            if end is not None:
+                bucket["to"] = float(end)
+            bucket["doc_count"] = docCount
+            for child, childState in zip(self.children, childStates):
+                bucket[child.name] = child.render(childState)
+            buckets.append(bucket)
+        return {"buckets": buckets}
+
+    @staticmethod
+    def _inRange(values, start, end):
+        inRange = values == values  # False for the missing values (NaN)
+        if start is not None:
+            inRange = inRange & (values >= start)
+        if end is not None:
+            inRange = inRange & (values < end)
+        return inRange
+
+
+class TermsAggregation:
+    """terms aggregation on a numeric field, ordered by doc_count and then by key.
+    The state is [number of documents with a term, {term: [doc_count, sub-aggregation states]}]."""
+
+    def __init__(self, name, spec, children):
+        self.name = name
+        self.field = spec["field"]
+        self.size = spec.get("size", TERMS_DEFAULT_SIZE)
+        if any(not isinstance(child, MetricAggregation) for child in children):
+            raise ValueError(f"The terms aggregation {name} can only have metric sub-aggregations")
+        self.children = children
+
+    @property
+    def fields(self):
+        return {self.field}.union(*(child.fields for child in self.children))
+
+    def state(self, columns, mask):
+        values = columns[self.field]
+        mask = mask & ~np.isnan(values)
+        terms, groups = np.unique(values[mask], return_inverse=True)
+        counts = np.bincount(groups, minlength=len(terms))
+        childStates = [child.groupedStates(columns, mask, groups, len(terms)) for child in self.children]
+        return [int(mask.sum()), {_termKey(term): [int(count), [states[position] for states in childStates]]
+                                  for position, (term, count) in enumerate(zip(terms, counts))}]
+
+    def update(self, state, values, sign):
+        value = values[self.field]
+        if np.isnan(value):
+            return
+        term = _termKey(value)
+        if term not in state[1]:
+            state[1][term] = [0, [child.emptyState() for child in self.children]]
+        bucket = state[1][term]
+        state[0] += sign
+        bucket[0] += sign
+        for child, childState in zip(self.children, bucket[1]):
+            child.update(childState, values, sign)
+        if bucket[0] == 0:
+            del state[1][term]
+
+    def render(self, state):
+        total, terms = state
+        top = sorted(terms.items(), key=lambda item: (-item[1][0], item[0]))[:self.size]
+        buckets = []
+        for term, (docCount, childStates) in top:
+            bucket = {"key": term, "doc_count": docCount}
+            for child, childState in zip(self.children, childStates):
+                bucket[child.name] = child.render(childState)
+            buckets.append(bucket)
+        return {"doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": total - sum(docCount for _, (docCount, _) in top),
+                "buckets": buckets}
+
+
+def parseAggregations(aggs):
+    """Parse the "aggs" of a search body into aggregation objects.
+
+    Raises:
+        ValueError: if an aggregation is not supported.
+    """
+    aggregations = []
+    for name, spec in aggs.items():
+        children = parseAggregations(spec.get("aggs", spec.get("aggregations", {})))
+        kinds = [kind for kind in spec if kind not in ("aggs", "aggregations", "meta")]
+        if len(kinds) != 1:
+            raise ValueError(f"The aggregation {name} should have a single type")
+        kind = kinds[0]
+        if kind == "range":
+            aggregations.append(RangeAggregation(name, spec[kind], children))
+        elif kind == "terms":
+            aggregations.append(TermsAggregation(name, spec[kind], children))
+        elif kind in MetricAggregation.KINDS and not children:
+            aggregations.append(MetricAggregation(name, kind, spec[kind]))
+        else:
+            raise ValueError(f"The {kind} aggregation {name} can not be materialized")
+    return aggregations
+
+
+class AggregationSnapshot:
+    """The aggregations of a canned query, over columns holding the recipes that match its query."""
+
+    def __init__(self, queryNumber, body):
+        self.queryNumber = queryNumber
+        self.query = body.get("query")
+        self.aggregations = parseAggregations(body["aggs"])
+        self.fields = sorted(set().union(*(aggregation.fields for aggregation in self.aggregations)))
+        # Identifies the query, a snapshot saved for another version of it is not loaded
+        self.version = hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+        self.recipeIds = np.empty(0, dtype=np.int64)
+        self.columns = {field: np.empty(0) for field in self.fields}
+        self.present = np.empty(0, dtype=bool)
+        self.size = 0
+        self.positions = {}
+        self.states = None
+        self.rendered = None
+        self.builtAt = None
+        self.refreshedAt = None
+        self.lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.states is not None
+
+    @property
+    def numRecipes(self):
+        return int(self.present[:self.size].sum())
+
+    def response(self):
+        """The response of /api/elasticsearch/queries for the query, None until the snapshot is built."""
+        with self.lock:
+            if self.states is None:
+                return None
+            if self.rendered is None:
+                self.rendered = {"aggregations": {aggregation.name: aggregation.render(state)
+                                                  for aggregation, state in zip(self.aggregations, self.states)}}
+            return self.rendered
+
+    def build(self, documents, exportedAt=None):
+        """Replace the content of the snapshot with the documents matching the query.
+
+        Args:
+            documents: iterable of the _source of the matching recipes, with RecipeId and the aggregated fields.
+            exportedAt: when the export started, the next refresh looks for the changes after it.
+        """
+        recipeIds = []
+        values = {field: [] for field in self.fields}
+        for document in documents:
+            recipeIds.append(document[ELASTIC_ID_FIELD])
+            for field in self.fields:
+                values[field].append(_number(document.get(field)))
+        exportedAt = exportedAt or _now()
+        self._load(np.asarray(recipeIds, dtype=np.int64),
+                   {field: np.asarray(column, dtype=np.float64) for field, column in values.items()},
+                   exportedAt, exportedAt)
+
+    def apply(self, recipeIds, documents):
+        """Update the snapshot for changed recipes.
+
+        Args:
+            recipeIds: the ids of the changed recipes.
+            documents: the _source of those of them that match the query now. The others are removed.
+        """
+        documents = {document[ELASTIC_ID_FIELD]: document for document in documents}
+        with self.lock:
+            for recipeId in recipeIds:
+                position = self.positions.get(recipeId)
+                if position is not None and self.present[position]:
+                    self._update(position, -1)
+                    self.present[position] = False
+                document = documents.get(recipeId)
+                if document is None:
+                    continue
+                if position is None:
+                    position = self._append(recipeId)
+                for field in self.fields:
+                    self.columns[field][position] = _number(document.get(field))
+                self.present[position] = True
+                self._update(position, 1)
+            self.rendered = None
+
+    def markRefreshed(self, refreshedAt):
+        self.refreshedAt = refreshedAt
+
+    def save(self, path):
+        """Save the columns of the snapshot in a numpy .npz file."""
+        with self.lock:
+            present = self.present[:self.size]
+            arrays = {"recipeIds": self.recipeIds[:self.size][present],
+                      **{f"column:{field}": column[:self.size][present] for field, column in self.columns.items()}}
+            metadata = {"version": self.version, "builtAt": self.builtAt, "refreshedAt": self.refreshedAt}
+        temporary = path + ".tmp.npz"
+        np.savez(temporary, metadata=np.array(json.dumps(metadata)), **arrays)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """Load a snapshot saved by save(). Returns False if there is none for this version of the query."""
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as saved:
+            metadata = json.loads(str(saved["metadata"]))
+            if metadata["version"] != self.version:
+                return False
+            self._load(saved["recipeIds"], {field: saved[f"column:{field}"] for field in self.fields},
+                       metadata["builtAt"], metadata["refreshedAt"])
+        return True
+
+    def _load(self, recipeIds, columns, builtAt, refreshedAt):
+        present = np.ones(len(recipeIds), dtype=bool)
+        states = [aggregation.state(columns, present) for aggregation in self.aggregations]
+        positions = {int(recipeId): position for position, recipeId in enumerate(recipeIds.tolist())}
+        with self.lock:
+            self.recipeIds = recipeIds
+            self.columns = columns
+            self.present = present
+            self.size = len(recipeIds)
+            self.positions = positions
+            self.states = states
+            self.rendered = None
+            self.builtAt = builtAt
+            self.refreshedAt = refreshedAt
+
+    def _update(self, position, sign):
+        values = {field: column[position] for field, column in self.columns.items()}
+        for aggregation, state in zip(self.aggregations, self.states):
+            aggregation.update(state, values, sign)
+
+    def _append(self, recipeId):
+        """Add a row for a new recipe, growing the columns geometrically."""
+        if self.size == len(self.recipeIds):
+            capacity = max(16, 2 * self.size)
+            self.recipeIds = _grow(self.recipeIds, capacity, 0)
+            self.present = _grow(self.present, capacity, False)
+            self.columns = {field: _grow(column, capacity, np.nan) for field, column in self.columns.items()}
+        position = self.size
+        self.recipeIds[position] = recipeId
+        self.positions[recipeId] = position
+        self.size += 1
+        return position
+
+
+class MaterializedQueries:
+    """The snapshots of some canned queries, built and refreshed in the background from ElasticSearch.
+
+    Until its first build is done, a query has no snapshot and is answered by ElasticSearch.
+    """
+
+    def __init__(self, es, queries, refreshSeconds=300, rebuildSeconds=86400, directory=None, changeField=None):
+        """
+        Args:
+            es: an ElasticSearch client (synchronous, it is used from a background thread).
+            queries: dictionary from query number to the search body of the canned query.
+            refreshSeconds: age after which a snapshot is refreshed with the changed recipes.
+            rebuildSeconds: age after which a snapshot is rebuilt from scratch.
+            directory: optional directory where the snapshots are saved, and loaded from at startup.
+            changeField: optional date field set by the ingestion when it indexes a recipe, used to find the
+              recipes changed since the previous refresh. Without it only the recipes pushed to refresh()
+              are refreshed.
+        """
+        self.es = es
+        self.snapshots = {queryNumber: AggregationSnapshot(queryNumber, body) for queryNumber, body in queries.items()}
+        self.refreshSeconds = refreshSeconds
+        self.rebuildSeconds = rebuildSeconds
+        self.directory = directory
+        self.changeField = changeField
+        self.lock = threading.Lock()
+        # Serializes the builds and the refreshes, so that a pushed change is applied after a running build
+        self.updateLock = threading.Lock()
+        # Recipes pushed while a build or a refresh was running
+        self.pending = set()
+        self.running = False
+        self.checkedAt = None
+        self.rebuiltAt = None
+        self.errors = 0
+        if directory is not None:
+            for snapshot in self.snapshots.values():
+                snapshot.load(self._path(snapshot))
+
+    def response(self, queryNumber):
+        """The materialized response of the query, or None if it is not materialized or not built yet.
+
+        Starts a background build or refresh when the snapshots are missing or old.
+        """
+        snapshot = self.snapshots.get(queryNumber)
+        if snapshot is None:
+            return None
+        self._maybeRefresh()
+        return snapshot.response()
+
+    def build(self):
+        """Export every snapshot from ElasticSearch."""
+        with self.updateLock:
+            for snapshot in self.snapshots.values():
+                exportedAt = _now()
+                snapshot.build(_scan(self.es, _filter(snapshot.query), [ELASTIC_ID_FIELD, *snapshot.fields]), exportedAt)
+                self._save(snapshot)
+            self.rebuiltAt = time.monotonic()
+        self._applyPending()
+
+    def refresh(self, recipeIds=None):
+        """Re-export the changed recipes and update the snapshots with them, after the running build or refresh.
+
+        Args:
+            recipeIds: the ids of the recipes indexed, updated or deleted by the ingestion. By default the
+              recipes whose changeField is after the previous refresh are asked to ElasticSearch.
+
+        Returns:
+            The number of changed recipes applied to the snapshots.
+        """
+        if recipeIds is None and self.changeField is None:
+            return 0
+        with self.updateLock:
+            applied = self._refresh(recipeIds)
+        self._applyPending()
+        return applied
+
+    def push(self, recipeIds):
+        """Refresh the snapshots with the recipes changed by the ingestion, without waiting for a running build.
+
+        The recipes are applied now, or when the running build or refresh is done.
+        """
+        with self.lock:
+            self.pending.update(recipeIds)
+        self._applyPending()
+
+    def _applyPending(self):
+        while True:
+            if not self.updateLock.acquire(blocking=False):
+                # The build or refresh running applies them when it is done
+                return
+            try:
+                with self.lock:
+                    recipeIds, self.pending = list(self.pending), set()
+                try:
+                    if recipeIds:
+                        self._refresh(recipeIds)
+                except Exception:
+                    with self.lock:
+                        self.pending.update(recipeIds)
+                    raise
+            finally:
+                self.updateLock.release()
+            with self.lock:
+                if not self.pending:
+                    return
+
+    def _refresh(self, recipeIds):
+        """refresh(), with the update lock held."""
+        applied = 0
+        for snapshot in self.snapshots.values():
+            if not snapshot.ready:
+                # The build exports every recipe
+                continue
+            startedAt = _now()
+            changed = (recipeIds if recipeIds is not None
+                       else changedRecipeIds(self.es, self.changeField, snapshot.refreshedAt))
+            changed = list(dict.fromkeys(changed))
+            applied += len(changed)
+            for start in range(0, len(changed), REFRESH_BATCH_SIZE):
+                batch = changed[start:start + REFRESH_BATCH_SIZE]
+                query = _filter(snapshot.query, {"terms": {ELASTIC_ID_FIELD: batch}})
+                snapshot.apply(batch, _scan(self.es, query, [ELASTIC_ID_FIELD, *snapshot.fields]))
+            if recipeIds is None:
+                snapshot.markRefreshed(startedAt)
+            if changed:
+                self._save(snapshot)
+        return applied
+
+    def statistics(self):
+        """The size and the age of each snapshot, the number of failed builds and refreshes and of pushed recipes
+        waiting for a running build."""
+        return {"errors": self.errors,
+                "pending": len(self.pending),
+                "snapshots": {str(queryNumber): {"ready": snapshot.ready, "recipes": snapshot.numRecipes,
+                                                 "builtAt": snapshot.builtAt, "refreshedAt": snapshot.refreshedAt}
+                              for queryNumber, snapshot in self.snapshots.items()}}
+
+    def _maybeRefresh(self):
+        now = time.monotonic()
+        with self.lock:
+            # A failed build is retried after refreshSeconds too, not on every request
+            if self.running or (self.checkedAt is not None and now - self.checkedAt < self.refreshSeconds):
+                return
+            self.running = True
+            self.checkedAt = now
+        rebuild = (not all(snapshot.ready for snapshot in self.snapshots.values())
+                   or (self.rebuildSeconds is not None and self.rebuiltAt is not None
+                       and now - self.rebuiltAt > self.rebuildSeconds))
+        if self.rebuiltAt is None and not rebuild:
+            # Loaded from the directory: the age of the rebuild starts now
+            self.rebuiltAt = now
+        if not rebuild and self.changeField is None:
+            # Nothing to look for, the changes are pushed to refresh()
+            self.running = False
+            return
+
+        def run():
+            try:
+                if rebuild:
+                    self.build()
+                else:
+                    self.refresh()
+            except Exception:
+                # ElasticSearch answers the queries meanwhile, the snapshots are not an error of the requests
+                self.errors += 1
+            finally:
+                self.running = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _save(self, snapshot):
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            snapshot.save(self._path(snapshot))
+
+    def _path(self, snapshot):
+        return os.path.join(self.directory, f"query{snapshot.queryNumber}.npz")
+
+
+def pushedRecipeIds(body):
+    """Read the ids of the changed recipes pushed by the ingestion, as the JSON object {"recipeIds": [...]}.
+
+    Raises:
+        ValueError: if the ids are missing, are not integers or are too many.
+    """
+    if not isinstance(body, dict) or not isinstance(body.get('recipeIds'), list):
+        raise ValueError("No recipeIds found")
+    recipeIds = body['recipeIds']
+    if any(not isinstance(recipeId, int) or isinstance(recipeId, bool) for recipeId in recipeIds):
+        raise ValueError("The recipeIds should be integers")
+    if len(recipeIds) > MAX_PUSHED_RECIPES:
+        raise ValueError(f"Too many recipeIds, the maximum is {MAX_PUSHED_RECIPES}")
+    return recipeIds
+
+
+def changedRecipeIds(es, changeField, since):
+    """The ids of the recipes whose changeField, the date the ingestion indexed them, is after an ISO 8601 date."""
+    since = (datetime.fromisoformat(since) - timedelta(seconds=REFRESH_OVERLAP_SECONDS)).isoformat()
+    query = {"range": {changeField: {"gte": since}}}
+    return [document[ELASTIC_ID_FIELD] for document in _scan(es, query, [ELASTIC_ID_FIELD])]
+
+
+def scanHits(es, query, source=True):
+    """Every hit of the recipes matching the query, paged with search_after on the recipe id.
+
+    Args:
+        es: an ElasticSearch client.
+        query: the query of the search.
+        source: the _source filter of the hits, the whole recipes by default.
+    """
+    body = {"query": query, "_source": source, "sort": [{ELASTIC_ID_FIELD: "asc"}], "size": EXPORT_PAGE_SIZE}
+    searchAfter = None
+    while True:
+        page = body if searchAfter is None else {**body, "search_after": searchAfter}
+        hits = es.search(index=INDEX, body=page, request_timeout=EXPORT_REQUEST_TIMEOUT_SECONDS)['hits']['hits']
+        yield from hits
+        if len(hits) < EXPORT_PAGE_SIZE:
+            return
+        searchAfter = hits[-1]['sort']
+
+
+def _scan(es, query, fields):
+    """The _source of every recipe matching the query, with the given fields."""
+    for hit in scanHits(es, query, {"includes": list(fields)}):
+        yield hit['_source']
+
+
+def _filter(query, *clauses):
+    """A query matching the documents of the query (all of them for None), without scoring them."""
+    filters = ([query] if query is not None else []) + list(clauses)
+    return {"bool": {"filter": filters}} if filters else {"match_all": {}}
+
+
+def _number(value):
+    return np.nan if value is None else float(value)
+
+
+def _termKey(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _rangeKey(start, end):
+    return f"{'*' if start is None else float(start)}-{'*' if end is None else float(end)}"
+
+
+def _grow(array, capacity, fill):
+    grown = np.full(capacity, fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
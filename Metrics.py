@@ -0,0 +1,478 @@
+"""Per-request timing instrumentation, Prometheus metrics and slow query log.
+
+Every request gets a RequestTimer, kept in a context variable so that the database wrappers below can add
+the time of their calls to it without being handed the request. The phases are reported in the
+Server-Timing header of the response:
+
+    Server-Timing: neo4j;dur=12.41, encode;dur=0.80, app;dur=1.12, total;dur=14.33
+
+where "app" is the time not spent in any measured phase (parsing the request, building the result lists).
+The durations and the errors are also aggregated per route, and per canned query number, and rendered in the
+Prometheus text format by the /metrics route. The aggregates are kept in memory by each worker process.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Route whose requests are also aggregated by their queryNumber
+CANNED_QUERY_ROUTE = "/api/elasticsearch/queries"
+
+METRICS = {
+    "tastetrios_requests_total": ("counter", "Requests answered, by route, method and status."),
+    "tastetrios_request_duration_seconds": ("histogram", "Time to answer a request, by route and method."),
+    "tastetrios_request_errors_total": ("counter", "Requests answered with a 5xx status, by route and exception type."),
+    "tastetrios_phase_seconds_total": ("counter", "Time spent in each phase of the requests, by route."),
+    "tastetrios_canned_query_duration_seconds": ("histogram", "Time to answer a canned ElasticSearch query, by queryNumber."),
+    "tastetrios_canned_query_errors_total": ("counter", "Canned ElasticSearch queries answered with a 5xx status, by queryNumber."),
+    "tastetrios_query_cache_hits_total": ("counter", "Hits of the canned queries cache."),
+    "tastetrios_query_cache_misses_total": ("counter", "Misses of the canned queries cache."),
+    "tastetrios_replica_searches_total": ("counter", "Searches answered by the local replica of the index, by reason."),
+}
+
+slowQueryLog = logging.getLogger("slowQueries")
+slowQuerySeconds = None
+
+_currentTimer = contextvars.ContextVar("requestTimer", default=None)
+
+
+class RequestTimer:
+    """Durations of the phases of one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.exception = None
+        # The hybrid search queries both backends from worker threads
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def serverTiming(self, total):
+        """Value of the Server-Timing header, in milliseconds."""
+        with self.lock:
+            phases = dict(self.phases)
+        # Phases running concurrently (the hybrid search) can add up to more than the total
+        phases["app"] = max(total - sum(phases.values()), 0.0)
+        phases["total"] = total
+        return ", ".join(f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in phases.items())
+
+
+class Histogram:
+    """Cumulative histogram of durations, with the Prometheus bucket semantics (value <= upper bound)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(labels + (('le', _bound(bound)),))} {cumulative}"
+        yield f"{name}_sum{_labels(labels)} {self.sum!r}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+
+class MetricsRegistry:
+    """Counters and histograms of the requests, keyed by metric name and label values."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, labels, amount=1):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if labels not in series:
+                series[labels] = Histogram(self.buckets)
+            series[labels].observe(value)
+
+    def recordRequest(self, route, method, status, seconds, phases, exception=None, queryNumber=None):
+        """Aggregate a finished request.
+
+        Args:
+            route: the URL rule of the route, e.g. "/api/neo4j/matchIngredients".
+            method: the HTTP method.
+            status: the status code of the response.
+            seconds: the time to answer the request.
+            phases: dictionary from phase name to its duration in seconds.
+            exception: name of the exception type of a failed request.
+            queryNumber: the canned query number, for the canned queries route.
+        """
+        self.increment("tastetrios_requests_total", (("route", route), ("method", method), ("status", str(status))))
+        self.observe("tastetrios_request_duration_seconds", (("route", route), ("method", method)), seconds)
+        for phase, duration in phases.items():
+            self.increment("tastetrios_phase_seconds_total", (("route", route), ("phase", phase)), duration)
+        if status >= 500:
+            self.increment("tastetrios_request_errors_total",
+                           (("route", route), ("method", method), ("exception", exception or "none")))
+        if queryNumber is not None:
+            self.observe("tastetrios_canned_query_duration_seconds", (("queryNumber", queryNumber),), seconds)
+            if status >= 500:
+                self.increment("tastetrios_canned_query_errors_total", (("queryNumber", queryNumber),))
+
+    def render(self, queryCache=None):
+        """The metrics in the Prometheus text exposition format.
+
+        Args:
+            queryCache: optional CannedQueryCache whose hit and miss counters are exported too.
+        """
+        counters = {}
+        with self.lock:
+            for name, series in self.counters.items():
+                counters[name] = dict(series)
+            histograms = {name: {labels: list(histogram.samples(name, labels)) for labels, histogram in series.items()}
+                          for name, series in self.histograms.items()}
+        if queryCache is not None:
+            statistics = queryCache.statistics()
+            counters["tastetrios_query_cache_hits_total"] = {(): statistics["hits"]}
+            counters["tastetrios_query_cache_misses_total"] = {(): statistics["misses"]}
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            if name not in counters and name not in histograms:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(counters.get(name, {}).items()):
+                lines.append(f"{name}{_labels(labels)} {value!r}")
+            for labels, samples in sorted(histograms.get(name, {}).items()):
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of this worker process
+metrics = MetricsRegistry()
+
+
+def configureSlowQueryLog(thresholdMs, path=None):
+    """Log the database calls taking more than thresholdMs milliseconds, with their query and parameters.
+
+    Args:
+        thresholdMs: threshold in milliseconds, 0 or None disables the log.
+        path: optional file where the log is appended, one JSON object per line. By default the records go
+          through the logging configuration of the server.
+    """
+    global slowQuerySeconds
+    slowQuerySeconds = thresholdMs / 1000 if thresholdMs else None
+    if slowQuerySeconds is not None and path:
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        slowQueryLog.addHandler(handler)
+        slowQueryLog.propagate = False
+
+
+def startRequest():
+    """Start timing the current request."""
+    _currentTimer.set(RequestTimer())
+
+
+def finishRequest(request, response):
+    """Add the Server-Timing header to the response of the current request and aggregate its metrics.
+
+    Streamed responses are measured up to their headers.
+    """
+    timer = _currentTimer.get()
+    if timer is None:
+        return response
+    total = time.perf_counter() - timer.start
+    response.headers["Server-Timing"] = timer.serverTiming(total)
+
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    queryNumber = None
+    if route == CANNED_QUERY_ROUTE and response.status_code != 400:
+        try:
+            queryNumber = str(int(request.args.get("queryNumber")))
+        except (TypeError, ValueError):
+            pass
+    with timer.lock:
+        phases = dict(timer.phases)
+    metrics.recordRequest(route, request.method, response.status_code, total, phases, timer.exception, queryNumber)
+    return response
+
+
+def recordException(exception):
+    """Note the type of the exception that failed the current request, for the error counters."""
+    timer = _currentTimer.get()
+    if timer is not None:
+        timer.exception = type(exception).__name__
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to the phase of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer = _currentTimer.get()
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - start)
+
+
+def timeEncoding(app):
+    """Count the JSON encoding of the responses of the app (jsonify) in the "encode" phase."""
+    response = app.json.response
+
+    def timedResponse(*args, **kwargs):
+        with timed("encode"):
+            return response(*args, **kwargs)
+
+    app.json.response = timedResponse
+
+
+def logSlowQuery(backend, seconds, query, parameters):
+    """Record a database call in the slow query log when it took longer than the threshold."""
+    if slowQuerySeconds is None or seconds < slowQuerySeconds:
+        return
+    slowQueryLog.warning(json.dumps({"backend": backend, "durationMs": round(seconds * 1000, 1), "query": query,
+                                     "parameters": parameters}, default=str))
+
+
+class InstrumentedDriver:
+    """Neo4j driver wrapper timing the queries of its sessions in the "neo4j" phase.
+
+    The records are streamed from the server while the result is consumed, so the time of the run and of
+    the consumption of the result (data(), single() or the iteration) are added up.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def session(self, **kwargs):
+        return InstrumentedSession(self.driver.session(**kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class InstrumentedSession:
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        self.session.__enter__()
+        return self
+
+    def __exit__(self, *exception):
+        return self.session.__exit__(*exception)
+
+    def run(self, query, parameters=None, **kwargs):
+        start = time.perf_counter()
+        with timed("neo4j"):
+            result = self.session.run(query, parameters, **kwargs)
+        # A query can also be a neo4j.Query, with its text and a transaction timeout
+        return InstrumentedResult(result, getattr(query, "text", query), {**(parameters or {}), **kwargs},
+                                  time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class InstrumentedResult:
+    def __init__(self, result, query, parameters, elapsed):
+        self.result = result
+        self.query = query
+        self.parameters = parameters
+        self.elapsed = elapsed
+
+    def data(self, *keys):
+        return self._consume(lambda: self.result.data(*keys))
+
+    def single(self, *args, **kwargs):
+        return self._consume(lambda: self.result.single(*args, **kwargs))
+
+    def __iter__(self):
+        records = iter(self.result)
+        while True:
+            start = time.perf_counter()
+            with timed("neo4j"):
+                record = next(records, None)
+            self.elapsed += time.perf_counter() - start
+            if record is None:
+                logSlowQuery("neo4j", self.elapsed, self.query, self.parameters)
+                return
+            yield record
+
+    def _consume(self, consume):
+        start = time.perf_counter()
+        with timed("neo4j"):
+            value = consume()
+        self.elapsed += time.perf_counter() - start
+        logSlowQuery("neo4j", self.elapsed, self.query, self.parameters)
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+
+class InstrumentedElasticsearch:
+    """ElasticSearch client wrapper timing search and msearch in the "elasticsearch" phase."""
+
+    def __init__(self, es):
+        self.es = es
+
+    def search(self, *args, **kwargs):
+        return self._timed(self.es.search, args, kwargs)
+
+    def msearch(self, *args, **kwargs):
+        return self._timed(self.es.msearch, args, kwargs)
+
+    def pinned(self):
+        """The instrumented pinned client of a SearchReplica.ReplicaSearchClient, or this client for the others."""
+        pinned = getattr(self.es, "pinned", None)
+        return self if pinned is None else InstrumentedElasticsearch(pinned())
+
+    def _timed(self, method, args, kwargs):
+        start = time.perf_counter()
+        with timed("elasticsearch"):
+            result = method(*args, **kwargs)
+        _logSlowSearch(method.__name__, time.perf_counter() - start, args, kwargs)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.es, name)
+
+
+class InstrumentedAsyncDriver:
+    """Async version of InstrumentedDriver, for an AsyncDriver."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def session(self, **kwargs):
+        return InstrumentedAsyncSession(self.driver.session(**kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class InstrumentedAsyncSession:
+    def __init__(self, session):
+        self.session = session
+
+    async def __aenter__(self):
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, *exception):
+        return await self.session.__aexit__(*exception)
+
+    async def run(self, query, parameters=None, **kwargs):
+        start = time.perf_counter()
+        with timed("neo4j"):
+            result = await self.session.run(query, parameters, **kwargs)
+        return InstrumentedAsyncResult(result, getattr(query, "text", query), {**(parameters or {}), **kwargs},
+                                       time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class InstrumentedAsyncResult:
+    def __init__(self, result, query, parameters, elapsed):
+        self.result = result
+        self.query = query
+        self.parameters = parameters
+        self.elapsed = elapsed
+
+    async def data(self, *keys):
+        return await self._consume(self.result.data(*keys))
+
+    async def single(self, *args, **kwargs):
+        return await self._consume(self.result.single(*args, **kwargs))
+
+    async def __aiter__(self):
+        records = self.result.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                with timed("neo4j"):
+                    record = await records.__anext__()
+            except StopAsyncIteration:
+                self.elapsed += time.perf_counter() - start
+                logSlowQuery("neo4j", self.elapsed, self.query, self.parameters)
+                return
+            self.elapsed += time.perf_counter() - start
+            yield record
+
+    async def _consume(self, consume):
+        start = time.perf_counter()
+        with timed("neo4j"):
+            value = await consume
+        self.elapsed += time.perf_counter() - start
+        logSlowQuery("neo4j", self.elapsed, self.query, self.parameters)
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+
+class InstrumentedAsyncElasticsearch:
+    """Async version of InstrumentedElasticsearch, for an AsyncElasticsearch client."""
+
+    def __init__(self, es):
+        self.es = es
+
+    async def search(self, *args, **kwargs):
+        return await self._timed(self.es.search, args, kwargs)
+
+    async def msearch(self, *args, **kwargs):
+        return await self._timed(self.es.msearch, args, kwargs)
+
+    def pinned(self):
+        pinned = getattr(self.es, "pinned", None)
+        return self if pinned is None else InstrumentedAsyncElasticsearch(pinned())
+
+    async def _timed(self, method, args, kwargs):
+        start = time.perf_counter()
+        with timed("elasticsearch"):
+            result = await method(*args, **kwargs)
+        _logSlowSearch(method.__name__, time.perf_counter() - start, args, kwargs)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.es, name)
+
+
+def _logSlowSearch(method, seconds, args, kwargs):
+    parameters = dict(kwargs)
+    body = parameters.pop("body", args[0] if args else None)
+    logSlowQuery("elasticsearch", seconds, body, {"method": method, **parameters})
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class MixAndMaxIndex:
+    """Ingredient co-occurrence engine that answers /api/neo4j/mixAndMax from a RecipeGraph.
+
+    It reproduces the statistics of the mixAndMax Cypher query. For a set P of provided ingredients, let
+    k(r) be the number of ingredients of P contained in the recipe r. Only recipes with k(r) > 0 and at
+    least one review are considered. For every other ingredient m of those recipes:
+      - recipeCount is the number of such recipes that contain m;
+      - avgOfAvgRatings is the average of the recipes' average rating, weighted by k(r);
+      - IngredientCompatibility is the average of k(r), weighted by k(r).
+    The weighting by k(r) comes from the last MATCH of the query, which repeats each recipe row once per
+    provided ingredient it contains.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.reviewed = graph.reviewCounts > 0
+
+    def query(self, ingredients, limit=None):
+        """Compute the mixAndMax statistics for a list of ingredients.
+
+        Args:
+            ingredients: list of the provided ingredient names.
+            limit: maximum number of results to return.
+
+        Returns:
+            A list of objects with the keys "matchedIngredient", "recipeCount", "avgOfAvgRatings" and
+            "IngredientCompatibility", sorted by IngredientCompatibility * log10(recipeCount) descending.
+
+        Raises:
+            ValueError: if the limit is negative, which the Cypher LIMIT rejects too.
+        """
+        if limit is not None and limit < 0:
+            raise ValueError("Limit should be greater than 0")
+        graph = self.graph
+        provided = graph.toPositions(ingredients)
+        if len(provided) == 0:
+            return []
+
+        # Number of provided ingredients in each recipe
+        matches = np.zeros(graph.numRecipes, dtype=np.int64)
+        for position in provided:
+            matches[graph.postings(position)] += 1
+
+        recipes = np.flatnonzero((matches > 0) & self.reviewed)
+        rows, cols = graph.gatherIngredients(recipes)
+
+        isProvided = np.zeros(graph.numIngredients, dtype=bool)
+        isProvided[provided] = True
+        keep = ~isProvided[cols]
+        rows, cols = rows[keep], cols[keep]
+
+        weights = matches[rows].astype(np.float64)
+        ratings = graph.avgRatings[rows]
+        rated = ~np.isnan(ratings)
+
+        n = graph.numIngredients
+        recipeCount = np.bincount(cols, minlength=n)
+        weightSum = np.bincount(cols, weights=weights, minlength=n)
+        compatibility = np.divide(np.bincount(cols, weights=weights * weights, minlength=n), weightSum,
+                                  out=np.zeros(n), where=weightSum > 0)
+        ratedWeightSum = np.bincount(cols[rated], weights=weights[rated], minlength=n)
+        avgRating = np.divide(np.bincount(cols[rated], weights=weights[rated] * ratings[rated], minlength=n),
+                              ratedWeightSum, out=np.full(n, np.nan), where=ratedWeightSum > 0)
+
+        matched = np.flatnonzero(recipeCount)
+        score = compatibility[matched] * np.log10(recipeCount[matched])
+        # Sort by score descending, ties by name to keep the output deterministic
+        names = [graph.ingredientNames[position] for position in matched]
+        order = sorted(range(len(matched)), key=lambda j: (-score[j], names[j]))
+        if limit is not None:
+            order = order[:limit]
+
+        return [{"matchedIngredient": names[j],
+                 "recipeCount": int(recipeCount[matched[j]]),
+                 "avgOfAvgRatings": None if np.isnan(avgRating[matched[j]]) else float(avgRating[matched[j]]),
+                 "IngredientCompatibility": float(compatibility[matched[j]])}
+                for j in order]
@@ -0,0 +1,59 @@
+"""Cypher queries of the Neo4j routes, shared by the Flask app and the async app."""
+
+SAMPLE_NODES = "MATCH (n) RETURN n LIMIT 5"
+
+CHECK_INGREDIENT = "MATCH (n:Ingredient) WHERE n.name = $ingredient RETURN n"
+
+# The optional " LIMIT {limit}" is appended to the query
+MATCH_INGREDIENTS = """
+                MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
+                WHERE i.name IN $ingredients
+                WITH r, count(i) AS matchingScore, COLLECT(i.name) AS matchingIngredients
+                RETURN r, matchingScore, matchingIngredients ORDER BY matchingScore DESC
+                """
+
+GET_INGREDIENTS = """
+                MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
+                WHERE r.id = $recipe
+                RETURN COLLECT(i.name) AS ingredients
+                """
+
+# The optional " LIMIT {limit}" is appended to the query
+MIX_AND_MAX = """
+                WITH $providedIngredients AS ingredients
+                // Find recipes that contain an existing ingredient and additional matched ingredients
+                MATCH (i:Ingredient)<-[:CONTAINS]-(r:Recipe)-[:CONTAINS]->(i1:Ingredient)
+                WHERE i.name IN ingredients AND NOT i1.name IN ingredients
+                WITH DISTINCT r, i1.name AS matchedIngredient, ingredients, COUNT(distinct i) as availableMatchedIngredients
+
+                // Match reviews for these recipes and calculate the average rating for each matched recipe
+                MATCH (r)<-[:FOR]-(rev:Review)
+                WITH matchedIngredient, r, AVG(rev.rating) AS avgRating, ingredients, availableMatchedIngredients
+
+                // Count the number of unique recipes for each matched ingredient
+                MATCH (r)-[:CONTAINS]->(i:Ingredient)
+                WHERE i.name IN ingredients
+                RETURN matchedIngredient, COUNT(DISTINCT r) AS recipeCount, AVG(avgRating) AS avgOfAvgRatings, AVG(availableMatchedIngredients) as IngredientCompatibility
+                ORDER BY IngredientCompatibility * log10(recipeCount) DESC
+                """
+
+# Keyset paginated version of MATCH_INGREDIENTS, the optional " LIMIT $limit" is appended to the query
+MATCH_INGREDIENTS_AFTER = """
+            MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
+            WHERE i.name IN $ingredients
+            WITH r, count(i) AS matchingScore, COLLECT(i.name) AS matchingIngredients
+            WHERE $afterScore IS NULL OR matchingScore < $afterScore OR (matchingScore = $afterScore AND r.id > $afterId)
+            RETURN r, matchingScore, matchingIngredients ORDER BY matchingScore DESC, r.id ASC
+            """
+
+CHECK_INGREDIENTS = """
+            UNWIND $items AS ingredient
+            OPTIONAL MATCH (n:Ingredient) WHERE n.name = ingredient
+            RETURN ingredient, COUNT(n) > 0 AS exists
+            """
+
+GET_RECIPES_INGREDIENTS = """
+            UNWIND $items AS recipe
+            OPTIONAL MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient) WHERE r.id = recipe
+            RETURN recipe, COLLECT(i.name) AS ingredients
+            """
@@ -0,0 +1,94 @@
+"""Selection of the recipe fields returned by the routes.
+
+A projection has the shape of the ElasticSearch _source filter, {"includes": [...]} or {"excludes": [...]},
+and None returns the whole recipe. It is pushed down to the databases, so that the fields left out are
+neither read nor transferred: as _source filtering in ElasticSearch and as a map projection in Cypher.
+"""
+import json
+import re
+
+# Named projections, used when the request does not list the fields
+VIEWS = {
+    # What a recipe card of the search results shows
+    "card": {"includes": ["RecipeId", "Name", "AggregatedRating", "ReviewCount", "TotalTime", "RecipeCategory", "Images"]},
+    # The recipe page: everything but the reviews, which are the bulk of the documents
+    "detail": {"excludes": ["Reviews"]},
+    "full": None,
+}
+
+# Fields always returned, because the pagination and the hybrid search join on them
+ELASTIC_ID_FIELD = "RecipeId"
+NEO4J_ID_PROPERTY = "id"
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+def parseProjection(fields=None, view=None):
+    """Read the projection of a request.
+
+    Args:
+        fields: list of field names, or a string of comma separated field names. Dotted names select nested
+            fields in ElasticSearch (e.g. "Reviews.Rating").
+        view: name of one of the VIEWS, used when fields is not given.
+
+    Returns:
+        The projection, or None for the whole recipe.
+
+    Raises:
+        ValueError: if a field name or the view is invalid.
+    """
+    if fields is not None:
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(",") if field.strip()]
+        if not isinstance(fields, list) or not fields:
+            raise ValueError("The fields should be a non empty list of field names")
+        for field in fields:
+            if not isinstance(field, str) or not FIELD_PATTERN.match(field):
+                raise ValueError(f"Invalid field name: {field}")
+        return {"includes": list(dict.fromkeys(fields))}
+    if view is not None:
+        if view not in VIEWS:
+            raise ValueError(f"Unknown view, it should be one of {', '.join(VIEWS)}")
+        return VIEWS[view]
+    return None
+
+
+def projectionFromRequest(request, body=None):
+    """The projection asked with the "fields" and "view" keys of the JSON body or of the query string."""
+    if isinstance(body, dict) and ("fields" in body or "view" in body):
+        return parseProjection(body.get("fields"), body.get("view"))
+    return parseProjection(request.args.get("fields"), request.args.get("view"))
+
+
+def projectionKey(projection):
+    """A string identifying the projection, to tell apart the cached responses."""
+    return None if projection is None else json.dumps(projection, sort_keys=True, separators=(",", ":"))
+
+
+def withSourceFilter(body, projection):
+    """The ElasticSearch search body restricted to the fields of the projection."""
+    if projection is None:
+        return body
+    if "includes" in projection:
+        return {**body, "_source": {"includes": list(dict.fromkeys([ELASTIC_ID_FIELD, *projection["includes"]]))}}
+    return {**body, "_source": {"excludes": projection["excludes"]}}
+
+
+def cypherProjection(projection, variable="r"):
+    """The Cypher expression returning the properties of the projection of a node.
+
+    Only the includes are pushed down: the reviews are separate nodes in the graph, so the nodes have nothing
+    to exclude. Dotted names keep their first part.
+    """
+    if projection is None or "includes" not in projection:
+        return variable
+    properties = dict.fromkeys([NEO4J_ID_PROPERTY, *(field.split(".")[0] for field in projection["includes"])])
+    return variable + " {" + ", ".join(f".`{name}`" for name in properties) + "}"
+
+
+def withRecipeProjection(query, projection):
+    """Rewrite a query of Neo4jQueries that returns the recipe r first, to return only its projection."""
+    expression = cypherProjection(projection)
+    if expression == "r":
+        return query
+    return query.replace("RETURN r,", f"RETURN {expression} AS r,", 1)
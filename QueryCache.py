@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with a time to live and a memory bound.
+
+    The size of an entry is the length of its JSON encoding, computed once when it is stored.
+    """
+
+    def __init__(self, ttl=600, maxBytes=64 * 2 ** 20, maxEntries=1024):
+        """
+        Args:
+            ttl: number of seconds an entry stays valid.
+            maxBytes: maximum total size of the stored entries.
+            maxEntries: maximum number of stored entries.
+        """
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        """Returns the value stored for the key, or None if it is missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            value, size, expiresAt = entry
+            if time.monotonic() >= expiresAt:
+                self._remove(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def set(self, key, value):
+        size = len(json.dumps(value))
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.maxBytes:
+                return
+            self.entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.maxBytes or len(self.entries) > self.maxEntries:
+                self._remove(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+
+class SharedCacheBackend:
+    """Cache stored in a key-value store shared by all the workers.
+
+    The client must provide `get(key)` and `set(key, value, ex=ttl)` like redis-py. Values are stored as
+    JSON. Eviction is left to the store.
+    """
+
+    def __init__(self, client, ttl=600, prefix="tastetrios:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception:
+            # An unavailable store is a cache miss, not an error of the request
+            self.stats["errors"] += 1
+            return None
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except Exception:
+            self.stats["errors"] += 1
+
+    def clear(self):
+        pass
+
+
+class LocalKeyValueStore:
+    """Stand-in for a shared key-value store (e.g. Redis) for local development and benchmarks."""
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expiresAt = self.values.get(key, (None, None))
+            if expiresAt is not None and time.monotonic() >= expiresAt:
+                del self.values[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.values[key] = (value, None if ex is None else time.monotonic() + ex)
+
+
+def buildQueryCache(ttl, maxBytes, redisUrl=None):
+    """Create the cache of the canned queries: an in-process tier, followed by a Redis tier if configured.
+
+    Returns:
+        A CannedQueryCache, or None if the ttl is not positive (cache disabled).
+    """
+    if ttl <= 0:
+        return None
+    backends = [MemoryCacheBackend(ttl=ttl, maxBytes=maxBytes)]
+    if redisUrl:
+        import redis
+        backends.append(SharedCacheBackend(redis.Redis.from_url(redisUrl), ttl=ttl))
+    return CannedQueryCache(backends)
+
+
+class CannedQueryCache:
+    """Cache of the responses of the canned ElasticSearch queries.
+
+    The responses depend only on the query number, the limit and the projection of the recipes (the variant,
+    see Projection.projectionKey). For each query and variant the cache keeps the
+    response to the largest limit requested so far: a smaller limit is answered by slicing its recipes.
+    Aggregation responses do not depend on the limit and are cached as a whole.
+
+    The backends are tiers looked up in order, e.g. [MemoryCacheBackend(), SharedCacheBackend(redis)]:
+    a hit in a later tier is copied into the earlier ones.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, queryNumber, limit, variant=None):
+        """Returns the cached response for the query, or None if it has to be run."""
+        key = self._key(queryNumber, variant)
+        for tier, backend in enumerate(self.backends):
+            entry = backend.get(key)
+            if entry is not None and self._covers(entry, limit):
+                for previous in self.backends[:tier]:
+                    previous.set(key, entry)
+                self.stats["hits"] += 1
+                response = entry["response"]
+                if "recipes" in response:
+                    return {"recipes": response["recipes"][:limit]}
+                return response
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, queryNumber, limit, response, variant=None):
+        """Store the response of the query run with the given limit."""
+        key = self._key(queryNumber, variant)
+        entry = {"limit": limit, "response": response}
+        for backend in self.backends:
+            backend.set(key, entry)
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+    def statistics(self):
+        """Returns the hit and miss counters of the cache and of each tier."""
+        return {"hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "tiers": [{"backend": type(backend).__name__, **backend.stats} for backend in self.backends]}
+
+    @staticmethod
+    def _key(queryNumber, variant):
+        return f"query:{queryNumber}" if variant is None else f"query:{queryNumber}:{variant}"
+
+    @staticmethod
+    def _covers(entry, limit):
+        """Whether a cached entry contains the answer for the limit."""
+        response = entry["response"]
+        if "recipes" not in response:
+            return True
+        # Fewer recipes than the limit means that the query has no more results
+        return entry["limit"] >= limit or len(response["recipes"]) < entry["limit"]
@@ -0,0 +1,242 @@
+"""Parameterized templates of the canned ElasticSearch queries.
+
+A canned query of ElasticQueries.json can declare named parameters, and use them in its body as placeholders:
+a JSON string "{{name}}" is replaced by the value of the parameter, with its type (so a range bound stays a
+number). For example:
+
+    {
+        "queryNumber": 3,
+        "parameters": {
+            "ingredients": {"type": "terms", "default": "chicken onion cheese"},
+            "maxTotalTime": {"type": "integer", "default": 30, "min": 0}
+        },
+        "query": {"query": {"bool": {"must": [
+            {"match": {"RecipeIngredientParts": {"query": "{{ingredients}}", "operator": "and"}}},
+            {"range": {"TotalTime": {"lte": "{{maxTotalTime}}"}}}
+        ]}}}
+    }
+
+Two numeric parameters named minX and maxX bound the same field: a request where minX is greater than maxX
+is rejected, instead of running a query that can not match any recipe.
+
+The templates are validated when they are loaded, and each one is compiled once into a factory that builds
+the body from the parameter values, sharing the parts of the body without placeholders between the calls.
+"""
+import json
+import math
+import re
+
+PLACEHOLDER = re.compile(r"^\{\{([A-Za-z_][A-Za-z0-9_]*)\}\}$")
+
+# Types of the parameters: "terms" is a string of space separated terms, also given as a list of strings
+PARAMETER_TYPES = ("string", "terms", "integer", "number", "boolean")
+
+# Query string arguments of /api/elasticsearch/queries, which the parameters can not be named after
+RESERVED_NAMES = ("queryNumber", "limit", "fields", "view", "stream", "cursor", "pageSize", "params")
+
+MAX_STRING_LENGTH = 500
+
+
+class Parameter:
+    """A typed parameter of a template, with its default value and optional bounds."""
+
+    def __init__(self, name, type, default, min=None, max=None, description=None):
+        self.name = name
+        self.type = type
+        self.min = min
+        self.max = max
+        self.description = description
+        self.default = self.parse(default)
+
+    def parse(self, value):
+        """Convert and check a value of the parameter, given as JSON or as a query string argument.
+
+        Raises:
+            ValueError: if the value does not have the type of the parameter or is out of its bounds.
+        """
+        if self.type in ("string", "terms"):
+            if self.type == "terms" and isinstance(value, list) and all(isinstance(term, str) for term in value):
+                value = " ".join(value)
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError(f"The parameter {self.name} should be a non empty string")
+            if len(value) > MAX_STRING_LENGTH:
+                raise ValueError(f"The parameter {self.name} should be at most {MAX_STRING_LENGTH} characters long")
+            return value
+        if self.type == "boolean":
+            if isinstance(value, str) and value.lower() in ("true", "false"):
+                return value.lower() == "true"
+            if not isinstance(value, bool):
+                raise ValueError(f"The parameter {self.name} should be a boolean")
+            return value
+
+        try:
+            if isinstance(value, bool):
+                raise TypeError
+            number = int(value) if self.type == "integer" else float(value)
+            if isinstance(value, float) and self.type == "integer" and number != value:
+                raise ValueError
+            # NaN and the infinities are not valid JSON numbers
+            if not math.isfinite(number):
+                raise ValueError
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"The parameter {self.name} should be an {self.type}" if self.type == "integer"
+                             else f"The parameter {self.name} should be a {self.type}")
+        if self.min is not None and number < self.min:
+            raise ValueError(f"The parameter {self.name} should be at least {self.min}")
+        if self.max is not None and number > self.max:
+            raise ValueError(f"The parameter {self.name} should be at most {self.max}")
+        return number
+
+    def describe(self):
+        """JSON description of the parameter, for the clients."""
+        description = {"type": self.type, "default": self.default}
+        for key in ("min", "max", "description"):
+            if getattr(self, key) is not None:
+                description[key] = getattr(self, key)
+        return description
+
+
+class QueryTemplate:
+    """A canned query compiled into a factory of ElasticSearch search bodies."""
+
+    def __init__(self, queryNumber, description, parameters, query):
+        self.queryNumber = queryNumber
+        self.description = description
+        self.parameters = parameters
+        self.query = query
+        used = set()
+        factory = _compile(query, used)
+        unknown = used - set(parameters)
+        if unknown:
+            raise ValueError(f"Query {queryNumber} uses undeclared parameters: {', '.join(sorted(unknown))}")
+        unused = set(parameters) - used
+        if unused:
+            raise ValueError(f"Query {queryNumber} declares unused parameters: {', '.join(sorted(unused))}")
+        self.factory = factory
+        self.ranges = _ranges(parameters)
+        self.defaults = {name: parameter.default for name, parameter in parameters.items()}
+        for low, high in self.ranges:
+            if self.defaults[low] > self.defaults[high]:
+                raise ValueError(f"The default of the parameter {low} of query {queryNumber} is greater than the "
+                                 f"default of {high}")
+        # Built once, the queries without parameters and the requests without values share it
+        self.defaultBody = self._build(self.defaults)
+
+    def values(self, arguments=None):
+        """The values of the parameters: the ones in arguments, parsed and checked, and the defaults for the others.
+
+        Args:
+            arguments: dictionary (or query string arguments) from parameter name to its value. The other keys
+              are ignored.
+
+        Raises:
+            ValueError: if a value is invalid, or if the minimum of a range is greater than its maximum.
+        """
+        values = dict(self.defaults)
+        if arguments:
+            for name, parameter in self.parameters.items():
+                if name in arguments:
+                    values[name] = parameter.parse(arguments[name])
+            for low, high in self.ranges:
+                if values[low] > values[high]:
+                    raise ValueError(f"The parameter {low} should be at most {high} ({values[high]!r})")
+        return values
+
+    def build(self, values=None):
+        """The search body for the parameter values, from values()."""
+        if values is None or values == self.defaults:
+            return self.defaultBody
+        return self._build(values)
+
+    def key(self, values):
+        """A string identifying the parameter values, None for the defaults, to tell apart the cached responses."""
+        if values == self.defaults:
+            return None
+        return json.dumps(values, sort_keys=True, separators=(",", ":"))
+
+    def describe(self):
+        """JSON description of the template, for the clients."""
+        description = {"queryNumber": self.queryNumber, "queryDescription": self.description,
+                       "parameters": {name: parameter.describe() for name, parameter in self.parameters.items()}}
+        if self.ranges:
+            # The pairs of parameters where the first one should be at most the second one
+            description["ranges"] = [[low, high] for low, high in self.ranges]
+        return description
+
+    def _build(self, values):
+        return self.query if self.factory is None else self.factory(values)
+
+
+def loadQueryTemplates(entries):
+    """Validate and compile the canned queries of ElasticQueries.json.
+
+    Returns:
+        The list of QueryTemplate, indexed by query number.
+
+    Raises:
+        ValueError: if a template is invalid.
+    """
+    templates = []
+    for position, entry in enumerate(entries):
+        if entry.get('queryNumber', position) != position:
+            raise ValueError(f"Query {entry.get('queryNumber')} is at position {position}, the queries should be in order")
+        parameters = {}
+        for name, spec in entry.get('parameters', {}).items():
+            if name in RESERVED_NAMES or not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+                raise ValueError(f"Query {position} has an invalid parameter name: {name}")
+            if spec.get('type') not in PARAMETER_TYPES:
+                raise ValueError(f"The parameter {name} of query {position} should have a type among {', '.join(PARAMETER_TYPES)}")
+            if 'default' not in spec:
+                raise ValueError(f"The parameter {name} of query {position} has no default")
+            parameters[name] = Parameter(name, spec['type'], spec['default'], spec.get('min'), spec.get('max'),
+                                         spec.get('description'))
+        templates.append(QueryTemplate(position, entry.get('queryDescription'), parameters, entry['query']))
+    return templates
+
+
+def _ranges(parameters):
+    """The (minX, maxX) pairs of numeric parameters of a template."""
+    numeric = {name for name, parameter in parameters.items() if parameter.type in ("integer", "number")}
+    return [(name, "max" + name[3:]) for name in sorted(numeric)
+            if name.startswith("min") and len(name) > 3 and "max" + name[3:] in numeric]
+
+
+def _compile(node, used):
+    """A function from the parameter values to the node with its placeholders replaced, or None when the node has
+    no placeholders. The names of the placeholders are added to used."""
+    if isinstance(node, str):
+        match = PLACEHOLDER.match(node)
+        if match is None:
+            return None
+        name = match.group(1)
+        used.add(name)
+        return lambda values: values[name]
+
+    if isinstance(node, dict):
+        dynamic = [(key, builder) for key, builder in ((key, _compile(value, used)) for key, value in node.items())
+                   if builder is not None]
+        if not dynamic:
+            return None
+
+        def buildObject(values):
+            built = dict(node)
+            for key, builder in dynamic:
+                built[key] = builder(values)
+            return built
+        return buildObject
+
+    if isinstance(node, list):
+        dynamic = [(position, builder) for position, builder in ((position, _compile(value, used))
+                                                                 for position, value in enumerate(node))
+                   if builder is not None]
+        if not dynamic:
+            return None
+
+        def buildList(values):
+            built = list(node)
+            for position, builder in dynamic:
+                built[position] = builder(values)
+            return built
+        return buildList
+
+    return None
@@ -0,0 +1,237 @@
+import threading
+import time
+
+import numpy as np
+
+from Projection import cypherProjection
+
+
+class RecipeGraph:
+    """An in-memory export of the (:Recipe)-[:CONTAINS]->(:Ingredient) graph.
+
+    Recipes and ingredients are mapped to dense integer positions. The incidence matrix is stored twice
+    in compressed sparse form: by recipe (recipe -> ingredients) and by ingredient (ingredient -> recipes,
+    i.e. the posting lists). Per-recipe review statistics are stored as parallel arrays.
+    """
+
+    def __init__(self, recipeIds, ingredientNames, recipeIngredients, reviewCounts=None, avgRatings=None):
+        """Build the graph from plain Python data.
+
+        Args:
+            recipeIds: list of recipe ids (the `id` property of the Recipe nodes).
+            ingredientNames: list of all ingredient names, including the ones not used by any recipe.
+            recipeIngredients: list with, for each recipe, the list of its ingredient names.
+            reviewCounts: optional list with the number of reviews of each recipe.
+            avgRatings: optional list with the average review rating of each recipe (None if unknown).
+        """
+        self.recipeIds = list(recipeIds)
+        self.recipePositions = {recipeId: position for position, recipeId in enumerate(self.recipeIds)}
+
+        self.ingredientNames = list(ingredientNames)
+        self.ingredientPositions = {name: position for position, name in enumerate(self.ingredientNames)}
+        for ingredients in recipeIngredients:
+            for name in ingredients:
+                if name not in self.ingredientPositions:
+                    self.ingredientPositions[name] = len(self.ingredientNames)
+                    self.ingredientNames.append(name)
+
+        # Recipe -> ingredients (CSR)
+        rows = [sorted({self.ingredientPositions[name] for name in ingredients})
+                for ingredients in recipeIngredients]
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        self.recipeIndptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.recipeIndptr[1:])
+        self.recipeIngredients = np.fromiter(
+            (position for row in rows for position in row), dtype=np.int32, count=int(self.recipeIndptr[-1]))
+
+        # Ingredient -> recipes (CSC), every posting list is sorted by recipe position
+        recipeOfEntry = np.repeat(np.arange(len(rows), dtype=np.int32), lengths)
+        order = np.argsort(self.recipeIngredients, kind="stable")
+        self.ingredientRecipes = recipeOfEntry[order]
+        self.ingredientIndptr = np.zeros(len(self.ingredientNames) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.recipeIngredients, minlength=len(self.ingredientNames)),
+                  out=self.ingredientIndptr[1:])
+
+        if reviewCounts is None:
+            reviewCounts = [0] * len(self.recipeIds)
+        if avgRatings is None:
+            avgRatings = [None] * len(self.recipeIds)
+        self.reviewCounts = np.asarray(reviewCounts, dtype=np.int64)
+        self.avgRatings = np.array([np.nan if rating is None else rating for rating in avgRatings],
+                                   dtype=np.float64)
+
+    @property
+    def numRecipes(self):
+        return len(self.recipeIds)
+
+    @property
+    def numIngredients(self):
+        return len(self.ingredientNames)
+
+    def postings(self, ingredientPosition):
+        """Returns the sorted array of recipe positions that contain the ingredient."""
+        return self.ingredientRecipes[self.ingredientIndptr[ingredientPosition]:self.ingredientIndptr[ingredientPosition + 1]]
+
+    def ingredientsOf(self, recipePosition):
+        """Returns the sorted array of ingredient positions of the recipe."""
+        return self.recipeIngredients[self.recipeIndptr[recipePosition]:self.recipeIndptr[recipePosition + 1]]
+
+    def recipeCounts(self):
+        """Returns, for each ingredient, the number of recipes that contain it."""
+        return np.diff(self.ingredientIndptr)
+
+    def toPositions(self, ingredients):
+        """Maps ingredient names to their positions, dropping unknown names and duplicates."""
+        positions = {self.ingredientPositions[name] for name in ingredients if name in self.ingredientPositions}
+        return np.array(sorted(positions), dtype=np.int32)
+
+    def gatherIngredients(self, recipePositions):
+        """Returns the (recipe, ingredient) pairs of the given recipes as two parallel arrays."""
+        starts = self.recipeIndptr[recipePositions]
+        lengths = self.recipeIndptr[recipePositions + 1] - starts
+        total = int(lengths.sum())
+        offsets = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        entries = np.repeat(starts, lengths) + offsets
+        return np.repeat(recipePositions, lengths), self.recipeIngredients[entries]
+
+
+def exportRecipeGraph(driver):
+    """Export the recipe graph from Neo4j.
+
+    Args:
+        driver: a Neo4j driver.
+
+    Returns:
+        A RecipeGraph with every Ingredient, every Recipe with at least one ingredient and the review
+        statistics of each recipe.
+    """
+    with driver.session() as session:
+        ingredientNames = [record['name'] for record in session.run(
+            "MATCH (i:Ingredient) RETURN i.name AS name")]
+
+        recipeIds = []
+        recipeIngredients = []
+        for record in session.run(
+                """
+                MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
+                RETURN r.id AS recipeId, COLLECT(DISTINCT i.name) AS ingredients
+                """):
+            recipeIds.append(record['recipeId'])
+            recipeIngredients.append(record['ingredients'])
+
+        reviews = {record['recipeId']: (record['reviewCount'], record['avgRating']) for record in session.run(
+            """
+            MATCH (r:Recipe)<-[:FOR]-(rev:Review)
+            RETURN r.id AS recipeId, COUNT(rev) AS reviewCount, AVG(rev.rating) AS avgRating
+            """)}
+
+    reviewCounts = [reviews.get(recipeId, (0, None))[0] for recipeId in recipeIds]
+    avgRatings = [reviews.get(recipeId, (0, None))[1] for recipeId in recipeIds]
+    return RecipeGraph(recipeIds, ingredientNames, recipeIngredients, reviewCounts, avgRatings)
+
+
+def exportIngredientCounts(driver):
+    """Export the name of every ingredient with the number of recipes that contain it.
+
+    Returns:
+        Two parallel lists: the ingredient names and their recipe counts.
+    """
+    with driver.session() as session:
+        result = session.run(
+            """
+            MATCH (i:Ingredient)
+            OPTIONAL MATCH (i)<-[:CONTAINS]-(r:Recipe)
+            RETURN i.name AS name, COUNT(DISTINCT r) AS recipeCount
+            """)
+        records = result.data()
+    return [record['name'] for record in records], [record['recipeCount'] for record in records]
+
+
+def fetchRecipes(driver, recipeIds, projection=None):
+    """Fetch the Recipe nodes with the given ids from Neo4j.
+
+    Args:
+        driver: a Neo4j driver.
+        recipeIds: list of recipe ids.
+        projection: optional projection of the recipe properties, see Projection.
+
+    Returns:
+        A dictionary from recipe id to the recipe properties. Unknown ids are missing.
+    """
+    if len(recipeIds) == 0:
+        return {}
+    with driver.session() as session:
+        result = session.run(
+            f"""
+            MATCH (r:Recipe)
+            WHERE r.id IN $recipeIds
+            RETURN {cypherProjection(projection)} AS r
+            """, recipeIds=list(recipeIds))
+        return {record['r']['id']: record['r'] for record in result.data()}
+
+
+class RefreshableIndex:
+    """Holds an index built from a slow source and rebuilds it when it gets old.
+
+    The first call to `get()` builds the index synchronously. After `maxAge` seconds the next call
+    returns the current index and starts a rebuild in a background thread, so requests never wait
+    for a refresh.
+    """
+
+    def __init__(self, build, maxAge=3600):
+        """
+        Args:
+            build: a function with no arguments that returns a freshly built index.
+            maxAge: number of seconds after which the index is rebuilt. None disables the refresh.
+        """
+        self.build = build
+        self.maxAge = maxAge
+        self.value = None
+        self.builtAt = None
+        # Serializes the builds, so that a request never starts a second build while one is running
+        self.buildLock = threading.Lock()
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def get(self):
+        """Returns the current index, building it if needed."""
+        if self.value is None:
+            with self.buildLock:
+                if self.value is None:
+                    self._set(self.build())
+        elif self.maxAge is not None and time.monotonic() - self.builtAt > self.maxAge:
+            self.refreshInBackground()
+        return self.value
+
+    def getIfReady(self):
+        """Returns the current index like `get()`, or None while the first build runs in a background thread.
+        The first call starts that build, so that the request does not wait for it."""
+        if self.value is None:
+            self.refreshInBackground()
+            return None
+        return self.get()
+
+    def refresh(self):
+        """Rebuilds the index synchronously and returns it."""
+        with self.buildLock:
+            self._set(self.build())
+            return self.value
+
+    def refreshInBackground(self):
+        """Rebuilds the index in a background thread, unless a background rebuild is already running."""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _set(self, value):
+        self.value = value
+        self.builtAt = time.monotonic()
@@ -0,0 +1,160 @@
+import numpy as np
+
+# Modulus of the universal hash functions (a * x + b) mod PRIME of the MinHash signatures
+PRIME = (1 << 31) - 1
+
+# Number of recipes whose signatures are computed at once, bounding the memory of the build
+SIGNATURE_BATCH_SIZE = 20000
+
+
+class RecipeSimilarityIndex:
+    """MinHash / locality-sensitive hashing index that finds the recipes with the most similar ingredients.
+
+    The similarity of two recipes is the Jaccard index of their ingredient sets, |A ∩ B| / |A ∪ B|. Each
+    recipe gets a MinHash signature of bands * rows values: the minimum over its ingredients of bands * rows
+    random hash functions, two recipes having the same value with a probability equal to their similarity.
+    The signature is cut in bands of rows values, and the recipes are bucketed by the hash of each band:
+    two recipes with similarity s share at least one bucket with probability 1 - (1 - s^rows)^bands, an S
+    curve with its threshold around (1 / bands)^(1 / rows). The candidates sharing a bucket with the query
+    are then ranked by their exact similarity, computed from the graph.
+
+    Only the buckets are kept, as the sorted 32 bit hashes of each band (4 bytes per band and recipe, plus the
+    recipe position), and not the signatures. A collision of the hashes only adds a candidate.
+    """
+
+    def __init__(self, graph, bands=32, rows=3, seed=0):
+        """Compute the signatures of the recipes of a RecipeGraph, in batches, and bucket them.
+
+        Args:
+            graph: a RecipeGraph.
+            bands: number of bands of the signatures. More bands find more of the similar recipes, with more
+              candidates to rank.
+            rows: number of values of each band. More rows give fewer candidates, missing more of the similar
+              recipes.
+            seed: seed of the random hash functions.
+        """
+        self.graph = graph
+        self.bands = bands
+        self.rows = rows
+        rng = np.random.default_rng(seed)
+        numHashes = bands * rows
+        multipliers = rng.integers(1, PRIME, size=numHashes, dtype=np.uint64)
+        offsets = rng.integers(0, PRIME, size=numHashes, dtype=np.uint64)
+        # The hash of every ingredient for every function, the signature of a recipe is the minimum over its rows
+        ingredients = np.arange(1, graph.numIngredients + 1, dtype=np.uint64)
+        self.ingredientHashes = ((ingredients[:, None] * multipliers + offsets) % PRIME).astype(np.uint32)
+        # Odd multipliers combining the values of a band into one hash
+        self.bandMultipliers = rng.integers(1, 1 << 63, size=rows, dtype=np.uint64) | np.uint64(1)
+
+        lengths = np.diff(graph.recipeIndptr)
+        keys = np.empty((graph.numRecipes, bands), dtype=np.uint32)
+        for start in range(0, graph.numRecipes, SIGNATURE_BATCH_SIZE):
+            stop = min(start + SIGNATURE_BATCH_SIZE, graph.numRecipes)
+            keys[start:stop] = self._bandKeys(self._signatures(start, stop))
+
+        # The recipes without ingredients have no signature, and are similar to none
+        recipes = np.flatnonzero(lengths > 0).astype(np.int32)
+        self.bucketKeys = np.empty((bands, len(recipes)), dtype=np.uint32)
+        self.bucketRecipes = np.empty((bands, len(recipes)), dtype=np.int32)
+        for band in range(bands):
+            bandKeys = keys[recipes, band]
+            order = np.argsort(bandKeys, kind="stable")
+            self.bucketKeys[band] = bandKeys[order]
+            self.bucketRecipes[band] = recipes[order]
+
+    def similarRecipes(self, recipeId, limit=10):
+        """Find the recipes whose ingredients are the most similar to the ones of a recipe.
+
+        Args:
+            recipeId: id of the recipe.
+            limit: maximum number of results.
+
+        Returns:
+            The list of matches, as in similarToIngredients, without the recipe itself. None if the recipe is
+            not in the graph.
+        """
+        position = self.graph.recipePositions.get(recipeId)
+        if position is None:
+            return None
+        return self._query(self.graph.ingredientsOf(position), limit, exclude=position)
+
+    def similarToIngredients(self, ingredients, limit=10):
+        """Find the recipes whose ingredients are the most similar to a list of ingredients.
+
+        Args:
+            ingredients: list of ingredient names. The unknown ones are ignored.
+            limit: maximum number of results.
+
+        Returns:
+            A list of objects with the keys "recipeId", "similarity" (the Jaccard index of the ingredient
+            sets) and "commonIngredients", sorted by similarity descending (ties by recipe position).
+        """
+        return self._query(self.graph.toPositions(ingredients), limit)
+
+    def candidates(self, ingredientPositions):
+        """The positions of the recipes sharing at least one bucket with a set of ingredients, sorted."""
+        if len(ingredientPositions) == 0:
+            return np.empty(0, dtype=np.int32)
+        signature = self.ingredientHashes[ingredientPositions].min(axis=0)
+        keys = self._bandKeys(signature[None, :])[0]
+        found = []
+        for band, key in enumerate(keys):
+            start = int(np.searchsorted(self.bucketKeys[band], key, side="left"))
+            stop = int(np.searchsorted(self.bucketKeys[band], key, side="right"))
+            if stop > start:
+                found.append(self.bucketRecipes[band, start:stop])
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(found))
+
+    def _query(self, ingredientPositions, limit, exclude=None):
+        graph = self.graph
+        if limit is not None and limit <= 0:
+            return []
+        candidates = self.candidates(ingredientPositions)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        if len(candidates) == 0:
+            return []
+
+        # Exact similarity of the candidates: count their ingredients in the query set
+        isQuery = np.zeros(graph.numIngredients, dtype=bool)
+        isQuery[ingredientPositions] = True
+        lengths = graph.recipeIndptr[candidates + 1] - graph.recipeIndptr[candidates]
+        _, cols = graph.gatherIngredients(candidates)
+        owners = np.repeat(np.arange(len(candidates)), lengths)
+        common = np.bincount(owners[isQuery[cols]], minlength=len(candidates))
+        similarities = common / (lengths + len(ingredientPositions) - common)
+
+        matching = np.flatnonzero(common > 0)
+        if limit is not None and limit < len(matching):
+            # Select the best `limit` candidates without sorting all of them, the ties are settled below
+            threshold = np.partition(similarities[matching], len(matching) - limit)[len(matching) - limit]
+            matching = matching[similarities[matching] >= threshold]
+        # Candidates are sorted by position, a stable sort keeps the ties in that order
+        winners = matching[np.argsort(-similarities[matching], kind="stable")][:limit]
+
+        return [{"recipeId": graph.recipeIds[recipe],
+                 "similarity": float(similarities[winner]),
+                 "commonIngredients": [graph.ingredientNames[position] for position in
+                                       np.intersect1d(graph.ingredientsOf(recipe), ingredientPositions).tolist()]}
+                for winner, recipe in zip(winners.tolist(), candidates[winners].tolist())]
+
+    def _signatures(self, start, stop):
+        """The MinHash signatures of the recipes at the positions start to stop, as a (recipes, hashes) matrix."""
+        graph = self.graph
+        indptr = graph.recipeIndptr[start:stop + 1]
+        hashes = self.ingredientHashes[graph.recipeIngredients[indptr[0]:indptr[-1]]]
+        signatures = np.full((stop - start, self.bands * self.rows), np.iinfo(np.uint32).max, dtype=np.uint32)
+        nonEmpty = np.diff(indptr) > 0
+        if nonEmpty.any():
+            signatures[nonEmpty] = np.minimum.reduceat(hashes, (indptr[:-1] - indptr[0])[nonEmpty], axis=0)
+        return signatures
+
+    def _bandKeys(self, signatures):
+        """The hash of each band of the signatures, as a (recipes, bands) matrix.
+
+        The values of a band are combined in 64 bits, the overflows wrapping around, and the high 32 bits are kept.
+        """
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        return ((bands * self.bandMultipliers).sum(axis=2, dtype=np.uint64) >> np.uint64(32)).astype(np.uint32)
@@ -0,0 +1,856 @@
+"""Local read replica of the recipeswithreviews ElasticSearch index.
+
+Every /api/elasticsearch route depends on the remote cluster: its latency dominates the tail of the
+requests, and an outage takes them all down. The replica is a snapshot of the index on the local disk,
+exported by this module, and searched in process by the same query bodies:
+
+    python SearchReplica.py replica/
+
+A snapshot is a directory of numpy arrays, opened as memory maps so that opening it costs nothing and the
+pages are shared by the workers:
+- the _source of every recipe, as JSON, with its offsets;
+- a float64 column per numeric field (RecipeServings, AggregatedRating, ...), NaN when missing;
+- an inverted index per full-text field (RecipeIngredientParts, Keywords, Description, ...): the sorted
+  terms, and for each term the recipes containing it with the number of occurrences, and the number of
+  terms of each recipe;
+- the same for the objects of the nested fields (Reviews), with the recipe of each of them.
+
+The executor evaluates the subset of the query DSL used by the app: bool (must, filter, should, must_not,
+minimum_should_match), match, range, nested, term, terms and match_all, the sort by score or by numeric
+fields with search_after, the _source filters and the aggregations supported by MaterializedQueries. The
+text is analyzed like the standard analyzer does and scored with BM25, as ElasticSearch does; the scores are
+close but not equal to the ones of the cluster (which scores per shard). Anything else raises
+UnsupportedQuery, and ReplicaSearchClient sends those searches to the cluster.
+
+ReplicaSearchClient stands for the ElasticSearch client of the app. In "local" mode the searches are
+answered by the replica. In "fallback" mode they go to the cluster, and the replica answers the ones that
+fail or take more than a timeout; the following searches go to the replica for a cooldown period.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import math
+import os
+import re
+import shutil
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+
+import numpy as np
+
+from MaterializedQueries import INDEX, parseAggregations, scanHits
+from Metrics import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Full-text fields of the recipes, and of the objects of their nested fields
+TEXT_FIELDS = ("RecipeIngredientParts", "Keywords", "Description", "RecipeCategory", "RecipeInstructions")
+NESTED_TEXT_FIELDS = {"Reviews": ("Reviews.Review",)}
+
+# Parameters of BM25, the similarity of ElasticSearch
+K1 = 1.2
+B = 0.75
+
+TOKEN = re.compile(r"\w+(?:['’]\w+)*")
+
+# File of a replica directory naming its current snapshot
+CURRENT = "CURRENT"
+ROOT = "root"
+
+SEARCH_KEYS = ("query", "size", "from", "sort", "search_after", "_source", "aggs", "aggregations", "track_total_hits")
+
+
+class UnsupportedQuery(Exception):
+    """A search the replica can not answer like ElasticSearch does."""
+
+
+def analyze(text):
+    """The terms of a text, as the standard analyzer of ElasticSearch splits and lowercases them."""
+    return [token.lower() for token in TOKEN.findall(text)]
+
+
+class Replica:
+    """A snapshot of the recipes index, searched in process."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.path = path
+        self.numDocs = self.manifest["numDocs"]
+        self.ids = _load(os.path.join(path, "ids.npy"))
+        sources = os.path.join(path, "sources.bin")
+        self.sources = np.memmap(sources, dtype=np.uint8, mode="r") if os.path.getsize(sources) else np.empty(0, np.uint8)
+        self.sourceOffsets = _load(os.path.join(path, "sourceOffsets.npy"))
+        self.root = _Space(os.path.join(path, ROOT), self.manifest["spaces"][ROOT])
+        self.nested = {nestedPath: _Space(os.path.join(path, nestedPath), self.manifest["spaces"][nestedPath])
+                       for nestedPath in self.manifest["spaces"] if nestedPath != ROOT}
+
+    @classmethod
+    def open(cls, directory):
+        """Open the current snapshot of a replica directory written by exportReplica."""
+        with open(os.path.join(directory, CURRENT)) as f:
+            return cls(os.path.join(directory, f.read().strip()))
+
+    def search(self, body=None, size=None, from_=None):
+        """Run a search, with the response of the ElasticSearch search API.
+
+        Args:
+            body: the search body.
+            size: number of hits, overriding the size of the body (as the size query parameter does).
+            from_: offset of the first hit, overriding the from of the body.
+
+        Raises:
+            UnsupportedQuery: if the body uses a feature of the query DSL the replica does not have.
+        """
+        start = time.perf_counter()
+        body = body or {}
+        unknown = set(body) - set(SEARCH_KEYS)
+        if unknown:
+            raise UnsupportedQuery(f"Unsupported search options: {', '.join(sorted(unknown))}")
+        matches, scores = self._evaluate(body.get("query", {"match_all": {}}), self.root)
+        size = int(size if size is not None else body.get("size", 10))
+        offset = int(from_ if from_ is not None else body.get("from", 0))
+        sort = body.get("sort")
+        keys = self._sortKeys(sort, scores)
+        positions = self._top(matches, keys, offset + size, body.get("search_after"))[offset:]
+
+        hits = []
+        for position in positions.tolist():
+            hit = {"_index": INDEX, "_type": "_doc", "_id": str(self.ids[position]),
+                   "_score": float(scores[position]) if sort is None or any(name == "_score" for name, _, _ in keys)
+                   else None,
+                   "_source": _filterSource(self.source(position), body.get("_source"))}
+            if sort is not None:
+                hit["sort"] = [_sortValue(values[position]) for _, values, _ in keys]
+            hits.append(hit)
+        response = {"hits": {"total": {"value": int(matches.sum()), "relation": "eq"},
+                             "max_score": float(scores[matches].max()) if matches.any() and sort is None else None,
+                             "hits": hits}}
+        aggs = body.get("aggs", body.get("aggregations"))
+        if aggs:
+            response["aggregations"] = self._aggregations(aggs, matches)
+        return {"took": int((time.perf_counter() - start) * 1000), "timed_out": False, **response}
+
+    def msearch(self, body):
+        """Run the searches of an msearch body (alternating headers and search bodies)."""
+        if isinstance(body, (str, bytes)):
+            body = [json.loads(line) for line in body.splitlines() if line.strip()]
+        start = time.perf_counter()
+        responses = []
+        for header, search in zip(body[::2], body[1::2]):
+            if header.get("index", INDEX) != INDEX:
+                raise UnsupportedQuery(f"The replica only holds the index {INDEX}")
+            responses.append({**self.search(search), "status": 200})
+        return {"took": int((time.perf_counter() - start) * 1000), "responses": responses}
+
+    def source(self, position):
+        """The _source of the recipe at a position."""
+        data = self.sources[self.sourceOffsets[position]:self.sourceOffsets[position + 1]].tobytes()
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+
+    def _evaluate(self, query, space):
+        """The recipes (or nested objects) of the space matching a query, as a boolean array, and their scores."""
+        if not isinstance(query, dict) or len(query) != 1:
+            raise UnsupportedQuery("A query should be an object with a single key")
+        kind, spec = next(iter(query.items()))
+        if kind == "bool":
+            return self._bool(spec, space)
+        if kind == "match":
+            return self._match(spec, space)
+        if kind == "range":
+            return self._range(spec, space)
+        if kind == "nested":
+            return self._nested(spec, space)
+        if kind in ("term", "terms"):
+            return self._terms(kind, spec, space)
+        if kind == "match_all":
+            boost = float(spec.get("boost", 1.0))
+            return np.ones(space.numDocs, dtype=bool), np.full(space.numDocs, boost)
+        raise UnsupportedQuery(f"The {kind} query is not supported by the replica")
+
+    def _bool(self, spec, space):
+        unknown = set(spec) - {"must", "filter", "should", "must_not", "minimum_should_match", "boost"}
+        if unknown:
+            raise UnsupportedQuery(f"Unsupported bool options: {', '.join(sorted(unknown))}")
+        matches = np.ones(space.numDocs, dtype=bool)
+        scores = np.zeros(space.numDocs)
+        for clause in _clauses(spec.get("must")):
+            clauseMatches, clauseScores = self._evaluate(clause, space)
+            matches &= clauseMatches
+            scores += clauseScores
+        for clause in _clauses(spec.get("filter")):
+            matches &= self._evaluate(clause, space)[0]
+        for clause in _clauses(spec.get("must_not")):
+            matches &= ~self._evaluate(clause, space)[0]
+        should = _clauses(spec.get("should"))
+        if should:
+            counts = np.zeros(space.numDocs, dtype=np.int32)
+            for clause in should:
+                clauseMatches, clauseScores = self._evaluate(clause, space)
+                counts += clauseMatches
+                scores += clauseScores
+            # At least one should clause has to match when there is nothing else to match
+            default = 0 if spec.get("must") or spec.get("filter") else 1
+            matches &= counts >= _minimumShouldMatch(spec.get("minimum_should_match", default), len(should))
+        return matches, np.where(matches, scores * float(spec.get("boost", 1.0)), 0.0)
+
+    def _match(self, spec, space):
+        field, value = _single(spec, "match")
+        if isinstance(value, dict):
+            unknown = set(value) - {"query", "operator", "boost"}
+            if unknown:
+                raise UnsupportedQuery(f"Unsupported match options: {', '.join(sorted(unknown))}")
+            text, operator, boost = value["query"], value.get("operator", "or").lower(), float(value.get("boost", 1.0))
+        else:
+            text, operator, boost = value, "or", 1.0
+        if operator not in ("or", "and"):
+            raise UnsupportedQuery(f"Unsupported match operator: {operator}")
+
+        index = space.text(field)
+        if index is None:
+            if space.column(field) is not None and not isinstance(text, str):
+                return self._terms("term", {field: {"value": text, "boost": boost}}, space)
+            raise UnsupportedQuery(f"The field {field} is not indexed in the replica")
+        terms = list(dict.fromkeys(analyze(str(text))))
+        counts = np.zeros(space.numDocs, dtype=np.int32)
+        scores = np.zeros(space.numDocs)
+        for term in terms:
+            docs, freqs = index.postings(term)
+            if len(docs) == 0:
+                continue
+            idf = math.log(1 + (index.docCount - len(docs) + 0.5) / (len(docs) + 0.5))
+            norms = K1 * (1 - B + B * index.lengths[docs] / index.avgLength)
+            counts[docs] += 1
+            scores[docs] += boost * idf * (freqs / (freqs + norms))
+        matches = counts == len(terms) if operator == "and" else counts > 0
+        if not terms:
+            matches[:] = False
+        return matches, np.where(matches, scores, 0.0)
+
+    def _range(self, spec, space):
+        field, bounds = _single(spec, "range")
+        unknown = set(bounds) - {"gte", "gt", "lte", "lt", "boost"}
+        if unknown:
+            raise UnsupportedQuery(f"Unsupported range options: {', '.join(sorted(unknown))}")
+        values = _column(space, field)
+        matches = ~np.isnan(values)
+        for name, compare in (("gte", np.greater_equal), ("gt", np.greater), ("lte", np.less_equal), ("lt", np.less)):
+            if bounds.get(name) is not None:
+                matches &= compare(values, _number(bounds[name], field))
+        # Like in ElasticSearch, a range is a filter with a constant score
+        return matches, np.where(matches, float(bounds.get("boost", 1.0)), 0.0)
+
+    def _terms(self, kind, spec, space):
+        spec = dict(spec)
+        boost = float(spec.pop("boost", 1.0))
+        field, value = _single(spec, kind)
+        if kind == "term" and isinstance(value, dict):
+            boost = float(value.get("boost", boost))
+            value = value.get("value")
+        if kind == "terms" and not isinstance(value, list):
+            raise UnsupportedQuery("The terms query should have a list of values")
+        values = _column(space, field)
+        accepted = [_number(item, field) for item in (value if kind == "terms" else [value])]
+        matches = np.isin(values, accepted)
+        return matches, np.where(matches, boost, 0.0)
+
+    def _nested(self, spec, space):
+        unknown = set(spec) - {"path", "query", "score_mode"}
+        if unknown:
+            raise UnsupportedQuery(f"Unsupported nested options: {', '.join(sorted(unknown))}")
+        child = self.nested.get(spec["path"]) if space is self.root else None
+        if child is None:
+            raise UnsupportedQuery(f"The nested field {spec['path']} is not in the replica")
+        childMatches, childScores = self._evaluate(spec["query"], child)
+        parents = child.parents[childMatches]
+        counts = np.bincount(parents, minlength=space.numDocs)
+        matches = counts > 0
+        mode = spec.get("score_mode", "avg")
+        if mode in ("avg", "sum"):
+            scores = np.bincount(parents, weights=childScores[childMatches], minlength=space.numDocs)
+            if mode == "avg":
+                scores = np.divide(scores, counts, out=np.zeros(space.numDocs), where=matches)
+        elif mode in ("max", "min"):
+            scores = np.full(space.numDocs, -np.inf if mode == "max" else np.inf)
+            (np.maximum if mode == "max" else np.minimum).at(scores, parents, childScores[childMatches])
+            scores[~matches] = 0.0
+        elif mode == "none":
+            scores = np.zeros(space.numDocs)
+        else:
+            raise UnsupportedQuery(f"Unsupported nested score_mode: {mode}")
+        return matches, scores
+
+    def _sortKeys(self, sort, scores):
+        """The sort of the hits, as a list of (name, values, descending)."""
+        if sort is None:
+            return [("_score", scores, True)]
+        keys = []
+        for item in sort if isinstance(sort, list) else [sort]:
+            if isinstance(item, str):
+                name, order = item, "desc" if item == "_score" else "asc"
+            else:
+                name, order = _single(item, "sort")
+                if isinstance(order, dict):
+                    order = order.get("order", "desc" if name == "_score" else "asc")
+            if order not in ("asc", "desc"):
+                raise UnsupportedQuery(f"Unsupported sort order: {order}")
+            if name == "_score":
+                values = scores
+            elif name == "_doc":
+                values = np.arange(self.numDocs)
+            else:
+                values = _column(self.root, name)
+            keys.append((name, values, order == "desc"))
+        return keys
+
+    def _top(self, matches, keys, count, searchAfter=None):
+        """The positions of the first count matching recipes in the order of the sort keys, ties by position."""
+        candidates = np.flatnonzero(matches)
+        # Ascending sort keys of the candidates, the missing values last
+        columns = []
+        for _, values, descending in keys:
+            column = np.asarray(values[candidates], dtype=np.float64)
+            column = -column if descending else column
+            columns.append(np.where(np.isnan(column), np.inf, column))
+        if searchAfter is not None:
+            if len(searchAfter) != len(keys):
+                raise UnsupportedQuery("search_after should have one value per sort key")
+            after = np.zeros(len(candidates), dtype=bool)
+            for column, (_, _, descending), value in reversed(list(zip(columns, keys, searchAfter))):
+                value = np.inf if value is None else (-float(value) if descending else float(value))
+                after = (column > value) | ((column == value) & after)
+            candidates = candidates[after]
+            columns = [column[after] for column in columns]
+        if count <= 0 or len(candidates) == 0:
+            return candidates[:0]
+        if len(candidates) > count:
+            # Keep the candidates up to the count-th value of the first key, the ties are ordered below
+            threshold = np.partition(columns[0], count - 1)[count - 1]
+            kept = columns[0] <= threshold
+            candidates = candidates[kept]
+            columns = [column[kept] for column in columns]
+        order = np.lexsort([candidates, *reversed(columns)])
+        return candidates[order[:count]]
+
+    def _aggregations(self, aggs, matches):
+        try:
+            aggregations = parseAggregations(aggs)
+        except ValueError as e:
+            raise UnsupportedQuery(str(e))
+        fields = set().union(*(aggregation.fields for aggregation in aggregations))
+        columns = {field: _column(self.root, field) for field in fields}
+        return {aggregation.name: aggregation.render(aggregation.state(columns, matches)) for aggregation in aggregations}
+
+
+class _Space:
+    """The recipes, or the objects of a nested field, with their numeric columns and text indexes."""
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.numDocs = manifest["numDocs"]
+        self.numericFields = set(manifest["numeric"])
+        self.textFields = manifest["text"]
+        self.parents = _load(os.path.join(path, "parents.npy")) if manifest.get("nested") else None
+        self.columns = {}
+        self.indexes = {}
+
+    def column(self, field):
+        """The values of a numeric field, None if it is not numeric."""
+        if field not in self.numericFields:
+            return None
+        if field not in self.columns:
+            self.columns[field] = _load(os.path.join(self.path, f"{field}.npy"))
+        return self.columns[field]
+
+    def text(self, field):
+        """The inverted index of a full-text field, None if the field is not indexed."""
+        if field not in self.textFields:
+            return None
+        if field not in self.indexes:
+            self.indexes[field] = _TextIndex(os.path.join(self.path, field), self.textFields[field])
+        return self.indexes[field]
+
+
+class _TextIndex:
+    """Inverted index of a full-text field, with the terms sorted by their UTF-8 bytes."""
+
+    def __init__(self, path, statistics):
+        self.terms = _Terms(_load(f"{path}.terms.npy"), _load(f"{path}.termOffsets.npy"))
+        self.indptr = _load(f"{path}.indptr.npy")
+        self.docs = _load(f"{path}.docs.npy")
+        self.freqs = _load(f"{path}.freqs.npy")
+        self.lengths = _load(f"{path}.lengths.npy")
+        self.docCount = statistics["docCount"]
+        self.avgLength = statistics["sumLengths"] / max(statistics["docCount"], 1)
+
+    def postings(self, term):
+        """The positions of the documents containing the term, and its number of occurrences in each."""
+        position = self.terms.find(term.encode())
+        if position is None:
+            return self.docs[:0], self.freqs[:0]
+        start, stop = self.indptr[position], self.indptr[position + 1]
+        return self.docs[start:stop], self.freqs[start:stop]
+
+
+class _Terms:
+    """The sorted terms of an index, stored one after the other in a byte array."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes()
+
+    def find(self, term):
+        position = bisect.bisect_left(self, term)
+        return position if position < len(self) and self[position] == term else None
+
+
+class ReplicaSearchClient:
+    """ElasticSearch client of the app answering the searches from a Replica, or falling back to it.
+
+    It has the search and msearch methods of the ElasticSearch client, the other attributes are the ones of
+    the remote client.
+    """
+
+    MODES = ("local", "fallback")
+
+    def __init__(self, remote, replica, mode="fallback", timeoutSeconds=1.0, cooldownSeconds=30.0):
+        """
+        Args:
+            remote: the ElasticSearch client of the cluster.
+            replica: holder of the Replica, with a get() method (e.g. a RefreshableIndex).
+            mode: "local" answers every search it can from the replica. "fallback" sends them to the cluster,
+              and answers from the replica the ones that fail or take more than timeoutSeconds.
+            timeoutSeconds: time after which a search of the cluster is given up, in "fallback" mode.
+            cooldownSeconds: time during which the searches go to the replica after a failure of the cluster.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown replica mode {mode}, it should be one of {', '.join(self.MODES)}")
+        self.remote = remote
+        self.replica = replica
+        self.mode = mode
+        self.timeoutSeconds = timeoutSeconds
+        self.cooldownSeconds = cooldownSeconds
+        self.remoteDownUntil = 0.0
+
+    def search(self, body=None, index=None, **kwargs):
+        return self._call("search", self._localSearch(body, kwargs), dict(kwargs, body=body, index=index))[0]
+
+    def msearch(self, body=None, index=None, **kwargs):
+        return self._call("msearch", lambda replica: replica.msearch(body), dict(kwargs, body=body, index=index))[0]
+
+    def pinned(self):
+        """A client for the pages of one listing, whose searches all go to the backend that answered the first one.
+        The scores of the replica differ from the ones of the cluster, so the search_after of a page of one can not
+        continue on the other."""
+        return PinnedSearchClient(self)
+
+    def _call(self, method, local, kwargs):
+        """The result of the search, and the backend that answered it: "replica" or "remote"."""
+        reason = self._replicaFirst()
+        if reason is not None:
+            result = self._tryReplica(local, reason)
+            if result is not None:
+                return result, "replica"
+        try:
+            return getattr(self.remote, method)(**self._remoteArguments(kwargs)), "remote"
+        except Exception as e:
+            reason = self._remoteFailed(e)
+            result = self._tryReplica(local, reason) if reason is not None else None
+            if result is None:
+                raise
+            return result, "replica"
+
+    @staticmethod
+    def _localSearch(body, kwargs):
+        return lambda replica: replica.search(body, kwargs.get("size"), kwargs.get("from_"))
+
+    def _tryReplica(self, local, reason):
+        """The result of the search on the replica, None if the replica can not answer it."""
+        try:
+            result = local(self.replica.get())
+        except (UnsupportedQuery, OSError):
+            return None
+        metrics.increment("tastetrios_replica_searches_total", (("reason", reason),))
+        return result
+
+    def _replicaFirst(self):
+        """Why the search goes to the replica first, None if it goes to the cluster."""
+        if self.mode == "local":
+            return "local"
+        if time.monotonic() < self.remoteDownUntil:
+            return "cooldown"
+        return None
+
+    def _remoteArguments(self, kwargs):
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        if self.mode == "fallback" and self.timeoutSeconds:
+            kwargs.setdefault("request_timeout", self.timeoutSeconds)
+        return kwargs
+
+    def _remoteFailed(self, e):
+        """The reason to answer from the replica after an exception of the cluster, None for a bad request."""
+        from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, TransportError
+
+        if isinstance(e, ConnectionTimeout):
+            reason = "timeout"
+        elif isinstance(e, ConnectionError) or (isinstance(e, TransportError) and isinstance(e.status_code, int)
+                                                and (e.status_code >= 500 or e.status_code == 429)):
+            reason = "error"
+        else:
+            return None
+        self.remoteDownUntil = time.monotonic() + self.cooldownSeconds
+        return reason
+
+    def __getattr__(self, name):
+        return getattr(self.remote, name)
+
+
+class AsyncReplicaSearchClient(ReplicaSearchClient):
+    """ReplicaSearchClient for an AsyncElasticsearch client. The replica is searched in a thread."""
+
+    async def search(self, body=None, index=None, **kwargs):
+        return (await self._callAsync("search", self._localSearch(body, kwargs), dict(kwargs, body=body, index=index)))[0]
+
+    async def msearch(self, body=None, index=None, **kwargs):
+        return (await self._callAsync("msearch", lambda replica: replica.msearch(body),
+                                      dict(kwargs, body=body, index=index)))[0]
+
+    def pinned(self):
+        return AsyncPinnedSearchClient(self)
+
+    async def _callAsync(self, method, local, kwargs):
+        reason = self._replicaFirst()
+        if reason is not None:
+            result = await asyncio.to_thread(self._tryReplica, local, reason)
+            if result is not None:
+                return result, "replica"
+        try:
+            return await getattr(self.remote, method)(**self._remoteArguments(kwargs)), "remote"
+        except Exception as e:
+            reason = self._remoteFailed(e)
+            result = await asyncio.to_thread(self._tryReplica, local, reason) if reason is not None else None
+            if result is None:
+                raise
+            return result, "replica"
+
+
+class PinnedSearchClient:
+    """Search client of a ReplicaSearchClient answering every search from the backend that answered the first one.
+
+    When that backend fails, the search fails instead of moving to the other one.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.backend = None
+
+    def search(self, body=None, index=None, **kwargs):
+        client = self.client
+        if self.backend is None:
+            result, self.backend = client._call("search", client._localSearch(body, kwargs), dict(kwargs, body=body, index=index))
+            return result
+        if self.backend == "replica":
+            metrics.increment("tastetrios_replica_searches_total", (("reason", "listing"),))
+            return client._localSearch(body, kwargs)(client.replica.get())
+        try:
+            return client.remote.search(**client._remoteArguments(dict(kwargs, body=body, index=index)))
+        except Exception as e:
+            client._remoteFailed(e)
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class AsyncPinnedSearchClient(PinnedSearchClient):
+    """PinnedSearchClient of an AsyncReplicaSearchClient."""
+
+    async def search(self, body=None, index=None, **kwargs):
+        client = self.client
+        if self.backend is None:
+            result, self.backend = await client._callAsync("search", client._localSearch(body, kwargs),
+                                                           dict(kwargs, body=body, index=index))
+            return result
+        if self.backend == "replica":
+            metrics.increment("tastetrios_replica_searches_total", (("reason", "listing"),))
+            return await asyncio.to_thread(client._localSearch(body, kwargs), client.replica.get())
+        try:
+            return await client.remote.search(**client._remoteArguments(dict(kwargs, body=body, index=index)))
+        except Exception as e:
+            client._remoteFailed(e)
+            raise
+
+
+def exportReplica(es, directory, keep=2):
+    """Export the recipes index of the cluster into a new snapshot of a replica directory.
+
+    Returns:
+        The path of the snapshot.
+    """
+    return writeReplica(scanHits(es, {"match_all": {}}), directory, keep)
+
+
+def writeReplica(hits, directory, keep=2):
+    """Write the hits of the whole recipes index as a new snapshot of a replica directory, and make it current.
+
+    Args:
+        hits: the ElasticSearch hits (with _id and _source) of every recipe.
+        directory: the replica directory.
+        keep: number of snapshots kept in the directory, the older ones are deleted.
+
+    Returns:
+        The path of the snapshot.
+    """
+    exportedAt = datetime.now(timezone.utc)
+    name = exportedAt.strftime("%Y%m%dT%H%M%S%f")
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+
+    root = _SpaceBuilder(TEXT_FIELDS, nested=False)
+    nested = {nestedPath: _SpaceBuilder(fields, nested=True) for nestedPath, fields in NESTED_TEXT_FIELDS.items()}
+    ids = []
+    offsets = array("q", [0])
+    with open(os.path.join(path, "sources.bin"), "wb") as sources:
+        for hit in hits:
+            document = hit["_source"]
+            position = len(ids)
+            ids.append(str(hit["_id"]))
+            data = orjson.dumps(document) if orjson is not None else json.dumps(document).encode()
+            sources.write(data)
+            offsets.append(offsets[-1] + len(data))
+            root.add(document)
+            for nestedPath, builder in nested.items():
+                for item in document.get(nestedPath) or []:
+                    if isinstance(item, dict):
+                        builder.add(item, parent=position, prefix=nestedPath + ".")
+
+    np.save(os.path.join(path, "sourceOffsets.npy"), np.frombuffer(offsets, dtype=np.int64))
+    np.save(os.path.join(path, "ids.npy"), np.array(ids, dtype=str))
+
+    spaces = {ROOT: root.save(os.path.join(path, ROOT))}
+    for nestedPath, builder in nested.items():
+        spaces[nestedPath] = builder.save(os.path.join(path, nestedPath))
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump({"index": INDEX, "exportedAt": exportedAt.isoformat(), "numDocs": len(ids), "spaces": spaces}, f)
+
+    temporary = os.path.join(directory, CURRENT + ".tmp")
+    with open(temporary, "w") as f:
+        f.write(name)
+    os.replace(temporary, os.path.join(directory, CURRENT))
+
+    # The workers that still map an older snapshot keep reading it after the files are deleted
+    snapshots = sorted(entry for entry in os.listdir(directory)
+                       if os.path.isdir(os.path.join(directory, entry)) and os.path.exists(os.path.join(directory, entry, "manifest.json")))
+    for old in snapshots[:-keep] if keep > 0 else []:
+        if old != name:
+            shutil.rmtree(os.path.join(directory, old))
+    return path
+
+
+class _SpaceBuilder:
+    """Collects the numeric columns and the text indexes of the recipes, or of the objects of a nested field."""
+
+    def __init__(self, textFields, nested):
+        self.numDocs = 0
+        self.nested = nested
+        self.numbers = {}
+        self.notNumeric = set()
+        self.texts = {field: _TextIndexBuilder() for field in textFields}
+        self.parents = array("i")
+
+    def add(self, document, parent=None, prefix=""):
+        position = self.numDocs
+        self.numDocs += 1
+        if parent is not None:
+            self.parents.append(parent)
+        for key, value in document.items():
+            field = prefix + key
+            if field in self.texts:
+                self.texts[field].add(position, value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                if field not in self.notNumeric:
+                    column = self.numbers.setdefault(field, array("d"))
+                    column.extend([math.nan] * (position - len(column)))
+                    column.append(value)
+            elif value is not None:
+                # Strings (e.g. dates), lists and objects are not numeric columns
+                self.notNumeric.add(field)
+
+    def save(self, path):
+        os.makedirs(path)
+        numeric = []
+        for field, column in self.numbers.items():
+            if field in self.notNumeric:
+                continue
+            column.extend([math.nan] * (self.numDocs - len(column)))
+            np.save(os.path.join(path, f"{field}.npy"), np.frombuffer(column, dtype=np.float64))
+            numeric.append(field)
+        if self.nested:
+            np.save(os.path.join(path, "parents.npy"), np.frombuffer(self.parents, dtype=np.int32))
+        text = {field: builder.save(os.path.join(path, field), self.numDocs) for field, builder in self.texts.items()}
+        return {"numDocs": self.numDocs, "nested": self.nested, "numeric": sorted(numeric), "text": text}
+
+
+class _TextIndexBuilder:
+    def __init__(self):
+        self.vocabulary = {}
+        self.docs = array("i")
+        self.terms = array("i")
+        self.freqs = array("i")
+        self.lengths = array("i")
+
+    def add(self, position, value):
+        values = value if isinstance(value, list) else [value]
+        terms = [term for text in values if isinstance(text, str) for term in analyze(text)]
+        self.lengths.extend([0] * (position - len(self.lengths)))
+        self.lengths.append(len(terms))
+        for term, freq in Counter(terms).items():
+            self.docs.append(position)
+            self.terms.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+            self.freqs.append(freq)
+
+    def save(self, path, numDocs):
+        self.lengths.extend([0] * (numDocs - len(self.lengths)))
+        lengths = np.frombuffer(self.lengths, dtype=np.int32)
+        encoded = sorted((term.encode(), termId) for term, termId in self.vocabulary.items())
+        ranks = np.empty(len(encoded), dtype=np.int32)
+        ranks[[termId for _, termId in encoded]] = np.arange(len(encoded), dtype=np.int32)
+        terms = ranks[np.frombuffer(self.terms, dtype=np.int32)]
+        # Stable, so that the documents of each term stay sorted
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(encoded)), out=indptr[1:])
+        termOffsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term, _ in encoded], out=termOffsets[1:])
+
+        np.save(f"{path}.terms.npy", np.frombuffer(b"".join(term for term, _ in encoded), dtype=np.uint8))
+        np.save(f"{path}.termOffsets.npy", termOffsets)
+        np.save(f"{path}.indptr.npy", indptr)
+        np.save(f"{path}.docs.npy", np.frombuffer(self.docs, dtype=np.int32)[order])
+        np.save(f"{path}.freqs.npy", np.frombuffer(self.freqs, dtype=np.int32)[order])
+        np.save(f"{path}.lengths.npy", lengths)
+        return {"docCount": int((lengths > 0).sum()), "sumLengths": int(lengths.sum()), "terms": len(encoded)}
+
+
+def _load(path):
+    return np.load(path, mmap_mode="r")
+
+
+def _clauses(clauses):
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def _single(spec, kind):
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise UnsupportedQuery(f"The {kind} clause should have a single field")
+    return next(iter(spec.items()))
+
+
+def _column(space, field):
+    values = space.column(field)
+    if values is None:
+        raise UnsupportedQuery(f"The field {field} is not a numeric field of the replica")
+    return values
+
+
+def _number(value, field):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise UnsupportedQuery(f"The value {value!r} of the field {field} is not a number")
+
+
+def _minimumShouldMatch(value, numClauses):
+    """The number of should clauses that have to match, from an integer or a percentage, possibly negative."""
+    text = str(value).strip()
+    try:
+        if text.endswith("%"):
+            count = int(numClauses * abs(float(text[:-1])) / 100)
+            return numClauses - count if text.startswith("-") else count
+        count = int(text)
+    except ValueError:
+        raise UnsupportedQuery(f"Unsupported minimum_should_match: {value}")
+    return numClauses + count if count < 0 else count
+
+
+def _sortValue(value):
+    value = float(value)
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def _filterSource(document, source):
+    """Apply a _source filter (False, a list of fields, or includes and excludes) to a recipe.
+    Dotted names select the fields of the objects of a nested array."""
+    if source is None or source is True:
+        return document
+    if source is False:
+        return {}
+    if isinstance(source, (str, list)):
+        source = {"includes": source}
+    includes = source.get("includes")
+    excludes = source.get("excludes")
+    if includes:
+        document = _selectFields(document, [includes] if isinstance(includes, str) else includes, keep=True)
+    if excludes:
+        document = _selectFields(document, [excludes] if isinstance(excludes, str) else excludes, keep=False)
+    return document
+
+
+def _selectFields(document, fields, keep):
+    """Keep (or drop) the fields of a document, the dotted names reaching into its objects and arrays of objects."""
+    children = {}
+    for field in fields:
+        name, _, rest = field.partition(".")
+        children.setdefault(name, []).append(rest)
+    selected = {}
+    for key, value in document.items():
+        paths = children.get(key)
+        if paths is None:
+            # Not named: dropped by the includes, kept by the excludes
+            if not keep:
+                selected[key] = value
+        elif "" in paths:
+            if keep:
+                selected[key] = value
+        elif isinstance(value, dict):
+            selected[key] = _selectFields(value, paths, keep)
+        elif isinstance(value, list):
+            selected[key] = [_selectFields(item, paths, keep) for item in value if isinstance(item, dict)]
+        elif not keep:
+            selected[key] = value
+    return selected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the recipeswithreviews index into a local search replica.")
+    parser.add_argument("directory", nargs="?", help="replica directory, SEARCH_REPLICA_DIR by default")
+    parser.add_argument("--keep", type=int, default=2, help="number of snapshots kept in the directory")
+    args = parser.parse_args()
+
+    from Clients import elasticsearchClient
+    from Settings import search_replica_dir
+
+    start = time.perf_counter()
+    path = exportReplica(elasticsearchClient(), args.directory or search_replica_dir, args.keep)
+    replica = Replica(path)
+    print(f"Exported {replica.numDocs} recipes to {path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
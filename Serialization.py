@@ -0,0 +1,93 @@
+"""Fast JSON encoding and compression of the responses.
+
+The recipe listings are large, and with the json module most of the time of a request goes into encoding
+them. OrjsonProvider encodes with orjson when it is installed. compressResponse (and its async version for
+the Quart app) compresses the responses with brotli or gzip, depending on the Accept-Encoding header of the
+request. brotli is optional: without the package, gzip is used.
+"""
+import gzip
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller responses are sent as they are, compressing them does not pay off
+COMPRESSION_MIN_BYTES = 1024
+# Levels trading a little of the compression ratio for a much faster compression
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider encoding with orjson, for a Flask or a Quart app.
+
+    Unlike the default provider the keys are not sorted. The types orjson does not know are converted by the
+    default function of the default provider.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj) + b"\n", mimetype=self.mimetype)
+
+    def _encode(self, obj):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def installJSONProvider(app):
+    """Use orjson to encode the responses of the app, if it is installed."""
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+def acceptedEncoding(request):
+    """The best compression accepted by the client, or None."""
+    encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(encodings)
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compressResponse(response, request):
+    """Compress a buffered Flask response. The streamed responses are sent as they are, line by line."""
+    if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+    data = response.get_data()
+    encoding = acceptedEncoding(request) if len(data) >= COMPRESSION_MIN_BYTES else None
+    if encoding is not None:
+        response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+async def compressResponseAsync(response, request):
+    """Async version of compressResponse, for a Quart response."""
+    from quart.wrappers.response import DataBody
+
+    if not isinstance(response.response, DataBody) or "Content-Encoding" in response.headers:
+        return response
+    data = await response.get_data()
+    encoding = acceptedEncoding(request) if len(data) >= COMPRESSION_MIN_BYTES else None
+    if encoding is not None:
+        response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,52 @@
+"""Configuration of the application, read from environment variables (or a .env file)."""
+import os
+
+# Load environment variables from .env file. Vercel sets them itself, so the cold starts skip dotenv
+if not os.getenv("VERCEL"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Get credentials from environment variables
+uri = os.getenv("NEO4J_URI")
+username = os.getenv("NEO4J_USERNAME")
+password = os.getenv("NEO4J_PASSWORD")
+bonsai_url = os.getenv("BONSAI_URL")
+
+# Serve the graph analytics from in-memory indexes built from a Neo4j export instead of running Cypher
+use_local_indexes = os.getenv("USE_LOCAL_INDEXES", "false").lower() == "true"
+index_refresh_seconds = int(os.getenv("INDEX_REFRESH_SECONDS", "3600"))
+
+# Cache of the canned ElasticSearch queries, optionally shared between workers through Redis
+query_cache_ttl = int(os.getenv("QUERY_CACHE_TTL", "600"))
+query_cache_max_bytes = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 2 ** 20)))
+redis_url = os.getenv("REDIS_URL")
+
+# Async serving mode: size of the shared connection pools and timeout of each request
+async_pool_size = int(os.getenv("ASYNC_POOL_SIZE", "50"))
+request_timeout_seconds = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "10"))
+
+# Time the hybrid search waits for each backend before answering with the results it has
+hybrid_deadline_seconds = float(os.getenv("HYBRID_DEADLINE_SECONDS", "2"))
+
+# Compress the responses with brotli or gzip when the client accepts it
+response_compression = os.getenv("RESPONSE_COMPRESSION", "true").lower() == "true"
+
+# Log the database queries slower than SLOW_QUERY_MS milliseconds (0 disables it), to the SLOW_QUERY_LOG file if set
+slow_query_ms = float(os.getenv("SLOW_QUERY_MS", "0"))
+slow_query_log = os.getenv("SLOW_QUERY_LOG")
+
+# Serve the aggregations of these canned queries (e.g. "6,8") from snapshots refreshed in the background, disabled by
+# default, optionally saved to SNAPSHOT_DIR so that a restart does not export them again. The changed recipes are
+# pushed by the ingestion, or found by the date field SNAPSHOT_CHANGE_FIELD the ingestion sets when it indexes them
+materialized_queries = [int(number) for number in os.getenv("MATERIALIZED_QUERIES", "").split(",") if number.strip()]
+snapshot_refresh_seconds = int(os.getenv("SNAPSHOT_REFRESH_SECONDS", "300"))
+snapshot_rebuild_seconds = int(os.getenv("SNAPSHOT_REBUILD_SECONDS", "86400"))
+snapshot_dir = os.getenv("SNAPSHOT_DIR")
+snapshot_change_field = os.getenv("SNAPSHOT_CHANGE_FIELD")
+
+# Local replica of the recipes index exported by SearchReplica.py into SEARCH_REPLICA_DIR: "off", "local" to answer
+# the searches from it, or "fallback" to answer from it the searches that fail or take more than SEARCH_REPLICA_FALLBACK_MS
+search_replica = os.getenv("SEARCH_REPLICA", "off").lower()
+search_replica_dir = os.getenv("SEARCH_REPLICA_DIR", "replica")
+search_replica_fallback_ms = float(os.getenv("SEARCH_REPLICA_FALLBACK_MS", "1000"))
+search_replica_cooldown_seconds = float(os.getenv("SEARCH_REPLICA_COOLDOWN_SECONDS", "30"))
@@ -0,0 +1,241 @@
+import base64
+import json
+
+from flask import Response, current_app, stream_with_context
+
+from Neo4jQueries import MATCH_INGREDIENTS_AFTER
+from Projection import withRecipeProjection
+
+# Number of hits fetched from ElasticSearch per round trip when streaming
+DEFAULT_PAGE_SIZE = 500
+# Maximum number of hits fetched per round trip, larger page sizes asked by the clients are capped to it
+MAX_PAGE_SIZE = 5000
+# Unique field used to break the ties of the score when paging through ElasticSearch hits
+TIEBREAK_FIELD = "RecipeId"
+
+
+def encodeCursor(values):
+    """Encode the position of the last returned result as an opaque continuation token."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decodeCursor(token, length=None):
+    """Decode a continuation token created by encodeCursor.
+    Decode it before starting to stream, so that an invalid token can be reported with a 400 status.
+
+    Raises:
+        ValueError: if the token is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parsePageSize(value):
+    """Parse the pageSize parameter of a streamed listing, capped to MAX_PAGE_SIZE.
+    Parse it before starting to stream, so that an invalid value can be reported with a 400 status.
+
+    Args:
+        value: the value sent by the client, None for the default page size.
+
+    Raises:
+        ValueError: if the value is not a positive integer.
+    """
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        pageSize = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid pageSize, it should be a positive integer")
+    if pageSize < 1:
+        raise ValueError("Invalid pageSize, it should be a positive integer")
+    return min(pageSize, MAX_PAGE_SIZE)
+
+
+def parseLimit(value, required=True):
+    """Parse the limit of a streamed listing.
+    Parse it before starting to stream, so that an invalid value can be reported with a 400 status.
+
+    Args:
+        value: the value sent by the client, None when it sent none.
+        required: whether the listing needs a limit. When it does not, None streams every result.
+
+    Raises:
+        ValueError: if the value is missing (when required) or not an integer of at least 0.
+    """
+    if value is None:
+        if required:
+            raise ValueError("No limit found")
+        return None
+    if isinstance(value, bool):
+        raise ValueError("Limit should be an integer")
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Limit should be an integer")
+    if limit < 0:
+        raise ValueError("Limit should be greater than 0")
+    return limit
+
+
+def ndjsonResponse(lines):
+    """Stream an iterable of JSON objects as newline delimited JSON.
+
+    The status code is sent before the first line, so an error raised while streaming is reported as a
+    last line with the key "error".
+    """
+    def generate():
+        try:
+            for line in lines:
+                yield current_app.json.dumps(line) + "\n"
+        except Exception as e:
+            yield current_app.json.dumps({"error": str(e)}) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
+
+
+def isStreamingRequest(request, body=None):
+    """Whether the client asked for a streamed response, with ?stream=true, "stream": true in the body or the Accept header."""
+    if request.args.get("stream", "false").lower() == "true":
+        return True
+    if isinstance(body, dict) and body.get("stream") is True:
+        return True
+    return request.accept_mimetypes.best == "application/x-ndjson"
+
+
+def streamNeo4jMatches(driver, ingredients, limit=None, after=None, projection=None):
+    """Stream the results of matchIngredients straight from the Neo4j result cursor.
+
+    The recipes are ordered by matchingScore descending and then by recipe id, so that a page can start
+    right after the last recipe of the previous one.
+
+    Args:
+        driver: a Neo4j driver.
+        ingredients: list of ingredient names.
+        limit: maximum number of recipes to stream. None streams all of them.
+        after: decoded continuation token returned by a previous call.
+        projection: optional projection of the recipe properties, see Projection.
+
+    Yields:
+        One object per recipe with the keys "matchingScore", "recipe" and "matchingIngredients". If there are
+          more recipes after the limit, a last object with the key "cursor" that continues the listing.
+    """
+    afterScore, afterId = after if after is not None else (None, None)
+    limitString = "" if limit is None else " LIMIT $limit"
+    with driver.session() as session:
+        result = session.run(
+            withRecipeProjection(MATCH_INGREDIENTS_AFTER, projection) + limitString, ingredients=ingredients,
+            afterScore=afterScore, afterId=afterId,
+            limit=None if limit is None else limit + 1)
+        count = 0
+        last = None
+        for record in result:
+            if limit is not None and count == limit:
+                yield {"cursor": encodeCursor([last['matchingScore'], last['recipe']['id']])}
+                break
+            last = {"matchingScore": record['matchingScore'], "recipe": record.data()['r'],
+                    "matchingIngredients": record['matchingIngredients']}
+            count += 1
+            yield last
+
+
+def streamElasticHits(es, body, limit, after=None, pageSize=DEFAULT_PAGE_SIZE):
+    """Stream the hits of an ElasticSearch query, fetching them page by page with search_after.
+
+    Args:
+        es: an ElasticSearch client.
+        body: the search body, without sort and size.
+        limit: maximum number of hits to stream.
+        after: decoded continuation token returned by a previous call.
+        pageSize: number of hits fetched per request, at least 1.
+
+    Yields:
+        One object per hit with the keys "matchingScore" and "recipe". If there are more hits after the
+          limit, a last object with the key "cursor" that continues the listing.
+    """
+    if pageSize < 1:
+        raise ValueError("Invalid pageSize, it should be a positive integer")
+    # The scores of the pages are compared with each other, so they all come from the same backend
+    es = pinnedClient(es)
+    searchAfter = after
+    remaining = limit
+    if remaining <= 0:
+        return
+    while True:
+        # Fetch one hit more than needed to know if the listing continues after the limit
+        size = min(pageSize, remaining + 1)
+        hits = es.search(index="recipeswithreviews", body=_elasticPage(body, size, searchAfter))['hits']['hits']
+        for hit in hits:
+            if remaining == 0:
+                yield {"cursor": encodeCursor(searchAfter)}
+                return
+            yield {"matchingScore": hit['_score'], "recipe": hit['_source']}
+            searchAfter = hit['sort']
+            remaining -= 1
+        if len(hits) < size:
+            return
+
+
+async def streamNeo4jMatchesAsync(driver, ingredients, limit=None, after=None, projection=None):
+    """Async version of streamNeo4jMatches, for an AsyncDriver."""
+    afterScore, afterId = after if after is not None else (None, None)
+    limitString = "" if limit is None else " LIMIT $limit"
+    async with driver.session() as session:
+        result = await session.run(
+            withRecipeProjection(MATCH_INGREDIENTS_AFTER, projection) + limitString, ingredients=ingredients,
+            afterScore=afterScore, afterId=afterId,
+            limit=None if limit is None else limit + 1)
+        count = 0
+        last = None
+        async for record in result:
+            if limit is not None and count == limit:
+                yield {"cursor": encodeCursor([last['matchingScore'], last['recipe']['id']])}
+                break
+            last = {"matchingScore": record['matchingScore'], "recipe": record.data()['r'],
+                    "matchingIngredients": record['matchingIngredients']}
+            count += 1
+            yield last
+
+
+async def streamElasticHitsAsync(es, body, limit, after=None, pageSize=DEFAULT_PAGE_SIZE):
+    """Async version of streamElasticHits, for an AsyncElasticsearch client."""
+    if pageSize < 1:
+        raise ValueError("Invalid pageSize, it should be a positive integer")
+    # The scores of the pages are compared with each other, so they all come from the same backend
+    es = pinnedClient(es)
+    searchAfter = after
+    remaining = limit
+    if remaining <= 0:
+        return
+    while True:
+        size = min(pageSize, remaining + 1)
+        hits = (await es.search(index="recipeswithreviews", body=_elasticPage(body, size, searchAfter)))['hits']['hits']
+        for hit in hits:
+            if remaining == 0:
+                yield {"cursor": encodeCursor(searchAfter)}
+                return
+            yield {"matchingScore": hit['_score'], "recipe": hit['_source']}
+            searchAfter = hit['sort']
+            remaining -= 1
+        if len(hits) < size:
+            return
+
+
+def pinnedClient(es):
+    """The client fetching every page of a listing from the same backend, see SearchReplica.PinnedSearchClient."""
+    pinned = getattr(es, "pinned", None)
+    return es if pinned is None else pinned()
+
+
+def _elasticPage(body, size, searchAfter):
+    """The body of the request of one page of hits, sorted by score with a unique tiebreak."""
+    page = {**body, "size": size, "sort": [{"_score": "desc"}, {TIEBREAK_FIELD: "asc"}]}
+    if searchAfter is not None:
+        page["search_after"] = searchAfter
+    return page
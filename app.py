@@ -1,31 +1,90 @@
-from flask import Flask, jsonify, request
-from neo4j import GraphDatabase
-import os
-from dotenv import load_dotenv
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from elasticsearch import Elasticsearch
-from ElasticQueries import elasticQueries
-
-# Load environment variables from .env file
-load_dotenv()
+from ElasticQueries import cannedQuery, elasticQueries, matchIngredientsBody, matchIngredientsAndBody, queryTemplates
+from Neo4jQueries import SAMPLE_NODES, CHECK_INGREDIENT, MATCH_INGREDIENTS, GET_INGREDIENTS, MIX_AND_MAX
+from Settings import (use_local_indexes, index_refresh_seconds, query_cache_ttl, query_cache_max_bytes, redis_url,
+                      hybrid_deadline_seconds, response_compression, slow_query_ms, slow_query_log, materialized_queries,
+                      snapshot_refresh_seconds, snapshot_rebuild_seconds, snapshot_dir, snapshot_change_field,
+                      search_replica, search_replica_dir, search_replica_fallback_ms, search_replica_cooldown_seconds)
+from Clients import LazyClient, elasticsearchClient, neo4jDriver
+from RecipeGraph import fetchRecipes, RefreshableIndex
+from LocalIndexes import buildLocalIndexes, buildAutocompleteIndex, buildSimilarityIndex
+from QueryCache import buildQueryCache
+from MaterializedQueries import MaterializedQueries, pushedRecipeIds
+from SearchReplica import Replica, ReplicaSearchClient
+from Batch import MAX_BATCH_SIZE, cannedQueryResponse, runBatch
+from Hybrid import hybridSearch, parseDeadline, validateHybridRequest
+from Metrics import (InstrumentedDriver, InstrumentedElasticsearch, configureSlowQueryLog, finishRequest, metrics,
+                     recordException, startRequest, timeEncoding, timed)
+from Projection import projectionFromRequest, withRecipeProjection, withSourceFilter
+from Serialization import compressResponse, installJSONProvider
+from Streaming import (decodeCursor, isStreamingRequest, ndjsonResponse, parseLimit, parsePageSize, streamElasticHits,
+                       streamNeo4jMatches)
 
 # Initialize Flask app
 app = Flask(__name__)
 
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
-# Get credentials from environment variables
-uri = os.getenv("NEO4J_URI")
-username = os.getenv("NEO4J_USERNAME")
-password = os.getenv("NEO4J_PASSWORD")
-bonsai_url = os.getenv("BONSAI_URL")
+# Encode the responses with orjson when it is installed, and compress them when the client accepts it
+installJSONProvider(app)
+
+# Time the phases of every request in its Server-Timing header, and aggregate them for /metrics
+timeEncoding(app)
+configureSlowQueryLog(slow_query_ms, slow_query_log)
+
+
+@app.before_request
+def start_timer():
+    startRequest()
+
+
+@app.after_request
+def record_metrics(response):
+    # Registered before the compression, so that it runs after it
+    return finishRequest(request, response)
+
+
+if response_compression:
+    @app.after_request
+    def compress_response(response):
+        with timed("compress"):
+            return compressResponse(response, request)
+
+# Create a Neo4j driver and an Elasticsearch client, on the first request that needs them
+driver = InstrumentedDriver(LazyClient(neo4jDriver))
+es = LazyClient(elasticsearchClient)
+if search_replica != "off":
+    # Answer the searches from the local replica of the index, reopened to pick up the new exports
+    es = ReplicaSearchClient(es, RefreshableIndex(lambda: Replica.open(search_replica_dir), maxAge=index_refresh_seconds),
+                             search_replica, search_replica_fallback_ms / 1000, search_replica_cooldown_seconds)
+es = InstrumentedElasticsearch(es)
+
+localIndexes = RefreshableIndex(lambda: buildLocalIndexes(driver), maxAge=index_refresh_seconds)
+
+# Index of the similar recipes, built in the background on the first request of /api/neo4j/similarRecipes
+similarityIndex = RefreshableIndex(lambda: buildSimilarityIndex(driver, localIndexes), maxAge=index_refresh_seconds)
 
-# Create a Neo4j driver
-driver = GraphDatabase.driver(uri, auth=(username, password))
+# Index of the ingredient names for the autocomplete, built at startup when the local indexes are enabled
+autocompleteIndex = RefreshableIndex(lambda: buildAutocompleteIndex(driver), maxAge=index_refresh_seconds)
+if use_local_indexes:
+    autocompleteIndex.refreshInBackground()
 
-# Create an Elasticsearch client
-es = Elasticsearch(bonsai_url,
-                   verify_certs=True)
+queryCache = buildQueryCache(query_cache_ttl, query_cache_max_bytes, redis_url)
+
+# Snapshots of the canned aggregation queries, exported in the background on their first request
+materializedQueries = (MaterializedQueries(es, {queryNumber: elasticQueries[queryNumber] for queryNumber in materialized_queries},
+                                           snapshot_refresh_seconds, snapshot_rebuild_seconds, snapshot_dir,
+                                           snapshot_change_field)
+                       if materialized_queries else None)
+
+
+def errorResponse(e):
+    """Answer a request that failed with an unexpected exception: the exception is logged with its traceback and
+    counted in the error metrics, and only its message is returned."""
+    recordException(e)
+    app.logger.exception(e)
+    return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/neo4j/data", methods=["GET"])
@@ -33,7 +92,7 @@ def get_neo4j_data():
     try:
         # Create a session and run a query
         with driver.session() as session:
-            result = session.run("MATCH (n) RETURN n LIMIT 5")
+            result = session.run(SAMPLE_NODES)
             data = [record['n'] for record in result.data()]
 
         response = jsonify(data)
@@ -41,7 +100,7 @@ def get_neo4j_data():
         return response
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/neo4j/checkIngredient", methods=["POST"])
@@ -53,11 +112,16 @@ def check_ingredient():
         A JSON object with a key "exists" that is True if the ingredient exists in the database and False
     """
     try:
+        if use_local_indexes:
+            exists = autocompleteIndex.get().exists(request.json['ingredient'])
+            response = jsonify({"exists": exists})
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            return response
+
         # Create a session and run a query
         with driver.session() as session:
             ingredient = request.json['ingredient']
-            result = session.run(
-                "MATCH (n:Ingredient) WHERE n.name = $ingredient RETURN n", ingredient=ingredient)
+            result = session.run(CHECK_INGREDIENT, ingredient=ingredient)
             data = [record['n'] for record in result.data()]
 
         # Return whether the ingredient is in the database
@@ -67,7 +131,7 @@ def check_ingredient():
         return response
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/neo4j/checkIngredient", methods=["OPTIONS"])
@@ -79,17 +143,82 @@ def check_ingredient_options():
     return response
 
 
+@app.route("/api/neo4j/autocomplete", methods=["GET"])
+def autocomplete():
+    """Suggest ingredients while the user is typing.
+    The text typed so far is passed as the query parameter "prefix".
+    A query parameter "limit" can be passed to change the number of suggestions (10 by default).
+    When there are not enough ingredients starting with the prefix, ingredients starting with a close misspelling are suggested.
+
+    Returns:
+        A JSON object with a key "ingredients" that is a list of objects with the keys "ingredient", "recipeCount"
+          (the number of recipes that use it) and "fuzzy" (True if the prefix is a misspelling of the ingredient).
+    """
+    try:
+        if ('prefix' not in request.args):
+            return jsonify({"error": "No prefix found"}), 400
+
+        prefix = request.args['prefix']
+        limit = int(request.args.get('limit', 10))
+
+        index = autocompleteIndex.get()
+        matches = index.complete(prefix, limit)
+        data = [{"ingredient": name, "recipeCount": count, "fuzzy": False} for name, count in matches]
+        if len(data) < limit:
+            suggestions = index.suggest(prefix, limit - len(data), exclude={name for name, _ in matches})
+            data += [{"ingredient": name, "recipeCount": count, "fuzzy": True} for name, count in suggestions]
+
+        response = jsonify({"ingredients": data})
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+
+    except Exception as e:
+        return errorResponse(e)
+
+
 @app.route("/api/neo4j/matchIngredients", methods=["POST"])
 def matchIngredients():
     """Returns a list of recipes that must contain at least one of the ingredients in the list. The results are sorted by the number of ingredients that match the query.
     The ingredients are passed in the request body as a JSON object with the key "ingredients".
     A limit parameter can be passed in the request body to limit the number of results.
+    With "stream": true in the request body (or the Accept header application/x-ndjson) the recipe matches are streamed as
+    newline delimited JSON, followed by an object with the key "cursor" when there are more results after the limit.
+    Passing that cursor back in the key "cursor" continues the listing.
+    The recipe properties can be restricted with the key "fields" (a list of property names) or "view" ("card", "detail" or "full").
 
     Returns:
         A JSON object with a key "recipes" that is a list of recipes matches. For each recipe match, the object contains the keys
           "matchingScore" (the number of ingredients that match the query) and "recipe" (the recipe object).
     """
     try:
+        try:
+            projection = projectionFromRequest(request, request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if isStreamingRequest(request, request.json):
+            ingredients = request.json['ingredients']
+            cursor = request.json.get('cursor')
+            try:
+                limit = parseLimit(request.json.get('limit'), required=False)
+                after = decodeCursor(cursor, length=2) if cursor is not None else None
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return ndjsonResponse(streamNeo4jMatches(driver, ingredients, limit, after, projection))
+
+        if use_local_indexes:
+            # Score the recipes with the inverted index and fetch only the winners from the database
+            ingredients = request.json['ingredients']
+            limit = int(request.json['limit']) if "limit" in request.json else None
+            matches = localIndexes.get()["matchIngredients"].topK(ingredients, limit)
+            recipes = fetchRecipes(driver, [match["recipeId"] for match in matches], projection)
+            data = [{"matchingScore": match['matchingScore'], "recipe": recipes[match['recipeId']], "matchingIngredients": match['matchingIngredients']}
+                    for match in matches if match['recipeId'] in recipes]
+
+            response = jsonify({"recipes": data})
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            return response
+
         # Create a session and run a query
         with driver.session() as session:
             ingredients = request.json['ingredients']
@@ -98,14 +227,7 @@ def matchIngredients():
                 limit = request.json['limit']
                 limitString = f" LIMIT {limit}"
 
-            result = session.run(
-                """
-                MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
-                WHERE i.name IN $ingredients
-                WITH r, count(i) AS matchingScore, COLLECT(i.name) AS matchingIngredients
-                RETURN r, matchingScore, matchingIngredients ORDER BY matchingScore DESC
-                """
-                + limitString, ingredients=ingredients)
+            result = session.run(withRecipeProjection(MATCH_INGREDIENTS, projection) + limitString, ingredients=ingredients)
             data = [{"matchingScore": record['matchingScore'], "recipe": record['r'], "matchingIngredients": record['matchingIngredients']}
                     for record in result.data()]
 
@@ -114,7 +236,7 @@ def matchIngredients():
         return response
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/neo4j/matchIngredients", methods=["OPTIONS"])
@@ -131,29 +253,36 @@ def matchIngredients_es():
     """Returns a list of recipes that must contain at least one of the ingredients in the list. The results are sorted by the number of ingredients that match the query.
     The ingredients are passed in the request body as a JSON object with the key "ingredients".
     A limit parameter can be passed in the request body to limit the number of results.
+    With "stream": true in the request body (or the Accept header application/x-ndjson) the recipe matches are streamed as
+    newline delimited JSON, followed by an object with the key "cursor" when there are more results after the limit.
+    Passing that cursor back in the key "cursor" continues the listing.
+    The recipe fields can be restricted with the key "fields" (a list of field names, dotted for nested fields) or "view"
+    ("card", "detail" or "full").
 
     Returns:
         A JSON object with a key "recipes" that is a list of recipes matches. For each recipe match, the object contains the keys
           "matchingScore" (the number of ingredients that match the query) and "recipe" (the recipe object).
     """
     try:
+        try:
+            projection = projectionFromRequest(request, request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         # Create a session and run a query
         ingredients = request.json['ingredients']
         limit = request.json['limit']
-        body = {
-            "query": {
-                "bool": {
-                    "should": [{
-                        "match": {
-                            "RecipeIngredientParts": {
-                                "query": " ".join(ingredients),
-                                "operator": "or"
-                            }
-                        }
-                    }]
-                }
-            }
-        }
+        body = withSourceFilter(matchIngredientsBody(ingredients), projection)
+        if isStreamingRequest(request, request.json):
+            cursor = request.json.get('cursor')
+            try:
+                limit = parseLimit(limit)
+                after = decodeCursor(cursor) if cursor is not None else None
+                pageSize = parsePageSize(request.json.get('pageSize'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return ndjsonResponse(streamElasticHits(es, body, limit, after, pageSize))
+
         result = es.search(index="recipeswithreviews", body=body, size=limit)
         data = [{"matchingScore": record['_score'], "recipe": record['_source']}
                 for record in result['hits']['hits']]
@@ -163,7 +292,7 @@ def matchIngredients_es():
         return response
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/elasticsearch/matchIngredients", methods=["OPTIONS"])
@@ -180,38 +309,36 @@ def matchIngredientsAnd_es():
     """Returns a list of recipes that must contain the last ingredient in the list while it should contain at least one other ingredient. The results are sorted by the number of ingredients that match the query.
     The ingredients are passed in the request body as a JSON object with the key "ingredients".
     A limit parameter can be passed in the request body to limit the number of results.
+    With "stream": true in the request body (or the Accept header application/x-ndjson) the recipe matches are streamed as
+    newline delimited JSON, followed by an object with the key "cursor" when there are more results after the limit.
+    Passing that cursor back in the key "cursor" continues the listing.
+    The recipe fields can be restricted with the key "fields" (a list of field names, dotted for nested fields) or "view"
+    ("card", "detail" or "full").
 
     Returns:
         A JSON object with a key "recipes" that is a list of recipes matches. For each recipe match, the object contains the keys
           "matchingScore" (the number of ingredients that match the query) and "recipe" (the recipe object).
     """
     try:
+        try:
+            projection = projectionFromRequest(request, request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         # Create a session and run a query
         ingredients = request.json['ingredients']
         limit = request.json['limit']
-        body = {
-            "query": {
-                "bool": {
-                    "filter": [
-                        {"match":
-                         {
-                             "RecipeIngredientParts": ingredients[-1]
-                         }
-                         }
-                    ],
-                    "must": [
-                        {
-                            "match": {
-                                "RecipeIngredientParts": {
-                                    "query": " ".join(ingredients[:-1]),
-                                    "operator": "or"
-                                }
-                            }
-                        }
-                    ]
-                }
-            }
-        }
+        body = withSourceFilter(matchIngredientsAndBody(ingredients), projection)
+        if isStreamingRequest(request, request.json):
+            cursor = request.json.get('cursor')
+            try:
+                limit = parseLimit(limit)
+                after = decodeCursor(cursor) if cursor is not None else None
+                pageSize = parsePageSize(request.json.get('pageSize'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return ndjsonResponse(streamElasticHits(es, body, limit, after, pageSize))
+
         result = es.search(index="recipeswithreviews", body=body, size=limit)
         data = [{"matchingScore": record['_score'], "recipe": record['_source']}
                 for record in result['hits']['hits']]
@@ -221,7 +348,7 @@ def matchIngredientsAnd_es():
         return response
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/elasticsearch/matchIngredientsAnd", methods=["OPTIONS"])
@@ -233,6 +360,49 @@ def matchIngredientsAnd_es_options():
     return response
 
 
+@app.route("/api/hybrid/matchIngredients", methods=["POST"])
+def matchIngredients_hybrid():
+    """Returns a list of recipes matching the ingredients according to both Neo4j and ElasticSearch.
+    The two backends are queried concurrently and their rankings are merged by recipe id.
+    The ingredients are passed in the request body as a JSON object with the key "ingredients".
+    Optional keys: "limit" (10 by default), "candidates" (recipes asked to each backend, the limit by default),
+    "fusion" ("rrf" for the reciprocal rank fusion, the default, or "weighted" for the weighted sum of the normalized
+    scores), "weights" (e.g. {"neo4j": 2, "elasticsearch": 1}), "matchAll" (rank the ElasticSearch matches like
+    matchIngredientsAnd), "deadline" (seconds to wait for the backends) and "fields" or "view" (see matchIngredients).
+
+    Returns:
+        A JSON object with a key "recipes" that is a list of recipes matches. For each recipe match, the object contains the keys
+          "recipeId", "fusedScore", "recipe", "ranks" and "scores" (the rank and score of the recipe in each backend that found it)
+          and "matchingIngredients" when Neo4j found it. The key "partial" is true when a backend missed the deadline or failed,
+          and "backends" reports the number of candidates of each backend or its error.
+    """
+    try:
+        try:
+            parameters = validateHybridRequest(request.json)
+            projection = projectionFromRequest(request, request.json)
+            deadline = parseDeadline(request.json.get('deadline'), hybrid_deadline_seconds)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        data = hybridSearch(driver, es, deadline=deadline, projection=projection, **parameters)
+
+        response = jsonify(data)
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+
+    except Exception as e:
+        return errorResponse(e)
+
+
+@app.route("/api/hybrid/matchIngredients", methods=["OPTIONS"])
+def matchIngredients_hybrid_options():
+    response = jsonify({"status": "OK"})
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    response.headers.add("Access-Control-Allow-Methods", "POST, OPTIONS")
+    response.headers.add("Access-Control-Allow-Headers", "Content-Type")
+    return response
+
+
 @app.route("/api/neo4j/getIngredients", methods=["POST"])
 def getIngredients():
     """Returns a list of all the ingredients recessary for a recipe.
@@ -245,19 +415,14 @@ def getIngredients():
         # Create a session and run a query
         with driver.session() as session:
             recipe = request.json['recipeId']
-            result = session.run(
-                """
-                MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
-                WHERE r.id = $recipe
-                RETURN COLLECT(i.name) AS ingredients
-                """, recipe=recipe)
+            result = session.run(GET_INGREDIENTS, recipe=recipe)
             data = result.single()['ingredients']
 
         response = jsonify({"ingredients": data})
         response.headers.add("Access-Control-Allow-Origin", "*")
         return response
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/neo4j/getIngredients", methods=["OPTIONS"])
@@ -281,32 +446,30 @@ def mixAndMax():
     """
 
     try:
+        limit = None
+        if ("limit" in request.json):
+            try:
+                limit = int(request.json['limit'])
+            except (TypeError, ValueError):
+                return jsonify({"error": "Limit should be an integer"}), 400
+            if (limit < 0):
+                return jsonify({"error": "Limit should be greater than 0"}), 400
+
+        if use_local_indexes:
+            # Answer from the precomputed co-occurrence index
+            ingredients = request.json['ingredients']
+            data = localIndexes.get()["mixAndMax"].query(ingredients, limit)
+
+            response = jsonify({"ingredients": data})
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            response.headers.add("Access-Control-Allow-Credentials", "true")
+            return response
+
         # Create a session and run a query
         with driver.session() as session:
             ingredients = request.json['ingredients']
-            limitString = ""
-            if ("limit" in request.json):
-                limit = request.json['limit']
-                limitString = f" LIMIT {limit}"
-            result = session.run(
-                """
-                WITH $providedIngredients AS ingredients
-                // Find recipes that contain an existing ingredient and additional matched ingredients
-                MATCH (i:Ingredient)<-[:CONTAINS]-(r:Recipe)-[:CONTAINS]->(i1:Ingredient)
-                WHERE i.name IN ingredients AND NOT i1.name IN ingredients
-                WITH DISTINCT r, i1.name AS matchedIngredient, ingredients, COUNT(distinct i) as availableMatchedIngredients
-
-                // Match reviews for these recipes and calculate the average rating for each matched recipe
-                MATCH (r)<-[:FOR]-(rev:Review)
-                WITH matchedIngredient, r, AVG(rev.rating) AS avgRating, ingredients, availableMatchedIngredients
-
-                // Count the number of unique recipes for each matched ingredient
-                MATCH (r)-[:CONTAINS]->(i:Ingredient)
-                WHERE i.name IN ingredients
-                RETURN matchedIngredient, COUNT(DISTINCT r) AS recipeCount, AVG(avgRating) AS avgOfAvgRatings, AVG(availableMatchedIngredients) as IngredientCompatibility
-                ORDER BY IngredientCompatibility * log10(recipeCount) DESC
-                """
-                + limitString, providedIngredients=ingredients)
+            limitString = "" if limit is None else f" LIMIT {limit}"
+            result = session.run(MIX_AND_MAX + limitString, providedIngredients=ingredients)
             data = [record for record in result.data()]
 
         response = jsonify({"ingredients": data})
@@ -314,7 +477,7 @@ def mixAndMax():
         response.headers.add("Access-Control-Allow-Credentials", "true")
         return response
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/neo4j/mixAndMax", methods=["OPTIONS"])
@@ -328,11 +491,81 @@ def mixAndMax_option():
     return response
 
 
+@app.route("/api/neo4j/similarRecipes", methods=["POST"])
+def similarRecipes():
+    """Returns the recipes whose ingredients are the most similar to the ones of a recipe ("more like this").
+    The recipe is passed in the request body as a JSON object with the key "recipeId", or a list of ingredients with the key "ingredients".
+    A limit parameter can be passed in the request body to limit the number of results (10 by default).
+    The similarity is the Jaccard index of the ingredient sets. The candidates are found with the MinHash signatures of the recipes,
+    built from the graph exported in memory (see RecipeSimilarity), so a few of the similar recipes can be missed.
+    The index is built in the background on the first request, which is answered with a 503 until it is ready.
+    The recipe properties can be restricted with the key "fields" (a list of property names) or "view" ("card", "detail" or "full").
+
+    Returns:
+        A JSON object with a key "recipes" that is a list of recipes sorted by similarity. For each recipe, the object contains the keys
+          "similarity", "recipe" (the recipe object) and "commonIngredients".
+    """
+    try:
+        body = request.get_json(silent=True)
+        if (not isinstance(body, dict) or ("recipeId" not in body and not isinstance(body.get('ingredients'), list))):
+            return jsonify({"error": "No recipeId or ingredients found"}), 400
+
+        try:
+            limit = int(body.get('limit', 10))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Limit should be an integer"}), 400
+        if (limit < 0):
+            return jsonify({"error": "Limit should be greater than 0"}), 400
+
+        try:
+            projection = projectionFromRequest(request, body)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        index = similarityIndex.getIfReady()
+        if index is None:
+            response = jsonify({"error": "The similarity index is being built, retry later"})
+            response.headers.add("Retry-After", "30")
+            return response, 503
+
+        if "recipeId" in body:
+            matches = index.similarRecipes(body['recipeId'], limit)
+            if matches is None:
+                return jsonify({"error": "Unknown recipe"}), 404
+        else:
+            matches = index.similarToIngredients(body['ingredients'], limit)
+
+        recipes = fetchRecipes(driver, [match["recipeId"] for match in matches], projection)
+        data = [{"similarity": match['similarity'], "recipe": recipes[match['recipeId']], "commonIngredients": match['commonIngredients']}
+                for match in matches if match['recipeId'] in recipes]
+
+        response = jsonify({"recipes": data})
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+    except Exception as e:
+        return errorResponse(e)
+
+
+@app.route("/api/neo4j/similarRecipes", methods=["OPTIONS"])
+def similarRecipes_options():
+    response = jsonify({"status": "OK"})
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    response.headers.add("Access-Control-Allow-Methods", "POST, OPTIONS")
+    response.headers.add("Access-Control-Allow-Headers", "Content-Type")
+    return response
+
+
 @app.route("/api/elasticsearch/queries", methods=["GET"])
 def elastic_queries():
     """Run an ElasticSearch query based on the query number and the JSON body.
     The query number is passed as a query parameter.
     The JSON body should contain the key "limit" with the number of results to return.
+    With the query parameter stream=true the recipes are streamed as newline delimited JSON, followed by an object with the key
+    "cursor" when there are more results after the limit. Passing that cursor back as the query parameter "cursor" continues the listing.
+    The recipe fields can be restricted with the query parameter "fields" (comma separated field names) or "view" ("card", "detail"
+    or "full").
+    The parameters of the query (see /api/elasticsearch/queries/templates) are passed as query parameters with their names, e.g.
+    queryNumber=3&limit=10&ingredients=beef+rice&maxTotalTime=45. The parameters not given keep their default value.
 
     Returns:
         A JSON object with the results of the ElasticSearch query.
@@ -354,22 +587,50 @@ def elastic_queries():
         if (limit < 0):
             return jsonify({"error": "Limit should be greater than 0"}), 400
 
-        query = elasticQueries[queryNumber]
+        try:
+            projection = projectionFromRequest(request)
+            query, variant = cannedQuery(queryNumber, request.args, projection)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # The aggregations with the default parameters can be answered from their snapshot
+        materialized = materializedQueries.response(queryNumber) if materializedQueries is not None and variant is None else None
+
+        if isStreamingRequest(request):
+            if 'aggs' in query:
+                # Aggregations are a single object, there is nothing to page through
+                return ndjsonResponse([materialized or cannedQueryResponse(es.search(index="recipeswithreviews", body=query, size=limit))])
+            cursor = request.args.get('cursor')
+            try:
+                after = decodeCursor(cursor) if cursor is not None else None
+                pageSize = parsePageSize(request.args.get('pageSize'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return ndjsonResponse(streamElasticHits(es, query, limit, after, pageSize))
+
+        if materialized is not None:
+            response = jsonify(materialized)
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            return response
+
+        cached = queryCache.get(queryNumber, limit, variant) if queryCache is not None else None
+        if cached is not None:
+            response = jsonify(cached)
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            return response
 
         result = es.search(index="recipeswithreviews", body=query, size=limit)
 
-        if ('aggregations' not in result):
-            data = [{"matchingScore": record['_score'], "recipe": record['_source']}
-                    for record in result['hits']['hits']]
-            response = jsonify({"recipes": data})
-        else:
-            data = result['aggregations']
-            response = jsonify({"aggregations": data})
+        data = cannedQueryResponse(result)
+
+        if queryCache is not None:
+            queryCache.put(queryNumber, limit, data, variant)
 
+        response = jsonify(data)
         response.headers.add("Access-Control-Allow-Origin", "*")
         return response
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return errorResponse(e)
 
 
 @app.route("/api/elasticsearch/queries", methods=["OPTIONS"])
@@ -381,6 +642,152 @@ def elastic_queries_options():
     return response
 
 
+@app.route("/api/elasticsearch/queries/cache", methods=["GET"])
+def elastic_queries_cache():
+    """Returns the hit, miss and eviction counters of the canned queries cache."""
+    if queryCache is None:
+        return jsonify({"error": "The query cache is disabled"}), 404
+    response = jsonify(queryCache.statistics())
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
+
+
+@app.route("/api/elasticsearch/queries/snapshots", methods=["GET"])
+def elastic_queries_snapshots():
+    """Returns the number of recipes and the build and refresh dates of the snapshots of the aggregation queries."""
+    if materializedQueries is None:
+        return jsonify({"error": "The materialized queries are disabled"}), 404
+    response = jsonify(materializedQueries.statistics())
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
+
+
+@app.route("/api/elasticsearch/queries/snapshots/refresh", methods=["POST"])
+def elastic_queries_snapshots_refresh():
+    """Refresh the snapshots of the aggregation queries with the recipes changed by the ingestion.
+    The ids of the recipes indexed, updated or deleted are passed in the request body as a JSON object with the key "recipeIds".
+    They are applied now, or when the running build or refresh of the snapshots is done.
+
+    Returns:
+        A JSON object with the keys "recipes" (the number of pushed recipes) and "pending" (the number of recipes waiting
+          for the running build or refresh).
+    """
+    if materializedQueries is None:
+        return jsonify({"error": "The materialized queries are disabled"}), 404
+    try:
+        try:
+            recipeIds = pushedRecipeIds(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        materializedQueries.push(recipeIds)
+
+        response = jsonify({"recipes": len(recipeIds), "pending": materializedQueries.statistics()["pending"]})
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+    except Exception as e:
+        return errorResponse(e)
+
+
+@app.route("/api/elasticsearch/queries/snapshots/refresh", methods=["OPTIONS"])
+def elastic_queries_snapshots_refresh_options():
+    response = jsonify({"status": "OK"})
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    response.headers.add("Access-Control-Allow-Methods", "POST, OPTIONS")
+    response.headers.add("Access-Control-Allow-Headers", "Content-Type")
+    return response
+
+
+@app.route("/api/elasticsearch/queries/templates", methods=["GET"])
+def elastic_queries_templates():
+    """Returns the canned queries with the type, the default value and the bounds of their parameters."""
+    response = jsonify({"queries": [template.describe() for template in queryTemplates]})
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
+
+
+@app.route("/api/elasticsearch/queries/multi", methods=["POST"])
+def elastic_queries_multi():
+    """Run several canned ElasticSearch queries with a single msearch request.
+    The queries are passed in the request body as a JSON object with the key "queries", a list of objects like
+    {"queryNumber": ..., "limit": ..., "params": {...}} that can also have the keys "fields" or "view".
+    The cached responses are answered from the cache, the others are searched together.
+
+    Returns:
+        A JSON object with a key "results" that is the list of the responses of the queries, in the same order.
+          Each response is what /api/elasticsearch/queries would return, or an object with the key "error".
+    """
+    try:
+        if (request.json is None or not isinstance(request.json.get('queries'), list)):
+            return jsonify({"error": "No queries found"}), 400
+
+        queries = request.json['queries']
+        if (len(queries) > MAX_BATCH_SIZE):
+            return jsonify({"error": f"Too many queries, the maximum is {MAX_BATCH_SIZE}"}), 400
+
+        operations = [{**query, "op": "elasticQuery"} if isinstance(query, dict) else query for query in queries]
+        data = runBatch(operations, driver, es, queryCache, materializedQueries)
+
+        response = jsonify({"results": data})
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+    except Exception as e:
+        return errorResponse(e)
+
+
+@app.route("/api/elasticsearch/queries/multi", methods=["OPTIONS"])
+def elastic_queries_multi_options():
+    response = jsonify({"status": "OK"})
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    response.headers.add("Access-Control-Allow-Methods", "POST, OPTIONS")
+    response.headers.add("Access-Control-Allow-Headers", "Content-Type")
+    return response
+
+
+@app.route("/api/batch", methods=["POST"])
+def batch():
+    """Execute many lookups in one request.
+    The operations are passed in the request body as a JSON object with the key "operations", a list of objects like
+    {"op": "checkIngredient", "ingredient": ...}, {"op": "getIngredients", "recipeId": ...} or
+    {"op": "elasticQuery", "queryNumber": ..., "limit": ..., "params": {...}}.
+    Operations of the same type are executed together with a single database query.
+
+    Returns:
+        A JSON object with a key "results" that is the list of the results of the operations, in the same order.
+          Each result is what the corresponding endpoint would return, or an object with the key "error".
+    """
+    try:
+        if (request.json is None or not isinstance(request.json.get('operations'), list)):
+            return jsonify({"error": "No operations found"}), 400
+
+        operations = request.json['operations']
+        if (len(operations) > MAX_BATCH_SIZE):
+            return jsonify({"error": f"Too many operations, the maximum is {MAX_BATCH_SIZE}"}), 400
+
+        data = runBatch(operations, driver, es, queryCache, materializedQueries)
+
+        response = jsonify({"results": data})
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
+    except Exception as e:
+        return errorResponse(e)
+
+
+@app.route("/api/batch", methods=["OPTIONS"])
+def batch_options():
+    response = jsonify({"status": "OK"})
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    response.headers.add("Access-Control-Allow-Methods", "POST, OPTIONS")
+    response.headers.add("Access-Control-Allow-Headers", "Content-Type")
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Returns the request counters and latency histograms of this worker, in the Prometheus text format."""
+    return Response(metrics.render(queryCache), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/")
 def hello():
     return "Hello, World!"
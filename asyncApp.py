@@ -0,0 +1,542 @@
+"""Async (ASGI) serving mode of the API.
+
+It exposes the same routes as app.py, but the requests wait for Neo4j and ElasticSearch without blocking a
+worker thread: the async Neo4j driver and the async ElasticSearch client share bounded connection pools,
+and every request is cancelled after REQUEST_TIMEOUT_SECONDS.
+
+Run it with an ASGI server, for example:
+    hypercorn asyncApp:app
+"""
+import asyncio
+
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from neo4j import AsyncGraphDatabase
+from elasticsearch import AsyncElasticsearch
+from ElasticQueries import cannedQuery, elasticQueries, matchIngredientsBody, matchIngredientsAndBody, queryTemplates
+from Neo4jQueries import SAMPLE_NODES, CHECK_INGREDIENT, MATCH_INGREDIENTS, GET_INGREDIENTS, MIX_AND_MAX
+from Settings import (uri, username, password, bonsai_url, use_local_indexes, index_refresh_seconds,
+                      query_cache_ttl, query_cache_max_bytes, redis_url, async_pool_size, request_timeout_seconds,
+                      hybrid_deadline_seconds, response_compression, slow_query_ms, slow_query_log, materialized_queries,
+                      snapshot_refresh_seconds, snapshot_rebuild_seconds, snapshot_dir, snapshot_change_field,
+                      search_replica, search_replica_dir, search_replica_fallback_ms, search_replica_cooldown_seconds)
+from Clients import LazyClient, elasticsearchClient, neo4jDriver
+from RecipeGraph import RefreshableIndex
+from LocalIndexes import buildLocalIndexes, buildAutocompleteIndex, buildSimilarityIndex
+from QueryCache import buildQueryCache
+from MaterializedQueries import MaterializedQueries, pushedRecipeIds
+from SearchReplica import AsyncReplicaSearchClient, Replica
+from Batch import MAX_BATCH_SIZE, cannedQueryResponse, runBatchAsync
+from Hybrid import hybridSearchAsync, parseDeadline, validateHybridRequest
+from Metrics import (InstrumentedAsyncDriver, InstrumentedAsyncElasticsearch, configureSlowQueryLog, finishRequest,
+                     metrics, recordException, startRequest, timeEncoding, timed)
+from Projection import cypherProjection, projectionFromRequest, withRecipeProjection, withSourceFilter
+from Serialization import compressResponseAsync, installJSONProvider
+from Streaming import decodeCursor, isStreamingRequest, parsePageSize, streamElasticHitsAsync, streamNeo4jMatchesAsync
+
+# Initialize Quart app
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+
+# Encode the responses with orjson when it is installed, and compress them when the client accepts it
+installJSONProvider(app)
+
+# Time the phases of every request in its Server-Timing header, and aggregate them for /metrics
+timeEncoding(app)
+configureSlowQueryLog(slow_query_ms, slow_query_log)
+
+
+@app.before_request
+async def start_timer():
+    startRequest()
+
+
+@app.after_request
+async def record_metrics(response):
+    # Registered before the compression, so that it runs after it
+    return finishRequest(request, response)
+
+
+if response_compression:
+    @app.after_request
+    async def compress_response(response):
+        with timed("compress"):
+            return await compressResponseAsync(response, request)
+
+# The clients are created when the server starts, inside its event loop
+driver = None
+es = None
+
+# The in-memory indexes are exported with the synchronous driver, in a worker thread
+syncDriver = LazyClient(neo4jDriver)
+
+localIndexes = RefreshableIndex(lambda: buildLocalIndexes(syncDriver), maxAge=index_refresh_seconds)
+similarityIndex = RefreshableIndex(lambda: buildSimilarityIndex(syncDriver, localIndexes), maxAge=index_refresh_seconds)
+autocompleteIndex = RefreshableIndex(lambda: buildAutocompleteIndex(syncDriver), maxAge=index_refresh_seconds)
+# Local replica of the index answering the searches, see SearchReplica
+replica = RefreshableIndex(lambda: Replica.open(search_replica_dir), maxAge=index_refresh_seconds)
+
+queryCache = buildQueryCache(query_cache_ttl, query_cache_max_bytes, redis_url)
+
+# The snapshots of the aggregation queries are exported with the synchronous client, in a background thread
+materializedQueries = (MaterializedQueries(LazyClient(elasticsearchClient),
+                                           {queryNumber: elasticQueries[queryNumber] for queryNumber in materialized_queries},
+                                           snapshot_refresh_seconds, snapshot_rebuild_seconds, snapshot_dir,
+                                           snapshot_change_field)
+                       if materialized_queries else None)
+
+
+@app.before_serving
+async def startup():
+    global driver, es
+    if driver is None:
+        driver = InstrumentedAsyncDriver(AsyncGraphDatabase.driver(uri, auth=(username, password),
+                                                                   max_connection_pool_size=async_pool_size,
+                                                                   connection_acquisition_timeout=request_timeout_seconds))
+    if es is None:
+        es = AsyncElasticsearch(bonsai_url, verify_certs=True, maxsize=async_pool_size, timeout=request_timeout_seconds)
+        if search_replica != "off":
+            es = AsyncReplicaSearchClient(es, replica, search_replica, search_replica_fallback_ms / 1000,
+                                          search_replica_cooldown_seconds)
+        es = InstrumentedAsyncElasticsearch(es)
+    if use_local_indexes:
+        autocompleteIndex.refreshInBackground()
+
+
+@app.after_serving
+async def shutdown():
+    await driver.close()
+    await es.close()
+
+
+async def respond(coroutine):
+    """Run the coroutine building the JSON response of a route, cancelling it after the request timeout."""
+    try:
+        data = await asyncio.wait_for(coroutine, request_timeout_seconds)
+        if isinstance(data, tuple):
+            # An error of the request, with its status
+            return jsonify(data[0]), data[1]
+        return jsonify(data)
+    except asyncio.TimeoutError as e:
+        recordException(e)
+        return jsonify({"error": "The request timed out"}), 504
+    except Exception as e:
+        return errorResponse(e)
+
+
+def errorResponse(e):
+    """Answer a request that failed with an unexpected exception. See app.errorResponse."""
+    recordException(e)
+    app.logger.exception(e)
+    return jsonify({"error": str(e)}), 500
+
+
+def limitOf(body, required=False):
+    """Read the "limit" of a JSON request body, before running the route so that a bad one is answered with a 400.
+
+    Returns:
+        The limit, None if it is missing and not required.
+
+    Raises:
+        ValueError: if the body is not a JSON object, or the limit is missing (when required) or not a positive integer.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("The request body should be a JSON object")
+    if "limit" not in body:
+        if required:
+            raise ValueError("No limit found")
+        return None
+    try:
+        limit = int(body['limit'])
+    except (TypeError, ValueError):
+        raise ValueError("Limit should be an integer")
+    if limit < 0:
+        raise ValueError("Limit should be greater than 0")
+    return limit
+
+
+def ndjsonResponse(lines):
+    """Stream an async iterable of JSON objects as newline delimited JSON."""
+    async def generate():
+        try:
+            async for line in lines:
+                yield app.json.dumps(line) + "\n"
+        except Exception as e:
+            yield app.json.dumps({"error": str(e)}) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@app.route("/api/neo4j/data", methods=["GET"])
+async def get_neo4j_data():
+    async def run():
+        async with driver.session() as session:
+            result = await session.run(SAMPLE_NODES)
+            return [record['n'] for record in await result.data()]
+
+    return await respond(run())
+
+
+@app.route("/api/neo4j/checkIngredient", methods=["POST"])
+async def check_ingredient():
+    """Check if an ingredient exists in the database. See app.check_ingredient."""
+    body = await request.get_json()
+
+    async def run():
+        ingredient = body['ingredient']
+        if use_local_indexes:
+            index = await asyncio.to_thread(autocompleteIndex.get)
+            return {"exists": index.exists(ingredient)}
+        async with driver.session() as session:
+            result = await session.run(CHECK_INGREDIENT, ingredient=ingredient)
+            data = await result.data()
+        return {"exists": len(data) > 0}
+
+    return await respond(run())
+
+
+@app.route("/api/neo4j/autocomplete", methods=["GET"])
+async def autocomplete():
+    """Suggest ingredients while the user is typing. See app.autocomplete."""
+    if ('prefix' not in request.args):
+        return jsonify({"error": "No prefix found"}), 400
+
+    async def run():
+        prefix = request.args['prefix']
+        limit = int(request.args.get('limit', 10))
+        index = await asyncio.to_thread(autocompleteIndex.get)
+        matches = index.complete(prefix, limit)
+        data = [{"ingredient": name, "recipeCount": count, "fuzzy": False} for name, count in matches]
+        if len(data) < limit:
+            suggestions = index.suggest(prefix, limit - len(data), exclude={name for name, _ in matches})
+            data += [{"ingredient": name, "recipeCount": count, "fuzzy": True} for name, count in suggestions]
+        return {"ingredients": data}
+
+    return await respond(run())
+
+
+@app.route("/api/neo4j/matchIngredients", methods=["POST"])
+async def matchIngredients():
+    """Returns the recipes that contain at least one of the ingredients. See app.matchIngredients."""
+    body = await request.get_json()
+    try:
+        limit = limitOf(body)
+        if not isinstance(body.get('ingredients'), list):
+            raise ValueError("No ingredients found")
+        projection = projectionFromRequest(request, body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if isStreamingRequest(request, body):
+        cursor = body.get('cursor')
+        try:
+            after = decodeCursor(cursor, length=2) if cursor is not None else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return ndjsonResponse(streamNeo4jMatchesAsync(driver, body['ingredients'], limit, after, projection))
+
+    async def run():
+        ingredients = body['ingredients']
+        if use_local_indexes:
+            index = await asyncio.to_thread(localIndexes.get)
+            matches = await asyncio.to_thread(index["matchIngredients"].topK, ingredients, limit)
+            recipes = await fetchRecipesAsync([match["recipeId"] for match in matches], projection)
+            return {"recipes": [{"matchingScore": match['matchingScore'], "recipe": recipes[match['recipeId']],
+                                 "matchingIngredients": match['matchingIngredients']}
+                                for match in matches if match['recipeId'] in recipes]}
+
+        limitString = "" if limit is None else f" LIMIT {limit}"
+        async with driver.session() as session:
+            result = await session.run(withRecipeProjection(MATCH_INGREDIENTS, projection) + limitString,
+                                       ingredients=ingredients)
+            data = [{"matchingScore": record['matchingScore'], "recipe": record['r'], "matchingIngredients": record['matchingIngredients']}
+                    for record in await result.data()]
+        return {"recipes": data}
+
+    return await respond(run())
+
+
+async def fetchRecipesAsync(recipeIds, projection=None):
+    """Async version of RecipeGraph.fetchRecipes."""
+    if len(recipeIds) == 0:
+        return {}
+    async with driver.session() as session:
+        result = await session.run(f"MATCH (r:Recipe) WHERE r.id IN $recipeIds RETURN {cypherProjection(projection)} AS r",
+                                   recipeIds=list(recipeIds))
+        return {record['r']['id']: record['r'] for record in await result.data()}
+
+
+async def searchRecipes(body):
+    """Shared implementation of the ElasticSearch ingredient matching routes."""
+    limit = body['limit']
+    if isStreamingRequest(request, body):
+        cursor = body.get('cursor')
+        try:
+            after = decodeCursor(cursor) if cursor is not None else None
+            pageSize = parsePageSize(body.get('pageSize'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return ndjsonResponse(streamElasticHitsAsync(es, body['query'], limit, after, pageSize))
+
+    async def run():
+        result = await es.search(index="recipeswithreviews", body=body['query'], size=limit)
+        return {"recipes": [{"matchingScore": record['_score'], "recipe": record['_source']}
+                            for record in result['hits']['hits']]}
+
+    return await respond(run())
+
+
+@app.route("/api/elasticsearch/matchIngredients", methods=["POST"])
+async def matchIngredients_es():
+    """Returns the recipes that contain at least one of the ingredients. See app.matchIngredients_es."""
+    body = await request.get_json()
+    try:
+        limit = limitOf(body, required=True)
+        query = withSourceFilter(matchIngredientsBody(body['ingredients']), projectionFromRequest(request, body))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return errorResponse(e)
+    return await searchRecipes({**body, "query": query, "limit": limit})
+
+
+@app.route("/api/elasticsearch/matchIngredientsAnd", methods=["POST"])
+async def matchIngredientsAnd_es():
+    """Returns the recipes that contain the last ingredient and at least one other. See app.matchIngredientsAnd_es."""
+    body = await request.get_json()
+    try:
+        limit = limitOf(body, required=True)
+        query = withSourceFilter(matchIngredientsAndBody(body['ingredients']), projectionFromRequest(request, body))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return errorResponse(e)
+    return await searchRecipes({**body, "query": query, "limit": limit})
+
+
+@app.route("/api/hybrid/matchIngredients", methods=["POST"])
+async def matchIngredients_hybrid():
+    """Returns the recipes matching the ingredients according to both Neo4j and ElasticSearch. See app.matchIngredients_hybrid."""
+    body = await request.get_json()
+    try:
+        parameters = validateHybridRequest(body)
+        projection = projectionFromRequest(request, body)
+        deadline = parseDeadline(body.get('deadline'), hybrid_deadline_seconds)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return await respond(hybridSearchAsync(driver, es, deadline=deadline, projection=projection, **parameters))
+
+
+@app.route("/api/neo4j/getIngredients", methods=["POST"])
+async def getIngredients():
+    """Returns the ingredients of a recipe. See app.getIngredients."""
+    body = await request.get_json()
+
+    async def run():
+        async with driver.session() as session:
+            result = await session.run(GET_INGREDIENTS, recipe=body['recipeId'])
+            record = await result.single()
+        return {"ingredients": record['ingredients']}
+
+    return await respond(run())
+
+
+@app.route("/api/neo4j/mixAndMax", methods=["POST"])
+async def mixAndMax():
+    """Returns the ingredients that combine with the given ones in many recipes. See app.mixAndMax."""
+    body = await request.get_json()
+    try:
+        limit = limitOf(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async def run():
+        ingredients = body['ingredients']
+        if use_local_indexes:
+            index = await asyncio.to_thread(localIndexes.get)
+            return {"ingredients": await asyncio.to_thread(index["mixAndMax"].query, ingredients, limit)}
+
+        limitString = "" if limit is None else f" LIMIT {limit}"
+        async with driver.session() as session:
+            result = await session.run(MIX_AND_MAX + limitString, providedIngredients=ingredients)
+            return {"ingredients": await result.data()}
+
+    return await respond(run())
+
+
+@app.route("/api/neo4j/similarRecipes", methods=["POST"])
+async def similarRecipes():
+    """Returns the recipes whose ingredients are the most similar to the ones of a recipe. See app.similarRecipes."""
+    body = await request.get_json(silent=True)
+    try:
+        limit = limitOf(body)
+        if ("recipeId" not in body and not isinstance(body.get('ingredients'), list)):
+            raise ValueError("No recipeId or ingredients found")
+        projection = projectionFromRequest(request, body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limit = 10 if limit is None else limit
+
+    index = similarityIndex.getIfReady()
+    if index is None:
+        return jsonify({"error": "The similarity index is being built, retry later"}), 503, {"Retry-After": "30"}
+
+    async def run():
+        if "recipeId" in body:
+            matches = await asyncio.to_thread(index.similarRecipes, body['recipeId'], limit)
+            if matches is None:
+                return {"error": "Unknown recipe"}, 404
+        else:
+            matches = await asyncio.to_thread(index.similarToIngredients, body['ingredients'], limit)
+        recipes = await fetchRecipesAsync([match["recipeId"] for match in matches], projection)
+        return {"recipes": [{"similarity": match['similarity'], "recipe": recipes[match['recipeId']],
+                             "commonIngredients": match['commonIngredients']}
+                            for match in matches if match['recipeId'] in recipes]}
+
+    return await respond(run())
+
+
+@app.route("/api/elasticsearch/queries", methods=["GET"])
+async def elastic_queries():
+    """Run a canned ElasticSearch query. See app.elastic_queries."""
+    if ('queryNumber' not in request.args):
+        return jsonify({"error": "No query number found"}), 400
+
+    if ('limit' not in request.args):
+        return jsonify({"error": "No limit found"}), 400
+
+    try:
+        queryNumber = int(request.args.get('queryNumber'))
+        limit = int(request.args['limit'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if (queryNumber < 0 or queryNumber >= len(elasticQueries)):
+        return jsonify({"error": f"Invalid query number, it should be between 0 and {len(elasticQueries) - 1}"}), 400
+
+    if (limit < 0):
+        return jsonify({"error": "Limit should be greater than 0"}), 400
+
+    try:
+        projection = projectionFromRequest(request)
+        query, variant = cannedQuery(queryNumber, request.args, projection)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The aggregations with the default parameters can be answered from their snapshot
+    materialized = materializedQueries.response(queryNumber) if materializedQueries is not None and variant is None else None
+
+    if isStreamingRequest(request):
+        if 'aggs' in query:
+            # Aggregations are a single object, there is nothing to page through
+            async def aggregations():
+                yield materialized or cannedQueryResponse(await es.search(index="recipeswithreviews", body=query, size=limit))
+
+            return ndjsonResponse(aggregations())
+        cursor = request.args.get('cursor')
+        try:
+            after = decodeCursor(cursor) if cursor is not None else None
+            pageSize = parsePageSize(request.args.get('pageSize'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return ndjsonResponse(streamElasticHitsAsync(es, query, limit, after, pageSize))
+
+    if materialized is not None:
+        return jsonify(materialized)
+
+    async def run():
+        cached = queryCache.get(queryNumber, limit, variant) if queryCache is not None else None
+        if cached is not None:
+            return cached
+        data = cannedQueryResponse(await es.search(index="recipeswithreviews", body=query, size=limit))
+        if queryCache is not None:
+            queryCache.put(queryNumber, limit, data, variant)
+        return data
+
+    return await respond(run())
+
+
+@app.route("/api/elasticsearch/queries/cache", methods=["GET"])
+async def elastic_queries_cache():
+    """Returns the hit, miss and eviction counters of the canned queries cache."""
+    if queryCache is None:
+        return jsonify({"error": "The query cache is disabled"}), 404
+    return jsonify(queryCache.statistics())
+
+
+@app.route("/api/elasticsearch/queries/snapshots", methods=["GET"])
+async def elastic_queries_snapshots():
+    """Returns the number of recipes and the build and refresh dates of the snapshots of the aggregation queries."""
+    if materializedQueries is None:
+        return jsonify({"error": "The materialized queries are disabled"}), 404
+    return jsonify(materializedQueries.statistics())
+
+
+@app.route("/api/elasticsearch/queries/snapshots/refresh", methods=["POST"])
+async def elastic_queries_snapshots_refresh():
+    """Refresh the snapshots of the aggregation queries with the recipes changed by the ingestion. See app.elastic_queries_snapshots_refresh."""
+    if materializedQueries is None:
+        return jsonify({"error": "The materialized queries are disabled"}), 404
+    try:
+        recipeIds = pushedRecipeIds(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async def run():
+        await asyncio.to_thread(materializedQueries.push, recipeIds)
+        return {"recipes": len(recipeIds), "pending": materializedQueries.statistics()["pending"]}
+
+    return await respond(run())
+
+
+@app.route("/api/elasticsearch/queries/templates", methods=["GET"])
+async def elastic_queries_templates():
+    """Returns the canned queries with the type, the default value and the bounds of their parameters."""
+    return jsonify({"queries": [template.describe() for template in queryTemplates]})
+
+
+@app.route("/api/elasticsearch/queries/multi", methods=["POST"])
+async def elastic_queries_multi():
+    """Run several canned ElasticSearch queries with a single msearch request. See app.elastic_queries_multi."""
+    body = await request.get_json()
+    if (body is None or not isinstance(body.get('queries'), list)):
+        return jsonify({"error": "No queries found"}), 400
+
+    queries = body['queries']
+    if (len(queries) > MAX_BATCH_SIZE):
+        return jsonify({"error": f"Too many queries, the maximum is {MAX_BATCH_SIZE}"}), 400
+
+    async def run():
+        operations = [{**query, "op": "elasticQuery"} if isinstance(query, dict) else query for query in queries]
+        return {"results": await runBatchAsync(operations, driver, es, queryCache, materializedQueries)}
+
+    return await respond(run())
+
+
+@app.route("/api/batch", methods=["POST"])
+async def batch():
+    """Execute many lookups in one request, the three operation types concurrently. See app.batch."""
+    body = await request.get_json()
+    if (body is None or not isinstance(body.get('operations'), list)):
+        return jsonify({"error": "No operations found"}), 400
+
+    operations = body['operations']
+    if (len(operations) > MAX_BATCH_SIZE):
+        return jsonify({"error": f"Too many operations, the maximum is {MAX_BATCH_SIZE}"}), 400
+
+    async def run():
+        return {"results": await runBatchAsync(operations, driver, es, queryCache, materializedQueries)}
+
+    return await respond(run())
+
+
+@app.route("/metrics", methods=["GET"])
+async def prometheus_metrics():
+    """Returns the request counters and latency histograms of this worker, in the Prometheus text format."""
+    return Response(metrics.render(queryCache), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/")
+async def hello():
+    return "Hello, World!"
@@ -0,0 +1,174 @@
+"""Load test of the synchronous (WSGI) app against the async (ASGI) app, with backends of fixed latency.
+
+Each server runs in its own process against the stand-ins of benchmarks.fakeBackends, which wait for the
+given latency on every query like a remote database would. The synchronous app is served by a pool of
+worker threads, the async app by Hypercorn on a single event loop. Many concurrent clients then send a mix
+of Neo4j and ElasticSearch requests, and the throughput and the latency percentiles are reported.
+
+    python -m benchmarks.asyncLoadTest --clients 200 --requests 2000 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks import fakeBackends
+
+REQUESTS = [
+    ("post", "/api/elasticsearch/matchIngredients", {"ingredients": ["salt", "butter"], "limit": 10}),
+    ("post", "/api/neo4j/getIngredients", {"recipeId": 1}),
+    ("get", "/api/elasticsearch/queries?queryNumber=0&limit=10", None),
+    ("post", "/api/batch", {"operations": [{"op": "checkIngredient", "ingredient": "salt"},
+                                           {"op": "getIngredients", "recipeId": 1},
+                                           {"op": "elasticQuery", "queryNumber": 1, "limit": 5}]}),
+]
+
+
+def handler(numRecipes):
+    """Neo4j handler answering the queries of REQUESTS."""
+    matches = fakeBackends.matchIngredientsHandler(numRecipes)
+
+    def answer(query, parameters):
+        if "recipe" in parameters:
+            return [{"ingredients": [f"ingredient{k}" for k in range(8)]}]
+        if "items" in parameters:
+            return ({"ingredient": item, "exists": True, "recipe": item, "ingredients": ["salt"]}
+                    for item in parameters["items"])
+        return matches(query, parameters)
+    return answer
+
+
+def serve(mode, port, latency, workers, numRecipes=1000):
+    """Serve the app in the current process until it is killed."""
+    os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+    os.environ.setdefault("BONSAI_URL", "http://localhost:9200")
+    os.environ["QUERY_CACHE_TTL"] = "0"
+
+    if mode == "sync":
+        from werkzeug.serving import BaseWSGIServer
+        import app
+
+        app.driver = fakeBackends.FakeNeo4jDriver(handler(numRecipes), latency)
+        app.es = fakeBackends.FakeElasticsearch(numRecipes, latency)
+
+        class PooledWSGIServer(BaseWSGIServer):
+            """A WSGI server answering the requests with a fixed number of worker threads."""
+            pool = ThreadPoolExecutor(workers)
+            request_queue_size = 1024
+
+            def process_request(self, request, client_address):
+                self.pool.submit(self._processRequest, request, client_address)
+
+            def _processRequest(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+
+        PooledWSGIServer("127.0.0.1", port, app.app).serve_forever()
+    else:
+        from hypercorn.asyncio import serve as hypercornServe
+        from hypercorn.config import Config
+        import asyncApp
+
+        asyncApp.driver = fakeBackends.AsyncFakeNeo4jDriver(handler(numRecipes), latency)
+        asyncApp.es = fakeBackends.AsyncFakeElasticsearch(numRecipes, latency)
+        config = Config()
+        config.bind = [f"127.0.0.1:{port}"]
+        config.backlog = 1024
+        config.accesslog = None
+        asyncio.run(hypercornServe(asyncApp.app, config))
+
+
+async def load(port, clients, numRequests):
+    """Send numRequests requests from clients concurrent connections.
+
+    Returns:
+        The elapsed time, the list of latencies in seconds and the number of failed requests.
+    """
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    queue = iter(range(numRequests))
+
+    async def client(session):
+        nonlocal errors
+        for position in queue:
+            method, path, body = REQUESTS[position % len(REQUESTS)]
+            start = time.perf_counter()
+            try:
+                async with session.request(method, f"http://127.0.0.1:{port}{path}", json=body) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(clients)))
+        return time.perf_counter() - start, latencies, errors
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def waitForServer(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"The server on port {port} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="total number of requests per mode")
+    parser.add_argument("--latency", type=float, default=0.05, help="latency of every backend query, in seconds")
+    parser.add_argument("--workers", type=int, default=16, help="worker threads of the synchronous server")
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--serve", choices=["sync", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.latency, args.workers)
+        return
+
+    print(f"{args.clients} clients, {args.requests} requests, {args.latency * 1000:.0f} ms backend latency")
+    print(f"{'mode':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes:
+        port = freePort()
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.asyncLoadTest", "--serve", mode,
+                                   "--port", str(port), "--latency", str(args.latency), "--workers", str(args.workers)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            waitForServer(port)
+            elapsed, latencies, errors = asyncio.run(load(port, args.clients, args.requests))
+        finally:
+            server.terminate()
+            server.wait()
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print(f"{mode:>6} {len(latencies) / elapsed:>8.0f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
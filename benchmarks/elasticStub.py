@@ -0,0 +1,86 @@
+"""Local HTTP server speaking the part of the ElasticSearch REST API used by the app: search and msearch.
+
+The app talks to it through the real elasticsearch client, so that the request serialization, the HTTP round
+trip and the response parsing are measured too. The hits are generated by FakeElasticsearch.
+
+    stub = ElasticStub(numDocs=10000)
+    stub.start()
+    es = Elasticsearch(stub.url)
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fakeBackends import FakeElasticsearch
+
+
+class ElasticStub:
+    """ElasticSearch stand-in served over HTTP on a local port, in a background thread."""
+
+    def __init__(self, numDocs, numReviews=0, port=0):
+        self.backend = FakeElasticsearch(numDocs, numReviews=numReviews)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _handlerClass(self.backend))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _handlerClass(backend):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are written separately, without this the client waits for a delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            self._send(200, {})
+
+        def do_GET(self):
+            self.do_POST()
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = self.rfile.read(length) if length else b""
+            segments = [segment for segment in url.path.split("/") if segment]
+            if segments and segments[-1] == "_search":
+                body = json.loads(payload) if payload else {}
+                size = int(query["size"][0]) if "size" in query else None
+                index = segments[0] if len(segments) > 1 else None
+                self._send(200, backend._search(index, body, size))
+            elif segments and segments[-1] == "_msearch":
+                lines = [json.loads(line) for line in payload.decode().splitlines() if line.strip()]
+                self._send(200, backend._msearch(lines))
+            elif not segments:
+                self._send(200, {"name": "elastic-stub", "version": {"number": "7.9.0"}, "tagline": "You Know, for Search"})
+            else:
+                self._send(404, {"error": {"type": "unsupported", "reason": f"{url.path} is not supported by the stub"},
+                                 "status": 404})
+
+        def _send(self, status, document):
+            data = json.dumps(document).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+    return Handler
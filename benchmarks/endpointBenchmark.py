@@ -0,0 +1,233 @@
+"""Benchmark of every route of the Flask app against local Neo4j and ElasticSearch stand-ins.
+
+The Neo4j driver is replaced by benchmarks.fakeBackends.FakeNeo4jDriver answering from a generated recipe
+graph, and the app talks to ElasticSearch through the real client and a local HTTP stub
+(benchmarks.elasticStub). Each route is driven by a number of concurrent clients, and its latency
+percentiles, throughput, payload size and allocations are reported, with the median time of each phase of the
+requests according to their Server-Timing header. The results are written as JSON, and
+a previous results file can be given to compare the two runs.
+
+    python -m benchmarks.endpointBenchmark --recipes 20000 --concurrency 1 8 --output results.json
+    python -m benchmarks.endpointBenchmark --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.syntheticData import sampleQueries, syntheticRecipeGraph
+
+
+def routes(queries):
+    """The requests of each route, as functions from a request number to (method, path, JSON body)."""
+    def ingredients(position):
+        return queries[position % len(queries)]
+
+    return {
+        "neo4j/data": lambda i: ("get", "/api/neo4j/data", None),
+        "neo4j/checkIngredient": lambda i: ("post", "/api/neo4j/checkIngredient", {"ingredient": ingredients(i)[0]}),
+        "neo4j/autocomplete": lambda i: ("get", f"/api/neo4j/autocomplete?prefix={ingredients(i)[0][:6]}", None),
+        "neo4j/matchIngredients": lambda i: ("post", "/api/neo4j/matchIngredients",
+                                             {"ingredients": ingredients(i), "limit": 20}),
+        "neo4j/getIngredients": lambda i: ("post", "/api/neo4j/getIngredients", {"recipeId": i}),
+        "neo4j/mixAndMax": lambda i: ("post", "/api/neo4j/mixAndMax", {"ingredients": ingredients(i), "limit": 20}),
+        "neo4j/similarRecipes": lambda i: ("post", "/api/neo4j/similarRecipes", {"recipeId": i, "limit": 10}),
+        "elasticsearch/matchIngredients": lambda i: ("post", "/api/elasticsearch/matchIngredients",
+                                                     {"ingredients": ingredients(i), "limit": 20}),
+        "elasticsearch/matchIngredientsAnd": lambda i: ("post", "/api/elasticsearch/matchIngredientsAnd",
+                                                        {"ingredients": ingredients(i), "limit": 20}),
+        "elasticsearch/queries": lambda i: ("get", f"/api/elasticsearch/queries?queryNumber={i % 10}&limit=20", None),
+        # The carousels of the home page, in one request
+        "elasticsearch/queries/multi": lambda i: ("post", "/api/elasticsearch/queries/multi", {"queries": [
+            {"queryNumber": (i + offset) % 10, "limit": 10, "view": "card"} for offset in range(5)]}),
+        "hybrid/matchIngredients": lambda i: ("post", "/api/hybrid/matchIngredients",
+                                              {"ingredients": ingredients(i), "limit": 20}),
+        "batch": lambda i: ("post", "/api/batch", {"operations": [
+            {"op": "checkIngredient", "ingredient": ingredients(i)[0]},
+            {"op": "getIngredients", "recipeId": i},
+            {"op": "elasticQuery", "queryNumber": i % 10, "limit": 10}]}),
+    }
+
+
+def send(client, request):
+    method, path, body = request
+    if method == "post":
+        return client.post(path, json=body)
+    return client.get(path)
+
+
+def percentiles(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "mean": round(statistics.fmean(latencies), 3)}
+
+
+def phaseMedians(serverTimings):
+    """Median duration in ms of each phase of the Server-Timing headers."""
+    phases = {}
+    for header in serverTimings:
+        for metric in header.split(","):
+            name, _, duration = metric.strip().partition(";dur=")
+            phases.setdefault(name, []).append(float(duration))
+    return {name: round(statistics.median(durations), 3) for name, durations in phases.items()}
+
+
+def drive(app, request, numRequests, concurrency):
+    """Send numRequests requests from concurrency threads, each with its own test client.
+
+    Returns:
+        The elapsed time in seconds, the latencies in ms, the sizes of the responses, their Server-Timing headers
+          and the number of errors.
+    """
+    latencies = []
+    sizes = []
+    serverTimings = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(numRequests))
+
+    def worker():
+        nonlocal errors
+        client = app.test_client()
+        for position in counter:
+            start = time.perf_counter()
+            response = send(client, request(position))
+            size = len(response.get_data())
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                sizes.append(size)
+                if "Server-Timing" in response.headers:
+                    serverTimings.append(response.headers["Server-Timing"])
+                errors += response.status_code != 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return time.perf_counter() - start, latencies, sizes, serverTimings, errors
+
+
+def allocations(app, request, numRequests):
+    """Median peak of the memory allocated by one request, and of the number of allocations it leaves."""
+    client = app.test_client()
+    peaks = []
+    blocks = []
+    for position in range(numRequests):
+        tracemalloc.start()
+        before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        send(client, request(position))
+        after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        blocks.append(after - before)
+        tracemalloc.stop()
+    return {"peakBytes": int(statistics.median(peaks)), "retainedBlocks": int(statistics.median(blocks))}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "commit": commit or None}
+
+
+def compare(results, baseline):
+    """Print the change of the latency and of the throughput of each route against a previous run."""
+    previous = {(result["route"], result["concurrency"]): result for result in baseline["results"]}
+    print(f"\n{'route':>34} {'conc':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9}")
+    for result in results:
+        old = previous.get((result["route"], result["concurrency"]))
+        if old is None:
+            continue
+        changes = [(result["latencyMs"][key] / old["latencyMs"][key] - 1) * 100 if old["latencyMs"][key] else 0.0
+                   for key in ("p50", "p95", "p99")]
+        changes.append((result["throughput"] / old["throughput"] - 1) * 100 if old["throughput"] else 0.0)
+        print(f"{result['route']:>34} {result['concurrency']:>5} " + " ".join(f"{change:>+8.1f}%" for change in changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=20000, help="number of recipes of the generated graph and index")
+    parser.add_argument("--ingredients", type=int, default=2000, help="number of distinct ingredients")
+    parser.add_argument("--reviews", type=int, default=3, help="number of reviews of each ElasticSearch document")
+    parser.add_argument("--query-ingredients", type=int, default=3, help="number of ingredients of each request")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and concurrency")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="numbers of concurrent clients")
+    parser.add_argument("--allocation-requests", type=int, default=5, help="requests traced for the allocations")
+    parser.add_argument("--routes", nargs="+", help="routes to benchmark, all of them by default")
+    parser.add_argument("--local-indexes", action="store_true", help="serve the graph routes from the in-memory indexes")
+    parser.add_argument("--cache", action="store_true", help="keep the canned queries cache enabled")
+    parser.add_argument("--output", help="file where the results are written as JSON")
+    parser.add_argument("--baseline", help="results file of a previous run to compare with")
+    args = parser.parse_args()
+
+    os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+    os.environ.setdefault("BONSAI_URL", "http://localhost:9200")
+    # Enabled after the import, so that the indexes are not built in the background with the real driver
+    os.environ["USE_LOCAL_INDEXES"] = "false"
+    if not args.cache:
+        os.environ["QUERY_CACHE_TTL"] = "0"
+
+    from elasticsearch import Elasticsearch
+    from benchmarks.elasticStub import ElasticStub
+    from benchmarks.fakeBackends import FakeNeo4jDriver, graphHandler
+    from Metrics import InstrumentedDriver, InstrumentedElasticsearch
+
+    graph = syntheticRecipeGraph(args.recipes, args.ingredients)
+    queries = sampleQueries(graph, args.query_ingredients, 100)
+    stub = ElasticStub(args.recipes, numReviews=args.reviews).start()
+
+    import app
+
+    app.driver = InstrumentedDriver(FakeNeo4jDriver(graphHandler(graph)))
+    app.use_local_indexes = args.local_indexes
+    app.es = InstrumentedElasticsearch(Elasticsearch(stub.url, maxsize=max(args.concurrency)))
+    if app.materializedQueries is not None:
+        app.materializedQueries.es = app.es
+    requests = routes(queries)
+    selected = args.routes or list(requests)
+
+    results = []
+    print(f"{'route':>34} {'conc':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'KiB':>8} "
+          f"{'peak KiB':>9} {'errors':>6}")
+    for route in selected:
+        request = requests[route]
+        # Warm up: the first request builds the indexes and the connections
+        if route == "neo4j/similarRecipes":
+            # Built in the background by the first request, which is answered with a 503
+            app.similarityIndex.refresh()
+        send(app.app.test_client(), request(0))
+        memory = allocations(app.app, request, args.allocation_requests)
+        for concurrency in args.concurrency:
+            elapsed, latencies, sizes, serverTimings, errors = drive(app.app, request, args.requests, concurrency)
+            result = {"route": route, "concurrency": concurrency, "requests": len(latencies), "errors": errors,
+                      "throughput": round(len(latencies) / elapsed, 2), "latencyMs": percentiles(latencies),
+                      "phasesMs": phaseMedians(serverTimings), "payloadBytes": int(statistics.median(sizes)),
+                      "allocations": memory}
+            results.append(result)
+            print(f"{route:>34} {concurrency:>5} {result['latencyMs']['p50']:>8.2f} {result['latencyMs']['p95']:>8.2f} "
+                  f"{result['latencyMs']['p99']:>8.2f} {result['throughput']:>8.1f} {result['payloadBytes'] / 1024:>8.1f} "
+                  f"{memory['peakBytes'] / 1024:>9.1f} {errors:>6}")
+    stub.stop()
+
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+              "environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
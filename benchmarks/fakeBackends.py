@@ -0,0 +1,296 @@
+"""Deterministic in-process stand-ins for the Neo4j driver and the ElasticSearch client.
+
+They generate the recipes on the fly, so that large result sets can be served without a database and
+without holding the whole dataset in memory. The latency argument simulates the round trip to a remote
+database: the synchronous stand-ins block for it, the async ones (AsyncFakeNeo4jDriver and
+AsyncFakeElasticsearch) await it.
+"""
+import asyncio
+import time
+
+
+def fakeRecipe(recipeId, descriptionLength=400, numReviews=0):
+    """A recipe document shaped like the ones of the recipeswithreviews index."""
+    recipe = {
+        "id": recipeId,
+        "RecipeId": recipeId,
+        "Name": f"Recipe {recipeId}",
+        "Description": ("A tasty recipe. " * (descriptionLength // 16 + 1))[:descriptionLength],
+        "RecipeServings": recipeId % 8 + 1,
+        "AggregatedRating": round(1 + (recipeId * 7919 % 400) / 100, 2),
+        "RecipeIngredientParts": [f"ingredient{(recipeId * k) % 97}" for k in range(1, 8)],
+    }
+    if numReviews:
+        recipe["ReviewCount"] = numReviews
+        recipe["Reviews"] = [{"ReviewId": recipeId * 1000 + k, "AuthorId": (recipeId + k) * 31 % 10007,
+                              "Rating": (recipeId + k) % 5 + 1,
+                              "Review": ("Loved it, will make it again. " * 6)[:150 + (recipeId * k) % 60]}
+                             for k in range(numReviews)]
+    return recipe
+
+
+def sourceFilter(document, source):
+    """Apply an ElasticSearch _source filter ({"includes": [...]}, {"excludes": [...]}, a list or a single field
+    name, or a boolean) to a document. Dotted names select the fields of the objects of a nested array."""
+    if source is None or source is True:
+        return document
+    if source is False:
+        return {}
+    if isinstance(source, str):
+        source = [source]
+    if isinstance(source, list):
+        source = {"includes": source}
+    if "excludes" in source:
+        return {key: value for key, value in document.items() if key not in source["excludes"]}
+    projected = {}
+    for field in source["includes"]:
+        name, _, nested = field.partition(".")
+        if name not in document:
+            continue
+        if nested and isinstance(document[name], list):
+            projected[name] = [{nested: item[nested]} for item in document[name] if nested in item]
+        else:
+            projected[name] = document[name]
+    return projected
+
+
+class FakeRecord(dict):
+    def data(self):
+        return dict(self)
+
+
+class FakeResult:
+    """A result whose records are produced lazily, like a Neo4j result cursor."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+
+    def __iter__(self):
+        return (FakeRecord(row) for row in self.rows)
+
+    def data(self):
+        return [dict(row) for row in self.rows]
+
+    def single(self):
+        return next(iter(self), None)
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **kwargs):
+        self.driver.queries += 1
+        if self.driver.latency:
+            time.sleep(self.driver.latency)
+        return FakeResult(self.driver.handler(getattr(query, "text", query), {**(parameters or {}), **kwargs}))
+
+
+class FakeNeo4jDriver:
+    """Neo4j driver whose queries are answered by a handler(query, parameters) returning an iterable of rows."""
+
+    def __init__(self, handler, latency=0):
+        self.handler = handler
+        self.latency = latency
+        self.queries = 0
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def close(self):
+        pass
+
+
+def matchIngredientsHandler(numRecipes):
+    """Handler answering the matchIngredients queries with numRecipes generated matches."""
+    def handler(query, parameters):
+        if "matchingScore" not in query:
+            return []
+        ingredients = parameters.get("ingredients", [])
+        afterId = parameters.get("afterId")
+        start = 0 if afterId is None else afterId + 1
+        end = numRecipes if parameters.get("limit") is None else min(numRecipes, start + parameters["limit"])
+        # Every recipe matches all the ingredients, so the order is by recipe id
+        return ({"r": fakeRecipe(recipeId), "matchingScore": len(ingredients), "matchingIngredients": list(ingredients)}
+                for recipeId in range(start, end))
+    return handler
+
+
+class FakeElasticsearch:
+    """ElasticSearch client serving numDocs generated recipes, sorted by a decreasing score.
+
+    It supports size, the search_after pagination, _source filtering and msearch. Aggregation queries get an
+    empty aggregations object. Each document has numReviews reviews.
+    """
+
+    def __init__(self, numDocs, latency=0, numReviews=0):
+        self.numDocs = numDocs
+        self.latency = latency
+        self.numReviews = numReviews
+        self.searches = 0
+
+    def search(self, index=None, body=None, size=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._search(index, body, size)
+
+    def msearch(self, body=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._msearch(body)
+
+    def close(self):
+        pass
+
+    def _search(self, index=None, body=None, size=None):
+        self.searches += 1
+        body = body or {}
+        if "aggs" in body or "aggregations" in body:
+            return {"hits": {"total": {"value": self.numDocs}, "hits": []}, "aggregations": {}}
+        size = size if size is not None else body.get("size", 10)
+        start = 0
+        if "search_after" in body:
+            start = body["search_after"][-1] + 1
+        hits = [{"_index": index, "_id": str(recipeId), "_score": float(self.numDocs - recipeId),
+                 "_source": sourceFilter(fakeRecipe(recipeId, numReviews=self.numReviews), body.get("_source")),
+                 "sort": [float(self.numDocs - recipeId), recipeId]}
+                for recipeId in range(start, min(self.numDocs, start + size))]
+        return {"hits": {"total": {"value": self.numDocs}, "hits": hits}}
+
+    def _msearch(self, body):
+        return {"responses": [self._search(index=header.get("index"), body=search)
+                              for header, search in zip(body[::2], body[1::2])]}
+
+
+class AsyncFakeResult(FakeResult):
+    def __aiter__(self):
+        return self._records()
+
+    async def _records(self):
+        for row in self.rows:
+            yield FakeRecord(row)
+
+    async def data(self):
+        return FakeResult.data(self)
+
+    async def single(self):
+        return FakeResult.single(self)
+
+
+class AsyncFakeSession(FakeSession):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def run(self, query, parameters=None, **kwargs):
+        self.driver.queries += 1
+        if self.driver.latency:
+            await asyncio.sleep(self.driver.latency)
+        return AsyncFakeResult(self.driver.handler(getattr(query, "text", query), {**(parameters or {}), **kwargs}))
+
+
+class AsyncFakeNeo4jDriver(FakeNeo4jDriver):
+    """Async version of FakeNeo4jDriver, shaped like a neo4j AsyncDriver."""
+
+    def session(self, **kwargs):
+        return AsyncFakeSession(self)
+
+    async def close(self):
+        pass
+
+
+class AsyncFakeElasticsearch(FakeElasticsearch):
+    """Async version of FakeElasticsearch, shaped like an AsyncElasticsearch client."""
+
+    async def search(self, index=None, body=None, size=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._search(index, body, size)
+
+    async def msearch(self, body=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._msearch(body)
+
+    async def close(self):
+        pass
+
+
+def graphHandler(graph):
+    """Handler answering every Cypher query of the app from a RecipeGraph, like a Neo4j holding that graph.
+
+    The matchIngredients and mixAndMax queries are answered by the in-memory indexes, which compute the
+    same results as the Cypher. The recipes are generated with fakeRecipe, and map projections are ignored:
+    the whole recipe is returned.
+    """
+    import re
+
+    from MatchIngredients import IngredientMatchIndex
+    from MixAndMax import MixAndMaxIndex
+
+    matches = IngredientMatchIndex(graph)
+    mixAndMax = MixAndMaxIndex(graph)
+    limitPattern = re.compile(r"LIMIT (\d+)\s*$")
+
+    def ingredientsOf(recipeId):
+        position = graph.recipePositions.get(recipeId)
+        if position is None:
+            return []
+        return [graph.ingredientNames[i] for i in graph.ingredientsOf(position).tolist()]
+
+    def matchRows(rows):
+        return ({"r": fakeRecipe(row["recipeId"]), "matchingScore": row["matchingScore"],
+                 "matchingIngredients": row["matchingIngredients"]} for row in rows)
+
+    def handler(query, parameters):
+        found = limitPattern.search(query)
+        limit = int(found.group(1)) if found else None
+        if "$afterScore" in query:
+            afterScore, afterId = parameters.get("afterScore"), parameters.get("afterId")
+            rows = (row for row in matches.topK(parameters["ingredients"])
+                    if afterScore is None or row["matchingScore"] < afterScore
+                    or (row["matchingScore"] == afterScore and row["recipeId"] > afterId))
+            if parameters.get("limit") is not None:
+                rows = (row for _, row in zip(range(parameters["limit"]), rows))
+            return matchRows(rows)
+        if "matchingScore" in query:
+            return matchRows(matches.topK(parameters["ingredients"], limit))
+        if "$providedIngredients" in query:
+            return mixAndMax.query(parameters["providedIngredients"], limit)
+        if "UNWIND $items AS ingredient" in query:
+            return [{"ingredient": name, "exists": name in graph.ingredientPositions} for name in parameters["items"]]
+        if "UNWIND $items AS recipe" in query:
+            return [{"recipe": recipeId, "ingredients": ingredientsOf(recipeId)} for recipeId in parameters["items"]]
+        if "$ingredient" in query:
+            name = parameters["ingredient"]
+            return [{"n": {"name": name}}] if name in graph.ingredientPositions else []
+        if "$recipeIds" in query:
+            return [{"r": fakeRecipe(recipeId)} for recipeId in parameters["recipeIds"] if recipeId in graph.recipePositions]
+        if "$recipe" in query:
+            return [{"ingredients": ingredientsOf(parameters["recipe"])}]
+        if "recipeCount" in query:
+            return [{"name": name, "recipeCount": count}
+                    for name, count in zip(graph.ingredientNames, graph.recipeCounts().tolist())]
+        if "reviewCount" in query:
+            return [{"recipeId": recipeId, "reviewCount": count, "avgRating": None if rating != rating else rating}
+                    for recipeId, count, rating in zip(graph.recipeIds, graph.reviewCounts.tolist(),
+                                                       graph.avgRatings.tolist()) if count > 0]
+        if "COLLECT(DISTINCT i.name)" in query:
+            return [{"recipeId": recipeId, "ingredients": ingredientsOf(recipeId)} for recipeId in graph.recipeIds]
+        if "i.name AS name" in query:
+            return [{"name": name} for name in graph.ingredientNames]
+        if "MATCH (n)" in query:
+            return [{"n": fakeRecipe(recipeId)} for recipeId in graph.recipeIds[:limit or 5]]
+        return []
+    return handler
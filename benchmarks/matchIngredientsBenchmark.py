@@ -0,0 +1,115 @@
+"""Benchmark of /api/neo4j/matchIngredients: inverted index vs the Cypher aggregation.
+
+Synthetic mode (default) builds a random graph and compares the IngredientMatchIndex with an in-process
+evaluation of what the Cypher query does: count the matching ingredients of every recipe, collect their
+names and sort all the matches. With --neo4j the index is built from the configured database and compared
+with the actual Cypher query.
+
+    python -m benchmarks.matchIngredientsBenchmark --recipes 500000 --limit 20
+    python -m benchmarks.matchIngredientsBenchmark --neo4j
+"""
+import argparse
+import os
+import statistics
+import time
+import tracemalloc
+
+from MatchIngredients import IngredientMatchIndex
+from RecipeGraph import exportRecipeGraph, fetchRecipes
+from benchmarks.syntheticData import syntheticRecipeGraph, sampleQueries
+
+
+def cypherEquivalent(graph, ingredients, limit=None):
+    """Evaluate matchIngredients the way the Cypher query does, with one row per matching recipe."""
+    rows = {}
+    for name in set(ingredients):
+        if name not in graph.ingredientPositions:
+            continue
+        for recipe in graph.postings(graph.ingredientPositions[name]).tolist():
+            rows.setdefault(recipe, []).append(name)
+    data = [{"recipeId": graph.recipeIds[recipe], "matchingScore": len(names), "matchingIngredients": names}
+            for recipe, names in rows.items()]
+    data.sort(key=lambda row: -row["matchingScore"])
+    return data if limit is None else data[:limit]
+
+
+def runCypher(driver, ingredients, limit=None):
+    limitString = "" if limit is None else f" LIMIT {limit}"
+    with driver.session() as session:
+        result = session.run(
+            """
+            MATCH (r:Recipe)-[:CONTAINS]->(i:Ingredient)
+            WHERE i.name IN $ingredients
+            WITH r, count(i) AS matchingScore, COLLECT(i.name) AS matchingIngredients
+            RETURN r, matchingScore, matchingIngredients ORDER BY matchingScore DESC
+            """
+            + limitString, ingredients=ingredients)
+        return result.data()
+
+
+def measure(function, queries):
+    """Returns the median and p95 latency in milliseconds and the peak traced memory in MiB."""
+    latencies = []
+    peak = 0
+    for query in queries:
+        tracemalloc.start()
+        start = time.perf_counter()
+        function(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))], peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=500000, help="number of synthetic recipes")
+    parser.add_argument("--ingredients", type=int, default=5000, help="number of synthetic ingredients")
+    parser.add_argument("--queries", type=int, default=20, help="queries per query size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 5, 10, 20], help="ingredients per query")
+    parser.add_argument("--limit", type=int, default=None, help="limit passed to every query")
+    parser.add_argument("--neo4j", action="store_true", help="compare with the Cypher query on NEO4J_URI")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.neo4j:
+        from dotenv import load_dotenv
+        from neo4j import GraphDatabase
+
+        load_dotenv()
+        driver = GraphDatabase.driver(os.getenv("NEO4J_URI"),
+                                      auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+        graph = exportRecipeGraph(driver)
+        baselineName = "cypher"
+
+        def baseline(query):
+            return runCypher(driver, query, args.limit)
+    else:
+        graph = syntheticRecipeGraph(args.recipes, args.ingredients)
+        baselineName = "cypher-equivalent"
+
+        def baseline(query):
+            return cypherEquivalent(graph, query, args.limit)
+    print(f"Graph with {graph.numRecipes} recipes and {graph.numIngredients} ingredients "
+          f"ready in {time.perf_counter() - start:.1f}s")
+
+    index = IngredientMatchIndex(graph)
+
+    def indexed(query):
+        matches = index.topK(query, args.limit)
+        if args.neo4j:
+            # The recipes still have to be hydrated from the database
+            fetchRecipes(driver, [match["recipeId"] for match in matches])
+        return matches
+
+    print(f"{'size':>4} {'method':>18} {'p50 ms':>9} {'p95 ms':>9} {'peak MiB':>9}")
+    for size in args.sizes:
+        queries = sampleQueries(graph, size, args.queries, seed=size)
+        for name, function in ((baselineName, baseline), ("index", indexed)):
+            p50, p95, peak = measure(function, queries)
+            print(f"{size:>4} {name:>18} {p50:>9.2f} {p95:>9.2f} {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Payload size and encoding time of the recipe listings, by projection, JSON encoder and compression.
+
+The requests go through the Flask app to /api/elasticsearch/matchIngredients, served by the ElasticSearch
+stand-in of benchmarks.fakeBackends with recipes carrying their reviews like the recipeswithreviews index.
+The projection is pushed down to the stand-in as a _source filter, so the smaller views are also cheaper
+to fetch.
+
+    python -m benchmarks.payloadBenchmark --recipes 1000 --reviews 10
+"""
+import argparse
+import os
+import statistics
+import time
+
+
+def measure(client, body, encoding, repeat):
+    """Median time of the request in ms and size of the response body in bytes."""
+    headers = {"Accept-Encoding": encoding} if encoding else {"Accept-Encoding": "identity"}
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.post("/api/elasticsearch/matchIngredients", json=body, headers=headers)
+        size = len(response.get_data())
+        times.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_data()[:200]
+    return statistics.median(times), size
+
+
+def measureEncoding(provider, data, repeat):
+    """Median time in ms to encode the data with the JSON provider."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        provider.dumps(data)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=1000, help="number of recipes in the response")
+    parser.add_argument("--reviews", type=int, default=10, help="number of reviews of each recipe")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of each measure")
+    args = parser.parse_args()
+
+    os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+    os.environ.setdefault("BONSAI_URL", "http://localhost:9200")
+    os.environ["RESPONSE_COMPRESSION"] = "true"
+    from flask.json.provider import DefaultJSONProvider
+    import app
+    from benchmarks.fakeBackends import FakeElasticsearch
+    from Serialization import OrjsonProvider, brotli, orjson
+
+    app.es = FakeElasticsearch(args.recipes, numReviews=args.reviews)
+    client = app.app.test_client()
+    providers = {"json": DefaultJSONProvider(app.app)}
+    if orjson is not None:
+        providers["orjson"] = OrjsonProvider(app.app)
+    encodings = [None, "gzip"] + (["br"] if brotli is not None else [])
+
+    full = client.post("/api/elasticsearch/matchIngredients", headers={"Accept-Encoding": "identity"},
+                       json={"ingredients": ["salt"], "limit": args.recipes}).get_json()
+    print(f"Encoding {args.recipes} recipes with {args.reviews} reviews each (full view)")
+    for name, provider in providers.items():
+        print(f"{name:>8} {measureEncoding(provider, full, args.repeat):>8.1f} ms")
+    print()
+
+    print(f"{'view':>7} {'encoder':>8} {'encoding':>9} {'KiB':>9} {'request ms':>11}")
+    for view in ("full", "detail", "card"):
+        body = {"ingredients": ["salt"], "limit": args.recipes, "view": view}
+        for name, provider in providers.items():
+            app.app.json = provider
+            for encoding in encodings:
+                elapsed, size = measure(client, body, encoding, args.repeat)
+                print(f"{view:>7} {name:>8} {encoding or 'identity':>9} {size / 1024:>9.1f} {elapsed:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
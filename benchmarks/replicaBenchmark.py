@@ -0,0 +1,106 @@
+"""Export time, size and search latency of the local replica of the recipes index.
+
+Synthetic recipe documents are exported with SearchReplica.writeReplica into a temporary directory, and the
+canned queries of ElasticQueries.json and the bodies of the matchIngredients routes are run on the replica.
+The queries the replica can not answer (e.g. the script queries) are reported as unsupported: the app sends
+them to the cluster.
+
+    python -m benchmarks.replicaBenchmark --recipes 200000 --reviews 3
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from ElasticQueries import cannedQuery, matchIngredientsAndBody, matchIngredientsBody, queryTemplates
+from SearchReplica import Replica, UnsupportedQuery, writeReplica
+
+WORDS = ("chicken onion cheese beef rice garlic salt butter sugar flour egg milk tomato potato carrot pepper lemon "
+         "party celebration gathering event buffet microwave oven pan healthy gym protein lactose free great "
+         "excellent good amazing awesome snacks dessert birthday quick easy bake stir mix chop serve").split()
+CATEGORIES = ["Dessert", "Snacks", "Main dish", "Party", "Breakfast", "Beverages", "Vegetable"]
+
+
+def syntheticDocuments(numRecipes, numReviews, seed=0):
+    """Recipe documents shaped like the ones of the recipeswithreviews index, with random words."""
+    rng = random.Random(seed)
+
+    def text(length):
+        return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+    for recipeId in range(1, numRecipes + 1):
+        yield {
+            "RecipeId": recipeId,
+            "Name": f"Recipe {recipeId}",
+            "Description": text(rng.randint(5, 40)),
+            "Keywords": [text(2) for _ in range(rng.randint(0, 3))],
+            "RecipeCategory": rng.choice(CATEGORIES),
+            "RecipeInstructions": [text(10) for _ in range(rng.randint(1, 5))],
+            "RecipeIngredientParts": rng.sample(WORDS[:17], rng.randint(2, 8)),
+            "RecipeServings": rng.randint(1, 12),
+            "AggregatedRating": rng.choice([1.0, 2.5, 3.5, 4.0, 4.5, 5.0]),
+            "TotalTime": rng.randint(5, 180),
+            "ProteinContent": round(rng.uniform(0, 40), 1),
+            "Calories": round(rng.uniform(0, 3000), 1),
+            "FatContent": round(rng.uniform(0, 30), 1),
+            "FiberContent": round(rng.uniform(0, 8), 1),
+            "SugarContent": round(rng.uniform(0, 30), 1),
+            "ReviewCount": numReviews,
+            "AuthorId": rng.randint(1, 10000),
+            "DatePublished": "2020-01-01T00:00:00Z",
+            "Reviews": [{"ReviewId": recipeId * 1000 + k, "Rating": rng.randint(1, 5), "Review": text(rng.randint(3, 25))}
+                        for k in range(numReviews)],
+        }
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=100000, help="number of synthetic recipes")
+    parser.add_argument("--reviews", type=int, default=3, help="number of reviews of each recipe")
+    parser.add_argument("--runs", type=int, default=20, help="number of runs of each query")
+    parser.add_argument("--limit", type=int, default=20, help="number of hits of each query")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        documents = syntheticDocuments(args.recipes, args.reviews)
+        path, exportTime = timed(writeReplica, ({"_id": str(document["RecipeId"]), "_source": document}
+                                                for document in documents), directory)
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names) / 2 ** 20
+        print(f"Replica of {args.recipes} recipes exported in {exportTime / 1000:.1f}s, {size:.1f} MiB")
+
+        replica, openTime = timed(Replica.open, directory)
+        print(f"Opened in {openTime:.1f} ms")
+
+        queries = [(f"canned {queryNumber}", cannedQuery(queryNumber)[0]) for queryNumber in range(len(queryTemplates))]
+        queries.append(("matchIngredients", matchIngredientsBody(["chicken", "rice", "garlic"])))
+        queries.append(("matchIngredientsAnd", matchIngredientsAndBody(["chicken", "onion", "garlic"])))
+
+        print(f"\n{'query':>20} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'hits':>8}")
+        for name, body in queries:
+            try:
+                response, first = timed(replica.search, body, args.limit)
+            except UnsupportedQuery as e:
+                print(f"{name:>20} unsupported: {e}")
+                continue
+            latencies = [timed(replica.search, body, args.limit)[1] for _ in range(args.runs)]
+            print(f"{name:>20} {first:>9.2f} {statistics.median(latencies):>8.2f} "
+                  f"{np.percentile(latencies, 95):>8.2f} {response['hits']['total']['value']:>8}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
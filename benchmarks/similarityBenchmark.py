@@ -0,0 +1,93 @@
+"""Recall and latency of the MinHash / LSH recipe similarity index against a brute-force Jaccard scan.
+
+A synthetic graph made of families of recipe variants is generated, and for random recipes the most similar
+ones are found by the RecipeSimilarityIndex with several band / row layouts, and by computing the exact
+Jaccard index of every recipe. The recall is the share of the exact top-k found by the index, counting the
+ties with the k-th result as found.
+
+    python -m benchmarks.similarityBenchmark --recipes 500000 --layouts 20x3 32x3 16x4
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from RecipeSimilarity import RecipeSimilarityIndex
+from benchmarks.syntheticData import syntheticRecipeFamilies
+
+
+def bruteForce(graph, recipeOfEntry, position, limit):
+    """The exact similarities of the top `limit` recipes, scanning every (recipe, ingredient) pair."""
+    query = graph.ingredientsOf(position)
+    isQuery = np.zeros(graph.numIngredients, dtype=bool)
+    isQuery[query] = True
+    common = np.bincount(recipeOfEntry[isQuery[graph.recipeIngredients]], minlength=graph.numRecipes)
+    similarities = common / (np.diff(graph.recipeIndptr) + len(query) - common)
+    similarities[position] = 0
+    top = np.argpartition(-similarities, limit)[:limit]
+    return np.sort(similarities[top])[::-1]
+
+
+def recall(found, exact):
+    """Share of the exact top-k reached by the similarities found, the ties with the k-th counting as found."""
+    expected = exact[exact > 0]
+    if len(expected) == 0:
+        return 1.0
+    return min(sum(1 for similarity in found if similarity >= expected[-1] - 1e-12), len(expected)) / len(expected)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=200000, help="number of synthetic recipes")
+    parser.add_argument("--ingredients", type=int, default=5000, help="number of synthetic ingredients")
+    parser.add_argument("--family-size", type=int, default=5, help="number of variants of each synthetic recipe")
+    parser.add_argument("--changes", type=int, default=2, help="ingredients replaced in each variant")
+    parser.add_argument("--queries", type=int, default=200, help="number of query recipes")
+    parser.add_argument("--limit", type=int, default=10, help="number of similar recipes of each query")
+    parser.add_argument("--layouts", nargs="+", default=["10x2", "20x3", "32x3", "16x4", "32x4"],
+                        help="band layouts of the index, as BANDSxROWS")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = syntheticRecipeFamilies(args.recipes, args.ingredients, args.family_size, args.changes)
+    recipeOfEntry = np.repeat(np.arange(graph.numRecipes), np.diff(graph.recipeIndptr))
+    print(f"Graph with {graph.numRecipes} recipes and {graph.numIngredients} ingredients "
+          f"ready in {time.perf_counter() - start:.1f}s")
+
+    positions = np.random.default_rng(1).choice(graph.numRecipes, size=args.queries, replace=False).tolist()
+    exact = []
+    latencies = []
+    for position in positions:
+        similarities, elapsed = timed(bruteForce, graph, recipeOfEntry, position, args.limit)
+        exact.append(similarities)
+        latencies.append(elapsed)
+    print(f"\n{'method':>12} {'build s':>8} {'MiB':>7} {'p50 ms':>8} {'p95 ms':>8} {'candidates':>10} {'recall':>7}")
+    print(f"{'brute force':>12} {'':>8} {'':>7} {statistics.median(latencies):>8.2f} "
+          f"{np.percentile(latencies, 95):>8.2f} {graph.numRecipes:>10} {1:>7.3f}")
+
+    for layout in args.layouts:
+        bands, rows = (int(value) for value in layout.split("x"))
+        index, buildTime = timed(RecipeSimilarityIndex, graph, bands, rows)
+        size = (index.bucketKeys.nbytes + index.bucketRecipes.nbytes + index.ingredientHashes.nbytes) / 2 ** 20
+        latencies = []
+        candidates = []
+        recalls = []
+        for position, expected in zip(positions, exact):
+            matches, elapsed = timed(index.similarRecipes, graph.recipeIds[position], args.limit)
+            latencies.append(elapsed)
+            candidates.append(len(index.candidates(graph.ingredientsOf(position))))
+            recalls.append(recall([match["similarity"] for match in matches], expected))
+        print(f"{layout:>12} {buildTime / 1000:>8.2f} {size:>7.1f} {statistics.median(latencies):>8.2f} "
+              f"{np.percentile(latencies, 95):>8.2f} {statistics.fmean(candidates):>10.0f} "
+              f"{statistics.fmean(recalls):>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Cold start benchmark of the Flask app: import time and time to the first response of each route.
+
+Every measure runs in a fresh process, like a cold start of the Vercel function. The database clients are
+really built (so the neo4j and elasticsearch imports and the client construction are paid), but the
+queries are answered by the stand-ins of benchmarks.fakeBackends. The eager mode builds both clients right
+after the import, as the app did before they were created lazily.
+
+    python -m benchmarks.startupBenchmark --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROUTES = {
+    "hello": ("get", "/", None),
+    "checkIngredient": ("post", "/api/neo4j/checkIngredient", {"ingredient": "salt"}),
+    "matchIngredients": ("post", "/api/neo4j/matchIngredients", {"ingredients": ["salt", "butter"], "limit": 10}),
+    "matchIngredients_es": ("post", "/api/elasticsearch/matchIngredients", {"ingredients": ["salt", "butter"], "limit": 10}),
+    "queries": ("get", "/api/elasticsearch/queries?queryNumber=0&limit=10", None),
+}
+
+
+def runOne(route, eager):
+    """Import the app, answer one request and print the import time and the time to the first response in ms."""
+    os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+    os.environ.setdefault("BONSAI_URL", "http://localhost:9200")
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+
+    from benchmarks.fakeBackends import FakeElasticsearch, FakeNeo4jDriver, matchIngredientsHandler
+    from Clients import LazyClient, elasticsearchClient, neo4jDriver
+
+    def building(factory, fake):
+        """Build the real client, to pay for its imports and construction, and answer with the fake."""
+        def build():
+            client = factory()
+            client.close()
+            return fake
+        return build
+
+    app.driver = LazyClient(building(neo4jDriver, FakeNeo4jDriver(matchIngredientsHandler(100))))
+    app.es = LazyClient(building(elasticsearchClient, FakeElasticsearch(100)))
+    if eager:
+        app.driver.get()
+        app.es.get()
+
+    method, path, body = ROUTES[route]
+    client = app.app.test_client()
+    response = client.post(path, json=body) if method == "post" else client.get(path)
+    assert response.status_code == 200, response.get_data()[:200]
+    end = time.perf_counter()
+    print(f"{(imported - start) * 1000:.1f} {(end - start) * 1000:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts per route and mode")
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES), choices=list(ROUTES))
+    parser.add_argument("--modes", nargs="+", default=["lazy", "eager"], choices=["lazy", "eager"])
+    parser.add_argument("--run", nargs=2, metavar=("ROUTE", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        runOne(args.run[0], args.run[1] == "eager")
+        return
+
+    print(f"{'route':>20} {'mode':>6} {'import ms':>10} {'first response ms':>18}")
+    for route in args.routes:
+        for mode in args.modes:
+            imports, responses = [], []
+            for _ in range(args.runs):
+                output = subprocess.run([sys.executable, "-m", "benchmarks.startupBenchmark", "--run", route, mode],
+                                        capture_output=True, text=True, check=True).stdout.split()
+                imports.append(float(output[-2]))
+                responses.append(float(output[-1]))
+            print(f"{route:>20} {mode:>6} {statistics.median(imports):>10.1f} {statistics.median(responses):>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
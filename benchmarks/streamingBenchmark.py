@@ -0,0 +1,87 @@
+"""Memory benchmark of the streamed (NDJSON) responses against the buffered JSON responses.
+
+Each route and mode runs in its own process against the local stand-ins of benchmarks.fakeBackends, and
+reports the peak resident memory growth while the response is consumed, with the time to first byte.
+
+    python -m benchmarks.streamingBenchmark --recipes 100000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROUTES = {
+    "neo4j": ("/api/neo4j/matchIngredients", "post"),
+    "elasticsearch": ("/api/elasticsearch/matchIngredients", "post"),
+    "queries": ("/api/elasticsearch/queries", "get"),
+}
+
+
+def currentRss():
+    """Resident memory of the process in MiB."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def runOne(route, stream, numRecipes):
+    """Consume one response and print the RSS growth, the time to first byte and the total time."""
+    os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+    os.environ.setdefault("BONSAI_URL", "http://localhost:9200")
+    os.environ["QUERY_CACHE_TTL"] = "0"
+    import app
+    from benchmarks.fakeBackends import FakeElasticsearch, FakeNeo4jDriver, matchIngredientsHandler
+
+    app.driver = FakeNeo4jDriver(matchIngredientsHandler(numRecipes))
+    app.es = FakeElasticsearch(numRecipes)
+    client = app.app.test_client()
+
+    path, method = ROUTES[route]
+    body = {"ingredients": ["salt", "butter"], "limit": numRecipes, "stream": stream}
+    if route == "neo4j" and not stream:
+        del body["limit"]
+
+    baseline = currentRss()
+    peak = baseline
+    start = time.perf_counter()
+    if method == "post":
+        response = client.post(path, json=body, buffered=False)
+    else:
+        response = client.get(path, query_string={"queryNumber": 0, "limit": numRecipes, "stream": str(stream).lower()},
+                              buffered=False)
+    firstByte = None
+    size = 0
+    for position, chunk in enumerate(response.response):
+        if firstByte is None:
+            firstByte = time.perf_counter() - start
+        size += len(chunk)
+        if position % 1000 == 0:
+            peak = max(peak, currentRss())
+    peak = max(peak, currentRss())
+    print(f"{peak - baseline:.1f} {firstByte * 1000:.1f} {(time.perf_counter() - start) * 1000:.1f} {size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=100000, help="number of recipes in the response")
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES), choices=list(ROUTES))
+    parser.add_argument("--run", nargs=2, metavar=("ROUTE", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        runOne(args.run[0], args.run[1] == "stream", args.recipes)
+        return
+
+    print(f"{'route':>14} {'mode':>7} {'RSS growth MiB':>15} {'first byte ms':>14} {'total ms':>10} {'MiB sent':>9}")
+    for route in args.routes:
+        for mode in ("json", "stream"):
+            output = subprocess.run([sys.executable, "-m", "benchmarks.streamingBenchmark", "--recipes",
+                                     str(args.recipes), "--run", route, mode],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            growth, firstByte, total, size = output[-4:]
+            print(f"{route:>14} {mode:>7} {float(growth):>15.1f} {float(firstByte):>14.1f} {float(total):>10.1f} "
+                  f"{int(size) / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
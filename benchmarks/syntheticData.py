@@ -0,0 +1,81 @@
+import numpy as np
+
+from RecipeGraph import RecipeGraph
+
+
+def syntheticRecipeGraph(numRecipes, numIngredients=5000, minIngredients=4, maxIngredients=15, seed=0):
+    """Generate a random RecipeGraph.
+
+    Ingredient popularity follows a Zipf-like distribution, so that a few ingredients (like "salt" or
+    "butter") appear in a large share of the recipes, as in the real dataset.
+
+    Args:
+        numRecipes: number of recipes.
+        numIngredients: number of distinct ingredients.
+        minIngredients: minimum number of ingredients per recipe.
+        maxIngredients: maximum number of ingredients per recipe.
+        seed: seed of the random generator.
+
+    Returns:
+        A RecipeGraph whose recipe ids are 0..numRecipes-1 and whose ingredients are named
+        "ingredient0" (the most popular) to "ingredient{numIngredients-1}".
+    """
+    rng = np.random.default_rng(seed)
+    ingredientNames = [f"ingredient{i}" for i in range(numIngredients)]
+    popularity = 1 / np.arange(1, numIngredients + 1)
+    popularity /= popularity.sum()
+
+    lengths = rng.integers(minIngredients, maxIngredients + 1, size=numRecipes)
+    draws = rng.choice(numIngredients, size=int(lengths.sum()), p=popularity)
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    recipeIngredients = [[ingredientNames[i] for i in draws[bounds[r]:bounds[r + 1]]] for r in range(numRecipes)]
+
+    reviewCounts = rng.poisson(3, size=numRecipes)
+    avgRatings = [float(rating) if count > 0 else None
+                  for count, rating in zip(reviewCounts, rng.uniform(1, 5, size=numRecipes))]
+    return RecipeGraph(list(range(numRecipes)), ingredientNames, recipeIngredients, reviewCounts, avgRatings)
+
+
+def sampleQueries(graph, numIngredients, numQueries, seed=0):
+    """Sample ingredient lists, drawn with the same popularity as in the recipes."""
+    rng = np.random.default_rng(seed)
+    counts = graph.recipeCounts().astype(np.float64)
+    probabilities = counts / counts.sum()
+    return [[graph.ingredientNames[i] for i in rng.choice(graph.numIngredients, size=numIngredients,
+                                                          replace=False, p=probabilities)]
+            for _ in range(numQueries)]
+
+
+def syntheticRecipeFamilies(numRecipes, numIngredients=5000, familySize=5, changes=2, minIngredients=4,
+                            maxIngredients=15, seed=0):
+    """Generate a RecipeGraph made of families of variants of the same recipe.
+
+    Each family starts from a random recipe, drawn like in syntheticRecipeGraph, and its other recipes replace
+    `changes` of its ingredients by random ones, as the variants of a dish do in the real dataset. The recipes
+    of the families are shuffled.
+
+    Returns:
+        A RecipeGraph whose recipe ids are 0..numRecipes-1.
+    """
+    rng = np.random.default_rng(seed)
+    ingredientNames = [f"ingredient{i}" for i in range(numIngredients)]
+    popularity = 1 / np.arange(1, numIngredients + 1)
+    popularity /= popularity.sum()
+
+    recipeIngredients = []
+    while len(recipeIngredients) < numRecipes:
+        length = rng.integers(minIngredients, maxIngredients + 1)
+        base = rng.choice(numIngredients, size=length, p=popularity)
+        recipeIngredients.append(base)
+        for _ in range(min(familySize, numRecipes - len(recipeIngredients) + 1) - 1):
+            variant = base.copy()
+            replaced = rng.choice(length, size=min(changes, length), replace=False)
+            variant[replaced] = rng.choice(numIngredients, size=len(replaced), p=popularity)
+            recipeIngredients.append(variant)
+    order = rng.permutation(numRecipes)
+    recipeIngredients = [[ingredientNames[i] for i in recipeIngredients[position]] for position in order]
+
+    reviewCounts = rng.poisson(3, size=numRecipes)
+    avgRatings = [float(rating) if count > 0 else None
+                  for count, rating in zip(reviewCounts, rng.uniform(1, 5, size=numRecipes))]
+    return RecipeGraph(list(range(numRecipes)), ingredientNames, recipeIngredients, reviewCounts, avgRatings)
@@ -0,0 +1,34 @@
+"""A small recipe graph shared by the tests of the in-memory indexes.
+
+Every recipe lists its ingredients and the ratings of its reviews, as the Recipe, Ingredient and Review
+nodes of the Neo4j database. Recipe 7 has no review, one review of recipe 4 has no rating and "saffron"
+is used by no recipe.
+"""
+from RecipeGraph import RecipeGraph
+
+INGREDIENTS = ["salt", "pepper", "chicken", "rice", "garlic", "onion", "butter", "sugar", "flour", "egg", "saffron"]
+
+RECIPES = [
+    {"id": 1, "ingredients": ["salt", "pepper", "chicken", "rice"], "ratings": [5, 4]},
+    {"id": 2, "ingredients": ["salt", "chicken", "garlic", "onion"], "ratings": [3]},
+    {"id": 3, "ingredients": ["rice", "garlic", "onion", "butter"], "ratings": [4, 4, 1]},
+    {"id": 4, "ingredients": ["sugar", "flour", "egg", "butter"], "ratings": [5, None]},
+    {"id": 5, "ingredients": ["sugar", "flour", "egg", "salt"], "ratings": [2]},
+    {"id": 6, "ingredients": ["chicken", "rice", "garlic", "pepper", "salt"], "ratings": [4]},
+    {"id": 7, "ingredients": ["chicken", "onion", "pepper"], "ratings": []},
+    {"id": 8, "ingredients": ["egg", "butter", "salt", "pepper"], "ratings": [1, 3]},
+]
+
+
+def averageRating(ratings):
+    """The average rating of a recipe as Cypher's AVG computes it: the missing ratings are ignored."""
+    rated = [rating for rating in ratings if rating is not None]
+    return sum(rated) / len(rated) if rated else None
+
+
+def fixtureGraph():
+    """The RecipeGraph exported from the fixture, as exportRecipeGraph builds it."""
+    return RecipeGraph([recipe["id"] for recipe in RECIPES], INGREDIENTS,
+                       [recipe["ingredients"] for recipe in RECIPES],
+                       [len(recipe["ratings"]) for recipe in RECIPES],
+                       [averageRating(recipe["ratings"]) if recipe["ratings"] else None for recipe in RECIPES])
@@ -0,0 +1,48 @@
+from Autocomplete import IngredientAutocomplete
+
+NAMES = {
+    "chicken": 900,
+    "chicken breasts": 400,
+    "chickpeas": 120,
+    "chili powder": 300,
+    "cheddar cheese": 250,
+    "boneless skinless chicken breasts": 80,
+    "boneless skinless chicken thighs": 30,
+    "salt": 2000,
+    "sugar": 1500,
+    "Saffron Threads": 5,
+}
+
+
+def autocomplete():
+    return IngredientAutocomplete(list(NAMES), list(NAMES.values()))
+
+
+def test_complete_ranks_by_recipe_count():
+    index = autocomplete()
+    assert index.complete("chi") == [("chicken", 900), ("chicken breasts", 400), ("chili powder", 300),
+                                     ("chickpeas", 120)]
+    assert index.complete("chi", limit=2) == [("chicken", 900), ("chicken breasts", 400)]
+    assert index.complete("chicken b") == [("chicken breasts", 400)]
+    assert index.complete("SAFF") == [("Saffron Threads", 5)]
+    assert index.complete("truffle") == []
+
+
+def test_exists():
+    index = autocomplete()
+    assert index.exists("salt")
+    assert not index.exists("sal")
+
+
+def test_suggest_short_typos():
+    index = autocomplete()
+    assert index.suggest("sugra")[0] == ("sugar", 1500)
+    assert ("chicken", 900) in index.suggest("chiken")
+    assert index.suggest("chiken", exclude={"chicken"})[0] == ("chicken breasts", 400)
+
+
+def test_suggest_long_misspelled_names():
+    index = autocomplete()
+    assert index.suggest("boneless skinless chiken breasts")[0] == ("boneless skinless chicken breasts", 80)
+    # A typo in the first characters of a query longer than the indexed trigrams
+    assert index.suggest("bonless skinless chicken t")[0] == ("boneless skinless chicken thighs", 30)
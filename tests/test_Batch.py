@@ -0,0 +1,155 @@
+import asyncio
+
+from Batch import runBatch, runBatchAsync
+from Neo4jQueries import CHECK_INGREDIENTS, GET_RECIPES_INGREDIENTS
+from QueryCache import CannedQueryCache, MemoryCacheBackend
+
+INGREDIENTS = {"salt", "pepper"}
+RECIPE_INGREDIENTS = {1: ["salt", "rice"], 2: ["sugar"]}
+
+
+class FakeResult:
+    def __init__(self, records):
+        self.records = records
+
+    def data(self):
+        return self.records
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, items):
+        self.driver.queries.append(query)
+        if query == CHECK_INGREDIENTS:
+            return FakeResult([{"ingredient": item, "exists": item in INGREDIENTS} for item in items])
+        assert query == GET_RECIPES_INGREDIENTS
+        return FakeResult([{"recipe": item, "ingredients": RECIPE_INGREDIENTS.get(item, [])} for item in items])
+
+
+class FakeDriver:
+    def __init__(self):
+        self.queries = []
+
+    def session(self):
+        return FakeSession(self)
+
+
+class FakeElasticsearch:
+    def __init__(self, error=None):
+        self.bodies = []
+        self.error = error
+
+    def msearch(self, body):
+        if self.error is not None:
+            raise self.error
+        self.bodies.append(body)
+        return {"responses": [{"hits": {"hits": [{"_score": 1.0, "_source": {"RecipeId": index}}
+                                                 for index in range(query["size"])]}}
+                              for query in body[1::2]]}
+
+
+class AsyncFakeSession(FakeSession):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run(self, query, items):
+        result = FakeSession.run(self, query, items)
+        records = result.records
+
+        class AsyncResult:
+            async def data(self):
+                return records
+        return AsyncResult()
+
+
+class AsyncFakeDriver(FakeDriver):
+    def session(self):
+        return AsyncFakeSession(self)
+
+
+class AsyncFakeElasticsearch(FakeElasticsearch):
+    async def msearch(self, body):
+        return FakeElasticsearch.msearch(self, body)
+
+
+OPERATIONS = [
+    {"op": "checkIngredient", "ingredient": "salt"},
+    {"op": "getIngredients", "recipeId": 1},
+    {"op": "elasticQuery", "queryNumber": 1, "limit": 2},
+    {"op": "checkIngredient", "ingredient": "truffle"},
+    {"op": "elasticQuery", "queryNumber": 2, "limit": 1},
+    {"op": "getIngredients", "recipeId": 3},
+    {"op": "unknown"},
+    {"op": "elasticQuery", "queryNumber": 1000, "limit": 1},
+]
+
+EXPECTED = [
+    {"exists": True},
+    {"ingredients": ["salt", "rice"]},
+    {"recipes": [{"matchingScore": 1.0, "recipe": {"RecipeId": 0}}, {"matchingScore": 1.0, "recipe": {"RecipeId": 1}}]},
+    {"exists": False},
+    {"recipes": [{"matchingScore": 1.0, "recipe": {"RecipeId": 0}}]},
+    {"ingredients": []},
+]
+
+
+def test_one_round_trip_per_operation_type():
+    driver = FakeDriver()
+    es = FakeElasticsearch()
+    results = runBatch(OPERATIONS, driver, es)
+    assert results[:6] == EXPECTED
+    assert results[6]["error"].startswith("Unknown operation")
+    assert results[7]["error"].startswith("Invalid query number")
+    assert sorted(driver.queries) == sorted([CHECK_INGREDIENTS, GET_RECIPES_INGREDIENTS])
+    assert len(es.bodies) == 1
+    assert [query["size"] for query in es.bodies[0][1::2]] == [2, 1]
+
+
+def test_async_batch_gives_the_same_results():
+    results = asyncio.run(runBatchAsync(OPERATIONS, AsyncFakeDriver(), AsyncFakeElasticsearch()))
+    assert results[:6] == EXPECTED
+
+
+def test_cached_queries_are_not_run():
+    cache = CannedQueryCache([MemoryCacheBackend()])
+    runBatch(OPERATIONS, FakeDriver(), FakeElasticsearch(), cache)
+    es = FakeElasticsearch()
+    results = runBatch([{"op": "elasticQuery", "queryNumber": 1, "limit": 1}], FakeDriver(), es, cache)
+    assert results == [{"recipes": [{"matchingScore": 1.0, "recipe": {"RecipeId": 0}}]}]
+    assert es.bodies == []
+
+
+def test_a_failed_group_does_not_fail_the_others():
+    results = runBatch(OPERATIONS, FakeDriver(), FakeElasticsearch(ConnectionError("unreachable")))
+    assert results[0] == {"exists": True}
+    assert results[2] == {"error": "unreachable"}
+    assert results[4] == {"error": "unreachable"}
+
+
+def test_a_malformed_operation_only_fails_itself():
+    operations = [
+        {"op": "checkIngredient", "ingredient": "salt"},
+        {"op": "checkIngredient", "ingredient": ["salt"]},
+        {"op": "getIngredients", "recipeId": 1},
+        {"op": "getIngredients", "recipeId": {"id": 1}},
+        {"op": "getIngredients", "recipeId": True},
+        {"op": "checkIngredient"},
+    ]
+    results = runBatch(operations, FakeDriver(), FakeElasticsearch())
+    assert results[0] == {"exists": True}
+    assert results[1] == {"error": "The ingredient should be a string"}
+    assert results[2] == {"ingredients": ["salt", "rice"]}
+    assert results[3] == {"error": "The recipeId should be an integer"}
+    assert results[4] == {"error": "The recipeId should be an integer"}
+    assert results[5] == {"error": "No ingredient found"}
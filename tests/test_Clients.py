@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from Clients import LazyClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Client:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_the_client_is_built_on_the_first_attribute_access():
+    built = []
+    lazy = LazyClient(lambda: built.append(Client()) or built[-1])
+    assert not lazy.initialized
+    assert built == []
+
+    lazy.close()
+    assert lazy.initialized
+    assert len(built) == 1 and built[0].closed
+    # Later accesses go to the same client
+    assert lazy.closed
+    assert lazy.get() is built[0]
+    assert len(built) == 1
+
+
+def test_a_single_client_is_built_across_threads():
+    calls = []
+
+    def factory():
+        calls.append(None)
+        # Let the other threads reach the lock while the client is being built
+        time.sleep(0.05)
+        return Client()
+
+    lazy = LazyClient(factory)
+    barrier = threading.Barrier(16)
+    clients = []
+
+    def worker():
+        barrier.wait()
+        clients.append(lazy.get())
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(clients) == 16 and all(client is clients[0] for client in clients)
+
+
+def test_a_failed_build_is_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise ConnectionError("unreachable")
+        return Client()
+
+    lazy = LazyClient(factory)
+    with pytest.raises(ConnectionError):
+        lazy.get()
+    assert not lazy.initialized
+    assert isinstance(lazy.get(), Client)
+
+
+def imported(code, **environment):
+    """The modules imported by code, run in a fresh interpreter from the root of the repository."""
+    env = {key: value for key, value in os.environ.items() if key != "VERCEL"}
+    env.update(environment)
+    output = subprocess.run([sys.executable, "-c", code + "\nimport sys\nprint(' '.join(sys.modules))"], cwd=ROOT,
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return set(output.split())
+
+
+def test_importing_the_app_does_not_load_the_database_packages():
+    modules = imported("import app")
+    assert "app" in modules
+    assert "neo4j" not in modules
+    assert "elasticsearch" not in modules
+
+
+@pytest.mark.parametrize("vercel, loaded", [(None, True), ("1", False)])
+def test_dotenv_is_skipped_on_vercel(vercel, loaded):
+    pytest.importorskip("dotenv")
+    environment = {} if vercel is None else {"VERCEL": vercel}
+    assert ("dotenv" in imported("import Settings", **environment)) == loaded
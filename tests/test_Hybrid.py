@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+import app
+from Hybrid import fuseRankings, hybridSearch, parseDeadline, validateHybridRequest
+
+
+class FakeResult:
+    def __init__(self, records):
+        self.records = records
+
+    def data(self):
+        return self.records
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, ingredients):
+        self.driver.queries.append(query)
+        return FakeResult([{"r": {"id": recipeId}, "matchingScore": 2, "matchingIngredients": ingredients}
+                           for recipeId in (1, 2, 3)])
+
+
+class FakeDriver:
+    def __init__(self):
+        self.queries = []
+
+    def session(self):
+        return FakeSession(self)
+
+
+class SlowElasticsearch:
+    """Answers after `latency` seconds, unless the request times out before."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.timeouts = []
+
+    def search(self, index, body, size, request_timeout=None):
+        self.timeouts.append(request_timeout)
+        if request_timeout is not None and request_timeout < self.latency:
+            time.sleep(request_timeout)
+            raise TimeoutError("request timed out")
+        time.sleep(self.latency)
+        return {"hits": {"hits": [{"_score": 1.0, "_source": {"RecipeId": recipeId}} for recipeId in (3, 4)]}}
+
+
+def candidates(*recipeIds):
+    return [{"recipeId": recipeId, "score": 10 - rank, "recipe": {"id": recipeId}} for rank, recipeId in enumerate(recipeIds)]
+
+
+def test_rrf_favours_the_recipes_found_by_both_backends():
+    fused = fuseRankings({"neo4j": candidates(1, 2, 3), "elasticsearch": candidates(3, 4)}, 10)
+    assert [match["recipeId"] for match in fused] == [3, 1, 2, 4]
+    assert fused[0]["ranks"] == {"neo4j": 3, "elasticsearch": 1}
+
+
+def test_weights():
+    rankings = {"neo4j": candidates(1, 2), "elasticsearch": candidates(3, 4)}
+    fused = fuseRankings(rankings, 2, "weighted", {"elasticsearch": 2})
+    assert [match["recipeId"] for match in fused] == [3, 4]
+
+
+def test_validate_hybrid_request():
+    assert validateHybridRequest({"ingredients": ["salt"], "limit": 5})["candidates"] == 5
+    for body in (None, {"limit": 5}, {"ingredients": ["salt"], "fusion": "max"},
+                 {"ingredients": ["salt"], "weights": {"solr": 1}}):
+        with pytest.raises(ValueError):
+            validateHybridRequest(body)
+
+
+def test_both_backends_are_fused():
+    es = SlowElasticsearch(0)
+    response = hybridSearch(FakeDriver(), es, ["salt"], limit=10, deadline=5)
+    assert not response["partial"]
+    assert {match["recipeId"] for match in response["recipes"]} == {1, 2, 3, 4}
+
+
+def test_backends_are_given_the_deadline_as_timeout():
+    driver = FakeDriver()
+    es = SlowElasticsearch(5)
+    start = time.monotonic()
+    response = hybridSearch(driver, es, ["salt"], limit=10, deadline=0.2)
+    assert time.monotonic() - start < 1
+    assert response["partial"]
+    assert "error" in response["backends"]["elasticsearch"]
+    assert es.timeouts == [0.2]
+    assert driver.queries[0].timeout == 0.2
+
+
+def test_parse_deadline():
+    assert parseDeadline(None, 2) == 2
+    assert parseDeadline(0.5, 2) == 0.5
+    assert parseDeadline("1", 2) == 1
+    assert parseDeadline(30, 2) == 2
+    for value in (0, -1, "nan", "inf", float("nan"), "soon", [1]):
+        with pytest.raises(ValueError):
+            parseDeadline(value, 2)
+
+
+@pytest.mark.parametrize("deadline", [0, -1, "nan", "-inf", "soon"])
+def test_the_route_rejects_bad_deadlines(deadline):
+    response = app.app.test_client().post("/api/hybrid/matchIngredients",
+                                          json={"ingredients": ["salt"], "deadline": deadline})
+    assert response.status_code == 400
@@ -0,0 +1,35 @@
+import pytest
+
+from MatchIngredients import IngredientMatchIndex
+from tests.fixtureGraph import RECIPES, fixtureGraph
+
+
+def matchIngredientsCypher(ingredients):
+    """The rows of the MATCH_INGREDIENTS Cypher query on the fixture, ties ordered by recipe position."""
+    rows = []
+    for recipe in RECIPES:
+        matching = [name for name in recipe["ingredients"] if name in ingredients]
+        if matching:
+            rows.append({"recipeId": recipe["id"], "matchingScore": len(matching), "matchingIngredients": matching})
+    return sorted(rows, key=lambda row: -row["matchingScore"])
+
+
+@pytest.mark.parametrize("ingredients", [["salt"], ["chicken", "rice"], ["butter", "egg", "salt", "pepper"]])
+def test_topK_matches_the_cypher_query(ingredients):
+    results = IngredientMatchIndex(fixtureGraph()).topK(ingredients)
+    expected = matchIngredientsCypher(ingredients)
+    assert [(row["recipeId"], row["matchingScore"]) for row in results] == \
+        [(row["recipeId"], row["matchingScore"]) for row in expected]
+    for result, row in zip(results, expected):
+        assert sorted(result["matchingIngredients"]) == sorted(row["matchingIngredients"])
+
+
+def test_topK_limit():
+    index = IngredientMatchIndex(fixtureGraph())
+    ingredients = ["butter", "egg", "salt", "pepper"]
+    assert index.topK(ingredients, limit=2) == index.topK(ingredients)[:2]
+    assert index.topK(ingredients, limit=0) == []
+
+
+def test_topK_unknown_ingredients():
+    assert IngredientMatchIndex(fixtureGraph()).topK(["truffle"]) == []
@@ -0,0 +1,182 @@
+import random
+import threading
+
+import pytest
+
+import MaterializedQueries
+from MaterializedQueries import AggregationSnapshot, MaterializedQueries as Materialized, pushedRecipeIds
+
+BODY = {
+    "query": {"range": {"AggregatedRating": {"gte": 3}}},
+    "aggs": {
+        "calories": {"range": {"field": "Calories", "ranges": [{"key": "low", "to": 500}, {"key": "high", "from": 500}]},
+                     "aggs": {"avg_protein": {"avg": {"field": "ProteinContent"}}}},
+        "authors": {"terms": {"field": "AuthorId", "size": 3}, "aggs": {"avg_rating": {"avg": {"field": "AggregatedRating"}}}},
+        "total_protein": {"sum": {"field": "ProteinContent"}},
+    },
+}
+
+
+def recipe(recipeId, rng):
+    document = {"RecipeId": recipeId, "AuthorId": rng.randrange(6), "AggregatedRating": rng.choice([1, 2, 3, 4, 5]),
+                "Calories": round(rng.uniform(0, 1000), 1)}
+    if rng.random() < 0.9:
+        document["ProteinContent"] = round(rng.uniform(0, 40), 1)
+    return document
+
+
+class FakeElasticsearch:
+    """Evaluates the searches of the snapshots on a dictionary of documents."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.bodies = []
+        self.timeouts = []
+
+    def search(self, index, body, request_timeout=None):
+        self.bodies.append(body)
+        self.timeouts.append(request_timeout)
+        recipeIds = sorted(recipeId for recipeId, document in self.documents.items()
+                           if self._matches(body["query"], document))
+        if "search_after" in body:
+            recipeIds = [recipeId for recipeId in recipeIds if recipeId > body["search_after"][0]]
+        includes = body["_source"]["includes"]
+        return {"hits": {"hits": [{"_source": {key: value for key, value in self.documents[recipeId].items() if key in includes},
+                                   "sort": [recipeId]} for recipeId in recipeIds[:body["size"]]]}}
+
+    def _matches(self, query, document):
+        kind, spec = next(iter(query.items()))
+        if kind == "match_all":
+            return True
+        if kind == "bool":
+            return all(self._matches(clause, document) for clause in spec["filter"])
+        if kind == "terms":
+            field, values = next(iter(spec.items()))
+            return document.get(field) in values
+        field, bounds = next(iter(spec.items()))
+        value = document.get(field)
+        return value is not None and value >= bounds.get("gte", value) and value <= bounds.get("lte", value)
+
+
+def documents(count, seed=0):
+    rng = random.Random(seed)
+    return {recipeId: recipe(recipeId, rng) for recipeId in range(1, count + 1)}
+
+
+def builtSnapshot(documents):
+    """Snapshot of BODY built from scratch on the documents."""
+    snapshot = AggregationSnapshot(6, BODY)
+    snapshot.build([document for document in documents.values() if document["AggregatedRating"] >= 3])
+    return snapshot
+
+
+def assertSameResponse(response, expected):
+    if isinstance(expected, dict):
+        assert response.keys() == expected.keys()
+        for key in expected:
+            assertSameResponse(response[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(response) == len(expected)
+        for value, expectedValue in zip(response, expected):
+            assertSameResponse(value, expectedValue)
+    elif isinstance(expected, float):
+        assert response == pytest.approx(expected)
+    else:
+        assert response == expected
+
+
+def test_aggregations():
+    docs = {1: {"RecipeId": 1, "AuthorId": 1, "AggregatedRating": 4, "Calories": 100, "ProteinContent": 10},
+            2: {"RecipeId": 2, "AuthorId": 1, "AggregatedRating": 5, "Calories": 700, "ProteinContent": 30},
+            3: {"RecipeId": 3, "AuthorId": 2, "AggregatedRating": 3, "Calories": 300},
+            4: {"RecipeId": 4, "AuthorId": 2, "AggregatedRating": 1, "Calories": 300, "ProteinContent": 99}}
+    snapshot = builtSnapshot(docs)
+    aggregations = snapshot.response()["aggregations"]
+    assert aggregations["calories"]["buckets"] == [
+        {"key": "low", "to": 500.0, "doc_count": 2, "avg_protein": {"value": 10.0}},
+        {"key": "high", "from": 500.0, "doc_count": 1, "avg_protein": {"value": 30.0}}]
+    assert aggregations["authors"] == {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": [
+        {"key": 1, "doc_count": 2, "avg_rating": {"value": 4.5}},
+        {"key": 2, "doc_count": 1, "avg_rating": {"value": 3.0}}]}
+    assert aggregations["total_protein"] == {"value": 40.0}
+
+
+def test_incremental_apply_matches_a_rebuild():
+    rng = random.Random(1)
+    docs = documents(300)
+    snapshot = builtSnapshot(docs)
+
+    changed = rng.sample(sorted(docs), 60)
+    for recipeId in changed[:20]:
+        del docs[recipeId]
+    for recipeId in changed[20:]:
+        docs[recipeId] = recipe(recipeId, rng)
+    added = list(range(301, 321))
+    for recipeId in added:
+        docs[recipeId] = recipe(recipeId, rng)
+    recipeIds = changed + added
+    snapshot.apply(recipeIds, [docs[recipeId] for recipeId in recipeIds
+                               if recipeId in docs and docs[recipeId]["AggregatedRating"] >= 3])
+    # Applying the same changes twice gives the same state
+    snapshot.apply(recipeIds[:10], [docs[recipeId] for recipeId in recipeIds[:10]
+                                    if recipeId in docs and docs[recipeId]["AggregatedRating"] >= 3])
+
+    assertSameResponse(snapshot.response(), builtSnapshot(docs).response())
+    assert snapshot.numRecipes == sum(1 for document in docs.values() if document["AggregatedRating"] >= 3)
+
+
+def test_pushed_recipes_refresh_the_snapshots(monkeypatch, tmp_path):
+    monkeypatch.setattr(MaterializedQueries, "EXPORT_PAGE_SIZE", 7)
+    docs = documents(50)
+    es = FakeElasticsearch(docs)
+    materialized = Materialized(es, {6: BODY}, directory=str(tmp_path))
+    materialized.build()
+
+    docs[3] = {**docs[3], "AggregatedRating": 5, "Calories": 900}
+    del docs[4]
+    docs[51] = {"RecipeId": 51, "AuthorId": 9, "AggregatedRating": 4, "Calories": 10}
+    materialized.push([3, 4, 51])
+    assertSameResponse(materialized.snapshots[6].response(), builtSnapshot(docs).response())
+
+    # The saved snapshot is loaded by a new process
+    loaded = Materialized(es, {6: BODY}, directory=str(tmp_path))
+    assertSameResponse(loaded.snapshots[6].response(), builtSnapshot(docs).response())
+
+
+def test_recipes_pushed_during_a_build_are_applied_after_it():
+    docs = documents(20)
+    materialized = Materialized(FakeElasticsearch(docs), {6: BODY})
+    materialized.build()
+    docs[5] = {**docs[5], "AggregatedRating": 5, "AuthorId": 42}
+
+    materialized.updateLock.acquire()
+    pusher = threading.Thread(target=materialized.push, args=([5],))
+    pusher.start()
+    pusher.join()
+    assert materialized.statistics()["pending"] == 1
+    materialized.updateLock.release()
+    materialized.build()
+    assert materialized.statistics()["pending"] == 0
+    assertSameResponse(materialized.snapshots[6].response(), builtSnapshot(docs).response())
+
+
+def test_periodic_refresh_uses_the_change_field():
+    docs = documents(20)
+    es = FakeElasticsearch(docs)
+    assert Materialized(es, {6: BODY}).refresh() == 0
+    assert es.bodies == []
+
+    materialized = Materialized(es, {6: BODY}, changeField="IndexedAt")
+    materialized.build()
+    es.bodies.clear()
+    materialized.refresh()
+    assert "IndexedAt" in es.bodies[0]["query"]["range"]
+    assert set(es.timeouts) == {MaterializedQueries.EXPORT_REQUEST_TIMEOUT_SECONDS}
+
+
+def test_pushed_recipe_ids():
+    assert pushedRecipeIds({"recipeIds": [1, 2]}) == [1, 2]
+    for body in (None, {}, {"recipeIds": "1"}, {"recipeIds": ["1"]}, {"recipeIds": [True]},
+                 {"recipeIds": list(range(MaterializedQueries.MAX_PUSHED_RECIPES + 1))}):
+        with pytest.raises(ValueError):
+            pushedRecipeIds(body)
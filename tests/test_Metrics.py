@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import re
+
+import pytest
+from flask import Flask, jsonify, request
+
+import Metrics
+from Metrics import (InstrumentedAsyncResult, InstrumentedElasticsearch, MetricsRegistry, configureSlowQueryLog,
+                     finishRequest, recordException, startRequest, timed)
+
+
+def test_render_counters_and_histograms():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.recordRequest("/api/a", "GET", 200, 0.05, {"neo4j": 0.04})
+    registry.recordRequest("/api/a", "GET", 200, 0.5, {})
+    registry.recordRequest("/api/a", "GET", 500, 2.0, {}, exception="KeyError")
+
+    lines = registry.render().splitlines()
+    assert "# HELP tastetrios_requests_total Requests answered, by route, method and status." in lines
+    assert "# TYPE tastetrios_requests_total counter" in lines
+    assert "# TYPE tastetrios_request_duration_seconds histogram" in lines
+    assert 'tastetrios_requests_total{route="/api/a",method="GET",status="200"} 2' in lines
+    assert 'tastetrios_requests_total{route="/api/a",method="GET",status="500"} 1' in lines
+    assert 'tastetrios_request_errors_total{route="/api/a",method="GET",exception="KeyError"} 1' in lines
+    assert 'tastetrios_phase_seconds_total{route="/api/a",phase="neo4j"} 0.04' in lines
+    # The buckets are cumulative, and end with +Inf
+    labels = 'route="/api/a",method="GET"'
+    assert [line for line in lines if line.startswith("tastetrios_request_duration_seconds")] == [
+        f'tastetrios_request_duration_seconds_bucket{{{labels},le="0.1"}} 1',
+        f'tastetrios_request_duration_seconds_bucket{{{labels},le="1.0"}} 2',
+        f'tastetrios_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3',
+        f'tastetrios_request_duration_seconds_sum{{{labels}}} 2.55',
+        f'tastetrios_request_duration_seconds_count{{{labels}}} 3',
+    ]
+    # No canned query was answered, so its metrics are left out
+    assert not any("canned_query" in line for line in lines)
+
+
+def test_bucket_bounds_are_inclusive():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.observe("tastetrios_request_duration_seconds", (), 0.1)
+    assert 'tastetrios_request_duration_seconds_bucket{le="0.1"} 1' in registry.render().splitlines()
+
+
+def test_render_escapes_label_values_and_exports_the_cache_counters():
+    class QueryCache:
+        def statistics(self):
+            return {"hits": 3, "misses": 1}
+
+    registry = MetricsRegistry()
+    registry.increment("tastetrios_replica_searches_total", (("reason", 'a "quoted"\nreason'),))
+    lines = registry.render(QueryCache()).splitlines()
+    assert 'tastetrios_replica_searches_total{reason="a \\"quoted\\"\\nreason"} 1' in lines
+    assert "tastetrios_query_cache_hits_total 3" in lines
+    assert "tastetrios_query_cache_misses_total 1" in lines
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(Metrics, "metrics", registry)
+    return registry
+
+
+@pytest.fixture
+def client(registry):
+    app = Flask(__name__)
+    app.before_request(startRequest)
+
+    @app.after_request
+    def record(response):
+        return finishRequest(request, response)
+
+    @app.route("/api/elasticsearch/queries")
+    def queries():
+        with timed("elasticsearch"):
+            pass
+        with timed("elasticsearch"):
+            pass
+        return jsonify([])
+
+    @app.route("/broken")
+    def broken():
+        try:
+            raise KeyError("missing")
+        except Exception as e:
+            recordException(e)
+            return jsonify({"error": str(e)}), 500
+
+    return app.test_client()
+
+
+def test_server_timing_header(client):
+    response = client.get("/api/elasticsearch/queries?queryNumber=4")
+    phases = [phase.split(";dur=") for phase in response.headers["Server-Timing"].split(", ")]
+    assert [name for name, _ in phases] == ["elasticsearch", "app", "total"]
+    assert all(re.fullmatch(r"\d+\.\d{2}", duration) for _, duration in phases)
+    durations = {name: float(duration) for name, duration in phases}
+    assert durations["elasticsearch"] + durations["app"] == pytest.approx(durations["total"], abs=0.02)
+
+
+def test_requests_are_aggregated_by_route_and_query_number(client, registry):
+    client.get("/api/elasticsearch/queries?queryNumber=4")
+    client.get("/broken")
+    client.get("/nowhere")
+    rendered = registry.render()
+    assert 'tastetrios_canned_query_duration_seconds_count{queryNumber="4"} 1' in rendered
+    assert ('tastetrios_request_errors_total{route="/broken",method="GET",exception="KeyError"} 1'
+            in rendered)
+    assert 'tastetrios_requests_total{route="unmatched",method="GET",status="404"} 1' in rendered
+
+
+def test_timer_phases_running_concurrently():
+    timer = Metrics.RequestTimer()
+    timer.add("neo4j", 0.2)
+    timer.add("elasticsearch", 0.2)
+    # The phases add up to more than the total, the rest of the request is not negative
+    assert timer.serverTiming(0.3) == "neo4j;dur=200.00, elasticsearch;dur=200.00, app;dur=0.00, total;dur=300.00"
+
+
+@pytest.fixture
+def slowQueries(monkeypatch, caplog):
+    # configureSlowQueryLog sets the module threshold, restored after the test
+    monkeypatch.setattr(Metrics, "slowQuerySeconds", None)
+    caplog.set_level(logging.WARNING, logger="slowQueries")
+
+    def records():
+        return [json.loads(record.getMessage()) for record in caplog.records if record.name == "slowQueries"]
+
+    return records
+
+
+def test_slow_query_threshold(slowQueries):
+    configureSlowQueryLog(100)
+    Metrics.logSlowQuery("neo4j", 0.099, "MATCH (r) RETURN r", {"limit": 5})
+    Metrics.logSlowQuery("neo4j", 0.1, "MATCH (r) RETURN r", {"limit": 5})
+    assert slowQueries() == [{"backend": "neo4j", "durationMs": 100.0, "query": "MATCH (r) RETURN r",
+                              "parameters": {"limit": 5}}]
+
+
+@pytest.mark.parametrize("thresholdMs", [0, None])
+def test_slow_query_log_disabled(slowQueries, thresholdMs):
+    configureSlowQueryLog(thresholdMs)
+    Metrics.logSlowQuery("neo4j", 60.0, "MATCH (r) RETURN r", {})
+    assert slowQueries() == []
+
+
+def test_slow_searches_are_logged_with_their_body(slowQueries):
+    class Elasticsearch:
+        def search(self, index=None, body=None):
+            return {"hits": {"hits": []}}
+
+    # Every call is over a negative threshold
+    Metrics.slowQuerySeconds = -1
+    InstrumentedElasticsearch(Elasticsearch()).search(index="recipes", body={"size": 1})
+    [record] = slowQueries()
+    assert record["backend"] == "elasticsearch"
+    assert record["query"] == {"size": 1}
+    assert record["parameters"] == {"method": "search", "index": "recipes"}
+
+
+def test_async_results_are_iterated_and_logged(slowQueries):
+    class AsyncResult:
+        def __init__(self, records):
+            self.records = records
+
+        async def __aiter__(self):
+            for record in self.records:
+                yield record
+
+    async def collect(result):
+        return [record async for record in result]
+
+    Metrics.slowQuerySeconds = -1
+    result = InstrumentedAsyncResult(AsyncResult([{"id": 1}, None, {"id": 2}]), "MATCH (r) RETURN r", {}, 0.0)
+    # A None record does not end the iteration
+    assert asyncio.run(collect(result)) == [{"id": 1}, None, {"id": 2}]
+    assert len(slowQueries()) == 1
@@ -0,0 +1,92 @@
+import math
+
+import pytest
+
+import app
+from MixAndMax import MixAndMaxIndex
+from RecipeGraph import RefreshableIndex
+from tests.fixtureGraph import RECIPES, averageRating, fixtureGraph
+
+
+def mixAndMaxCypher(ingredients):
+    """The rows of the MIX_AND_MAX Cypher query on the fixture, evaluated clause by clause."""
+    # MATCH (i)<-[:CONTAINS]-(r)-[:CONTAINS]->(i1) WHERE i.name IN ingredients AND NOT i1.name IN ingredients
+    # WITH DISTINCT r, i1.name AS matchedIngredient, COUNT(distinct i) AS availableMatchedIngredients
+    rows = []
+    for recipe in RECIPES:
+        available = len({name for name in recipe["ingredients"] if name in ingredients})
+        if available == 0:
+            continue
+        for name in recipe["ingredients"]:
+            if name not in ingredients:
+                rows.append({"r": recipe, "matchedIngredient": name, "available": available})
+
+    # MATCH (r)<-[:FOR]-(rev:Review) WITH ..., AVG(rev.rating) AS avgRating
+    rows = [dict(row, avgRating=averageRating(row["r"]["ratings"])) for row in rows if row["r"]["ratings"]]
+
+    # MATCH (r)-[:CONTAINS]->(i:Ingredient) WHERE i.name IN ingredients: one row per provided ingredient of r
+    rows = [row for row in rows for name in row["r"]["ingredients"] if name in ingredients]
+
+    # RETURN matchedIngredient, COUNT(DISTINCT r), AVG(avgRating), AVG(availableMatchedIngredients)
+    groups = {}
+    for row in rows:
+        groups.setdefault(row["matchedIngredient"], []).append(row)
+    results = []
+    for name, group in groups.items():
+        ratings = [row["avgRating"] for row in group if row["avgRating"] is not None]
+        results.append({"matchedIngredient": name,
+                        "recipeCount": len({row["r"]["id"] for row in group}),
+                        "avgOfAvgRatings": sum(ratings) / len(ratings) if ratings else None,
+                        "IngredientCompatibility": sum(row["available"] for row in group) / len(group)})
+    # ORDER BY IngredientCompatibility * log10(recipeCount) DESC, the index breaks the ties by name
+    return sorted(results, key=lambda result: (-result["IngredientCompatibility"] * math.log10(result["recipeCount"]),
+                                               result["matchedIngredient"]))
+
+
+@pytest.mark.parametrize("ingredients", [
+    ["salt"],
+    ["chicken", "rice"],
+    ["butter", "egg", "salt"],
+    ["onion", "pepper"],
+    ["salt", "pepper", "chicken", "rice", "garlic"],
+    ["saffron", "egg"],
+])
+def test_query_matches_the_cypher_query(ingredients):
+    expected = mixAndMaxCypher(ingredients)
+    assert expected, "the fixture should exercise the query"
+    results = MixAndMaxIndex(fixtureGraph()).query(ingredients)
+    assert [result["matchedIngredient"] for result in results] == [row["matchedIngredient"] for row in expected]
+    for result, row in zip(results, expected):
+        assert result["recipeCount"] == row["recipeCount"]
+        assert result["avgOfAvgRatings"] == pytest.approx(row["avgOfAvgRatings"])
+        assert result["IngredientCompatibility"] == pytest.approx(row["IngredientCompatibility"])
+
+
+def test_unreviewed_recipes_are_ignored():
+    # Recipe 7 is the only one with chicken and onion but without review
+    results = {result["matchedIngredient"]: result for result in MixAndMaxIndex(fixtureGraph()).query(["onion"])}
+    assert results["chicken"]["recipeCount"] == 1
+    assert results["chicken"]["avgOfAvgRatings"] == 3
+
+
+def test_limit():
+    index = MixAndMaxIndex(fixtureGraph())
+    assert index.query(["salt"], limit=3) == index.query(["salt"])[:3]
+
+
+def test_unknown_ingredients():
+    assert MixAndMaxIndex(fixtureGraph()).query(["saffron", "truffle"]) == []
+
+
+def test_negative_limits_are_rejected(monkeypatch):
+    with pytest.raises(ValueError):
+        MixAndMaxIndex(fixtureGraph()).query(["salt"], -1)
+
+    monkeypatch.setattr(app, "use_local_indexes", True)
+    monkeypatch.setattr(app, "localIndexes", RefreshableIndex(lambda: {"mixAndMax": MixAndMaxIndex(fixtureGraph())}))
+    client = app.app.test_client()
+    for limit in (-1, "x"):
+        assert client.post("/api/neo4j/mixAndMax", json={"ingredients": ["salt"], "limit": limit}).status_code == 400
+    response = client.post("/api/neo4j/mixAndMax", json={"ingredients": ["salt"], "limit": 2})
+    assert response.status_code == 200
+    assert len(response.get_json()["ingredients"]) == 2
@@ -0,0 +1,50 @@
+import pytest
+
+from Neo4jQueries import MATCH_INGREDIENTS
+from Projection import (VIEWS, cypherProjection, parseProjection, projectionKey, withRecipeProjection,
+                        withSourceFilter)
+
+
+def test_parse_projection():
+    assert parseProjection() is None
+    assert parseProjection(["Name", "Reviews.Rating", "Name"]) == {"includes": ["Name", "Reviews.Rating"]}
+    assert parseProjection("Name, AggregatedRating,") == {"includes": ["Name", "AggregatedRating"]}
+    assert parseProjection(view="card") == VIEWS["card"]
+    assert parseProjection(view="full") is None
+    # The fields win over the view
+    assert parseProjection(["Name"], "detail") == {"includes": ["Name"]}
+
+
+@pytest.mark.parametrize("fields, view", [([], None), ("", None), (["Name", 3], None), (["Name; DROP"], None),
+                                          (["`id`"], None), ({"Name": 1}, None), (None, "compact")])
+def test_parse_projection_rejects_bad_fields_and_views(fields, view):
+    with pytest.raises(ValueError):
+        parseProjection(fields, view)
+
+
+def test_source_filter_keeps_the_id():
+    body = {"query": {"match_all": {}}}
+    assert withSourceFilter(body, None) is body
+    assert withSourceFilter(body, {"includes": ["Name"]}) == {**body, "_source": {"includes": ["RecipeId", "Name"]}}
+    assert withSourceFilter(body, {"includes": ["RecipeId", "Name"]})["_source"] == {"includes": ["RecipeId", "Name"]}
+    assert withSourceFilter(body, VIEWS["detail"]) == {**body, "_source": {"excludes": ["Reviews"]}}
+
+
+def test_cypher_projection():
+    assert cypherProjection(None) == "r"
+    assert cypherProjection(VIEWS["detail"]) == "r"
+    assert cypherProjection({"includes": ["Name", "Reviews.Rating"]}) == "r {.`id`, .`Name`, .`Reviews`}"
+    assert cypherProjection({"includes": ["id"]}, "recipe") == "recipe {.`id`}"
+
+
+def test_recipe_projection_rewrites_the_return_clause():
+    assert withRecipeProjection(MATCH_INGREDIENTS, None) is MATCH_INGREDIENTS
+    query = withRecipeProjection(MATCH_INGREDIENTS, {"includes": ["Name"]})
+    assert "RETURN r {.`id`, .`Name`} AS r," in query
+    assert query.replace("r {.`id`, .`Name`} AS r", "r") == MATCH_INGREDIENTS
+
+
+def test_projection_key():
+    assert projectionKey(None) is None
+    assert projectionKey({"includes": ["Name"]}) == projectionKey({"includes": ["Name"]})
+    assert projectionKey({"includes": ["Name"]}) != projectionKey({"includes": ["AggregatedRating"]})
@@ -0,0 +1,78 @@
+import QueryCache
+from QueryCache import CannedQueryCache, LocalKeyValueStore, MemoryCacheBackend, SharedCacheBackend
+
+
+def recipes(count):
+    return {"recipes": [{"matchingScore": 10 - index, "recipe": {"RecipeId": index}} for index in range(count)]}
+
+
+def test_smaller_limits_are_sliced_from_the_cached_response():
+    cache = CannedQueryCache([MemoryCacheBackend()])
+    assert cache.get(1, 5) is None
+    cache.put(1, 5, recipes(5))
+    assert cache.get(1, 3) == recipes(3)
+    assert cache.get(1, 5) == recipes(5)
+    # A larger limit has to run the query, unless the query has no more results
+    assert cache.get(1, 10) is None
+    cache.put(2, 5, recipes(2))
+    assert cache.get(2, 10) == recipes(2)
+    assert cache.statistics()["hits"] == 3
+
+
+def test_variants_and_aggregations():
+    cache = CannedQueryCache([MemoryCacheBackend()])
+    cache.put(1, 5, recipes(5), variant="card")
+    assert cache.get(1, 5) is None
+    aggregations = {"aggregations": {"average_rating": {"value": 4.2}}}
+    cache.put(6, 0, aggregations)
+    assert cache.get(6, 50) == aggregations
+
+
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(QueryCache.time, "monotonic", lambda: now[0])
+    backend = MemoryCacheBackend(ttl=10)
+    backend.set("key", {"value": 1})
+    now[0] += 9
+    assert backend.get("key") == {"value": 1}
+    now[0] += 2
+    assert backend.get("key") is None
+    assert backend.stats["expirations"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    backend = MemoryCacheBackend(maxBytes=30)
+    backend.set("a", "x" * 10)
+    backend.set("b", "y" * 10)
+    backend.get("a")
+    backend.set("c", "z" * 10)
+    assert backend.get("b") is None
+    assert backend.get("a") == "x" * 10
+    assert backend.size <= 30
+    # An entry larger than the cache is not stored
+    backend.set("d", "w" * 100)
+    assert backend.get("d") is None
+
+
+def test_shared_tier_hits_fill_the_memory_tier():
+    store = LocalKeyValueStore()
+    CannedQueryCache([SharedCacheBackend(store)]).put(1, 5, recipes(5))
+    memory = MemoryCacheBackend()
+    cache = CannedQueryCache([memory, SharedCacheBackend(store)])
+    assert cache.get(1, 2) == recipes(2)
+    assert memory.get("query:1") == {"limit": 5, "response": recipes(5)}
+
+
+def test_unavailable_shared_store_is_a_miss():
+    class BrokenStore:
+        def get(self, key):
+            raise ConnectionError("down")
+
+        def set(self, key, value, ex=None):
+            raise ConnectionError("down")
+
+    backend = SharedCacheBackend(BrokenStore())
+    cache = CannedQueryCache([backend])
+    cache.put(1, 5, recipes(5))
+    assert cache.get(1, 5) is None
+    assert backend.stats["errors"] == 2
@@ -0,0 +1,116 @@
+import pytest
+
+import app
+from ElasticQueries import cannedQuery
+from QueryTemplates import Parameter, loadQueryTemplates
+
+TEMPLATE = {
+    "queryNumber": 0,
+    "queryDescription": "Quick recipes with some ingredients",
+    "parameters": {
+        "ingredients": {"type": "terms", "default": "chicken onion"},
+        "maxTotalTime": {"type": "integer", "default": 30, "min": 0, "max": 600},
+        "minRating": {"type": "number", "default": 4.0},
+        "strict": {"type": "boolean", "default": False},
+    },
+    "query": {"query": {"bool": {
+        "must": [{"match": {"RecipeIngredientParts": {"query": "{{ingredients}}", "operator": "and"}}},
+                 {"range": {"TotalTime": {"lte": "{{maxTotalTime}}"}}},
+                 {"range": {"AggregatedRating": {"gte": "{{minRating}}"}}}],
+        "filter": [{"term": {"Strict": "{{strict}}"}}],
+        "must_not": [{"match": {"Description": "{{not a placeholder}}"}}]}}},
+}
+
+
+def template():
+    return loadQueryTemplates([TEMPLATE])[0]
+
+
+def test_placeholders_are_replaced_with_typed_values():
+    query = template()
+    values = query.values({"ingredients": ["beef", "rice"], "maxTotalTime": "45", "minRating": "3.5", "strict": "true"})
+    body = query.build(values)["query"]["bool"]
+    assert body["must"][0]["match"]["RecipeIngredientParts"]["query"] == "beef rice"
+    assert body["must"][1]["range"]["TotalTime"]["lte"] == 45
+    assert body["must"][2]["range"]["AggregatedRating"]["gte"] == 3.5
+    assert body["filter"][0]["term"]["Strict"] is True
+    assert body["must_not"][0]["match"]["Description"] == "{{not a placeholder}}"
+    # The template itself is left untouched
+    assert TEMPLATE["query"]["query"]["bool"]["must"][1]["range"]["TotalTime"]["lte"] == "{{maxTotalTime}}"
+
+
+def test_defaults():
+    query = template()
+    assert query.build(query.values()) is query.defaultBody
+    assert query.key(query.values({"maxTotalTime": 30})) is None
+    assert query.key(query.values({"maxTotalTime": 31})) is not None
+
+
+@pytest.mark.parametrize("name, value", [
+    ("maxTotalTime", "abc"), ("maxTotalTime", 2.5), ("maxTotalTime", -1), ("maxTotalTime", 601), ("maxTotalTime", True),
+    ("maxTotalTime", float("inf")), ("minRating", "nan"), ("minRating", "inf"), ("minRating", "-Infinity"),
+    ("minRating", float("nan")), ("ingredients", ""), ("ingredients", "x" * 501), ("strict", "yes"),
+])
+def test_invalid_values_are_rejected(name, value):
+    with pytest.raises(ValueError):
+        template().values({name: value})
+
+
+def test_invalid_templates_are_rejected():
+    with pytest.raises(ValueError, match="undeclared"):
+        loadQueryTemplates([{**TEMPLATE, "parameters": {}}])
+    with pytest.raises(ValueError, match="invalid parameter name"):
+        loadQueryTemplates([{**TEMPLATE, "parameters": {"limit": {"type": "integer", "default": 1}}}])
+    with pytest.raises(ValueError, match="in order"):
+        loadQueryTemplates([{**TEMPLATE, "queryNumber": 1}])
+    with pytest.raises(ValueError):
+        Parameter("minRating", "number", "nan")
+
+
+def test_canned_query_parameters():
+    body, variant = cannedQuery(7, {"minProtein": "12.5"})
+    assert variant.startswith('parameters={"minProtein":12.5')
+    assert cannedQuery(7, {"minProtein": "12.5", "view": "card"})[1] == variant
+    with pytest.raises(ValueError):
+        cannedQuery(7, {"minProtein": "nan"})
+
+
+RANGE_TEMPLATE = {
+    "parameters": {
+        "minServings": {"type": "integer", "default": 2, "min": 1},
+        "maxServings": {"type": "integer", "default": 4, "min": 1},
+        "minTitle": {"type": "string", "default": "a"},
+        "maxTitle": {"type": "string", "default": "b"},
+    },
+    "query": {"query": {"bool": {"must": [
+        {"range": {"RecipeServings": {"gte": "{{minServings}}", "lte": "{{maxServings}}"}}},
+        {"range": {"Name": {"gte": "{{minTitle}}", "lte": "{{maxTitle}}"}}}]}}},
+}
+
+
+def test_ranges_are_checked_across_parameters():
+    query = loadQueryTemplates([RANGE_TEMPLATE])[0]
+    # Only the numeric pairs are ranges
+    assert query.ranges == [("minServings", "maxServings")]
+    assert query.describe()["ranges"] == [["minServings", "maxServings"]]
+    assert query.values({"minServings": 3, "maxServings": 3})["maxServings"] == 3
+    with pytest.raises(ValueError, match="minServings should be at most maxServings"):
+        query.values({"minServings": 6, "maxServings": 2})
+    # Checked against the default of the other bound too
+    with pytest.raises(ValueError, match="minServings should be at most maxServings"):
+        query.values({"minServings": 5})
+    with pytest.raises(ValueError, match="should be at most maxServings"):
+        cannedQuery(0, {"minServings": "6", "maxServings": "2"})
+    assert "ranges" not in template().describe()
+
+
+def test_ranges_with_inverted_defaults_are_rejected():
+    parameters = {**RANGE_TEMPLATE["parameters"], "minServings": {"type": "integer", "default": 5}}
+    with pytest.raises(ValueError, match="greater than the default of maxServings"):
+        loadQueryTemplates([{**RANGE_TEMPLATE, "parameters": parameters}])
+
+
+def test_the_route_rejects_inverted_ranges():
+    response = app.app.test_client().get("/api/elasticsearch/queries?queryNumber=0&limit=5&minServings=6&maxServings=2")
+    assert response.status_code == 400
+    assert "minServings" in response.get_json()["error"]
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from RecipeGraph import RefreshableIndex
+from RecipeSimilarity import RecipeSimilarityIndex
+from tests.fixtureGraph import RECIPES, fixtureGraph
+
+
+def jaccard(first, second):
+    return len(set(first) & set(second)) / len(set(first) | set(second))
+
+
+def exactSimilarities(ingredients, exclude=None):
+    """The recipes sharing ingredients with the list, by exact Jaccard similarity and then by id."""
+    matches = [(jaccard(ingredients, recipe["ingredients"]), recipe["id"]) for recipe in RECIPES
+               if recipe["id"] != exclude and set(ingredients) & set(recipe["ingredients"])]
+    return sorted(matches, key=lambda match: (-match[0], match[1]))
+
+
+@pytest.mark.parametrize("recipeId", [recipe["id"] for recipe in RECIPES])
+def test_similar_recipes_match_a_brute_force_scan(recipeId):
+    # With many bands of one row, every recipe sharing an ingredient is a candidate
+    index = RecipeSimilarityIndex(fixtureGraph(), bands=64, rows=1)
+    ingredients = next(recipe["ingredients"] for recipe in RECIPES if recipe["id"] == recipeId)
+    matches = index.similarRecipes(recipeId, limit=None)
+
+    expected = exactSimilarities(ingredients, exclude=recipeId)
+    assert [match["recipeId"] for match in matches] == [recipeId for _, recipeId in expected]
+    assert [match["similarity"] for match in matches] == pytest.approx([similarity for similarity, _ in expected])
+    for match in matches:
+        recipe = next(recipe for recipe in RECIPES if recipe["id"] == match["recipeId"])
+        assert sorted(match["commonIngredients"]) == sorted(set(ingredients) & set(recipe["ingredients"]))
+
+
+def test_similar_to_ingredients():
+    index = RecipeSimilarityIndex(fixtureGraph())
+    matches = index.similarToIngredients(["sugar", "flour", "egg", "butter", "unknown"], limit=1)
+    assert matches == [{"recipeId": 4, "similarity": 1.0, "commonIngredients": ["butter", "sugar", "flour", "egg"]}]
+    assert index.similarToIngredients(["unknown"]) == []
+
+
+def test_limits_and_unknown_recipes():
+    index = RecipeSimilarityIndex(fixtureGraph(), bands=64, rows=1)
+    assert len(index.similarRecipes(1, limit=2)) == 2
+    assert index.similarRecipes(1, limit=0) == []
+    assert index.similarRecipes(42) is None
+
+
+def test_index_is_built_in_the_background_when_not_ready():
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return "index"
+
+    index = RefreshableIndex(build)
+    assert index.getIfReady() is None
+    started.wait(5)
+    # A second request does not start another build
+    assert index.getIfReady() is None
+    release.set()
+    for _ in range(500):
+        if index.value is not None:
+            break
+        threading.Event().wait(0.01)
+    assert index.getIfReady() == "index"
+    assert len(builds) == 1
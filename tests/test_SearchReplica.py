@@ -0,0 +1,202 @@
+import asyncio
+import math
+
+import pytest
+from elasticsearch.exceptions import ConnectionTimeout, TransportError
+
+from Streaming import streamElasticHits, streamElasticHitsAsync
+from SearchReplica import (B, K1, AsyncReplicaSearchClient, ReplicaSearchClient, Replica, UnsupportedQuery, analyze,
+                           writeReplica)
+
+DOCUMENTS = [
+    {"RecipeId": 1, "RecipeCategory": "Dessert", "Description": "A chocolate cake for a birthday party.",
+     "RecipeIngredientParts": ["chocolate", "flour", "egg"], "AggregatedRating": 4.5, "Calories": 450.0,
+     "Reviews": [{"ReviewId": 11, "Rating": 5, "Review": "Great cake"}, {"ReviewId": 12, "Rating": 4, "Review": "Too sweet"}]},
+    {"RecipeId": 2, "RecipeCategory": "Main dish", "Description": "Chicken with rice, a quick chicken dinner.",
+     "RecipeIngredientParts": ["chicken", "rice", "garlic"], "AggregatedRating": 4.0, "Calories": 700.0,
+     "Reviews": [{"ReviewId": 21, "Rating": 3, "Review": "Good"}]},
+    {"RecipeId": 3, "RecipeCategory": "Main dish", "Description": "Beef stew.",
+     "RecipeIngredientParts": ["beef", "onion", "carrot"], "AggregatedRating": 3.0, "Calories": 900.0, "Reviews": []},
+    {"RecipeId": 4, "RecipeCategory": "Snacks", "Description": "Garlic bread with a lot of garlic and butter.",
+     "RecipeIngredientParts": ["bread", "garlic", "butter"], "AggregatedRating": 5.0, "Calories": 300.0,
+     "Reviews": [{"ReviewId": 41, "Rating": 5, "Review": "Great snack for a party"}]},
+    {"RecipeId": 5, "RecipeCategory": "Dessert", "Description": "Lemon tart.",
+     "RecipeIngredientParts": ["lemon", "flour", "butter", "egg"], "Calories": 350.0,
+     "Reviews": [{"ReviewId": 51, "Rating": 2, "Review": "Great but sour"}]},
+]
+
+
+@pytest.fixture
+def replica(tmp_path):
+    writeReplica(({"_id": str(document["RecipeId"]), "_source": document} for document in DOCUMENTS), str(tmp_path))
+    return Replica.open(str(tmp_path))
+
+
+def ids(response):
+    return [int(hit["_id"]) for hit in response["hits"]["hits"]]
+
+
+def test_match_is_scored_with_bm25(replica):
+    response = replica.search({"query": {"match": {"Description": "chicken"}}})
+    assert ids(response) == [2]
+
+    lengths = [len(analyze(document["Description"])) for document in DOCUMENTS]
+    idf = math.log(1 + (len(DOCUMENTS) - 1 + 0.5) / 1.5)
+    expected = idf * 2 / (2 + K1 * (1 - B + B * lengths[1] / (sum(lengths) / len(lengths))))
+    assert response["hits"]["hits"][0]["_score"] == pytest.approx(expected)
+    assert response["hits"]["max_score"] == pytest.approx(expected)
+
+
+def test_bool_filters(replica):
+    query = {"bool": {"must": [{"match": {"RecipeIngredientParts": "garlic butter"}}],
+                      "filter": [{"range": {"Calories": {"lt": 800}}}],
+                      "must_not": [{"term": {"RecipeId": 5}}]}}
+    response = replica.search({"query": query})
+    assert ids(response) == [4, 2]
+    assert response["hits"]["total"] == {"value": 2, "relation": "eq"}
+    # With a filter the should clauses only score
+    query["bool"]["should"] = query["bool"].pop("must")
+    assert ids(replica.search({"query": query})) == [4, 2, 1]
+
+    assert ids(replica.search({"query": {"terms": {"RecipeId": [1, 3]}}, "sort": [{"RecipeId": "asc"}]})) == [1, 3]
+    assert ids(replica.search({"query": {"match": {"RecipeIngredientParts": {"query": "flour egg lemon", "operator": "and"}}}})) == [5]
+
+
+def test_nested_reviews(replica):
+    response = replica.search({"query": {"nested": {"path": "Reviews", "query": {"match": {"Reviews.Review": "great"}}}},
+                               "sort": [{"RecipeId": "asc"}]})
+    assert ids(response) == [1, 4, 5]
+
+
+def test_sort_and_search_after(replica):
+    body = {"query": {"match_all": {}}, "sort": [{"AggregatedRating": "desc"}, {"RecipeId": "asc"}], "size": 2}
+    pages = []
+    while True:
+        hits = replica.search(body)["hits"]["hits"]
+        pages.extend(int(hit["_id"]) for hit in hits)
+        if len(hits) < 2:
+            break
+        body = {**body, "search_after": hits[-1]["sort"]}
+    # The recipe without rating comes last
+    assert pages == [4, 1, 2, 3, 5]
+
+
+def test_source_filters_and_aggregations(replica):
+    response = replica.search({"query": {"match_all": {}}, "_source": {"includes": ["RecipeId", "Calories"]}, "size": 1,
+                               "sort": [{"RecipeId": "asc"}],
+                               "aggs": {"calories": {"range": {"field": "Calories", "ranges": [{"key": "light", "to": 500}]},
+                                                     "aggs": {"rating": {"avg": {"field": "AggregatedRating"}}}}}})
+    assert response["hits"]["hits"][0]["_source"] == {"RecipeId": 1, "Calories": 450.0}
+    bucket = response["aggregations"]["calories"]["buckets"][0]
+    assert bucket["doc_count"] == 3
+    assert bucket["rating"]["value"] == pytest.approx(4.75)
+
+
+def test_unsupported_queries(replica):
+    with pytest.raises(UnsupportedQuery):
+        replica.search({"query": {"script": {"script": "doc['Calories'].value > 10"}}})
+    with pytest.raises(UnsupportedQuery):
+        replica.search({"query": {"match_all": {}}, "highlight": {}})
+
+
+class FakeRemote:
+    """Cluster client failing with the exceptions of its failures list, in order, then answering."""
+
+    def __init__(self, replica, failures=()):
+        self.replica = replica
+        self.failures = list(failures)
+        self.timeouts = []
+
+    def search(self, body=None, index=None, size=None, from_=None, request_timeout=None):
+        self.timeouts.append(request_timeout)
+        if self.failures:
+            raise self.failures.pop(0)
+        response = self.replica.search(body, size, from_)
+        response["remote"] = True
+        return response
+
+
+class Holder:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def timeout():
+    return ConnectionTimeout("TIMEOUT", "Read timed out", Exception())
+
+
+def test_fallback_to_the_replica(replica):
+    remote = FakeRemote(replica, [timeout()])
+    client = ReplicaSearchClient(remote, Holder(replica), "fallback", timeoutSeconds=0.5, cooldownSeconds=60)
+    body = {"query": {"match": {"Description": "garlic"}}}
+
+    assert "remote" not in client.search(body=body, index="recipeswithreviews")
+    assert remote.timeouts == [0.5]
+    # During the cooldown the replica answers without asking the cluster
+    assert ids(client.search(body=body, index="recipeswithreviews")) == [4]
+    assert remote.timeouts == [0.5]
+
+    client.remoteDownUntil = 0
+    assert client.search(body=body, index="recipeswithreviews", request_timeout=120)["remote"]
+    assert remote.timeouts == [0.5, 120]
+
+
+def test_bad_requests_are_not_answered_by_the_replica(replica):
+    remote = FakeRemote(replica, [TransportError(400, "parsing_exception", {})])
+    client = ReplicaSearchClient(remote, Holder(replica), "fallback")
+    with pytest.raises(TransportError):
+        client.search(body={"query": {"match_all": {}}})
+    assert client.remoteDownUntil == 0
+
+
+def test_local_mode_sends_the_unsupported_queries_to_the_cluster(replica):
+    remote = FakeRemote(replica)
+    client = ReplicaSearchClient(remote, Holder(replica), "local")
+    assert "remote" not in client.search(body={"query": {"match_all": {}}})
+    with pytest.raises(UnsupportedQuery):
+        # The fake cluster is the replica, which can not answer it either
+        client.search(body={"query": {"script": {}}})
+    assert remote.timeouts == [None]
+
+
+def test_a_listing_stays_on_the_backend_of_its_first_page(replica):
+    body = {"query": {"match_all": {}}}
+
+    # The cluster answered the first page, its failure on the second one ends the listing
+    remote = FakeRemote(replica)
+    client = ReplicaSearchClient(remote, Holder(replica), "fallback")
+    hits = streamElasticHits(client, body, limit=5, pageSize=2)
+    assert next(hits)["recipe"]["RecipeId"] == 1
+    next(hits)
+    remote.failures.append(timeout())
+    with pytest.raises(ConnectionTimeout):
+        next(hits)
+
+    # The replica answered the first page, the next ones come from it after the cooldown is over
+    remote = FakeRemote(replica, [timeout()])
+    client = ReplicaSearchClient(remote, Holder(replica), "fallback")
+    hits = streamElasticHits(client, body, limit=5, pageSize=2)
+    recipeIds = [next(hits)["recipe"]["RecipeId"] for _ in range(2)]
+    client.remoteDownUntil = 0
+    recipeIds.extend(hit["recipe"]["RecipeId"] for hit in hits)
+    assert recipeIds == [1, 2, 3, 4, 5]
+    assert len(remote.timeouts) == 1
+
+
+def test_an_async_listing_stays_on_the_backend_of_its_first_page(replica):
+    class AsyncFakeRemote(FakeRemote):
+        async def search(self, **kwargs):
+            return FakeRemote.search(self, **kwargs)
+
+    async def listing(client):
+        return [hit["recipe"]["RecipeId"] async for hit in streamElasticHitsAsync(client, {"query": {"match_all": {}}},
+                                                                                   limit=5, pageSize=2)]
+
+    remote = AsyncFakeRemote(replica, [timeout()])
+    client = AsyncReplicaSearchClient(remote, Holder(replica), "fallback", cooldownSeconds=0)
+    assert asyncio.run(listing(client)) == [1, 2, 3, 4, 5]
+    # The cooldown was over after the first page, but the listing stayed on the replica
+    assert len(remote.timeouts) == 1
@@ -0,0 +1,69 @@
+import gzip
+import json
+
+import pytest
+import numpy as np
+from flask import Flask, Response, jsonify, request
+
+import Serialization
+from Serialization import COMPRESSION_MIN_BYTES, compressResponse, installJSONProvider
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Without brotli, so that gzip is the only compression
+    monkeypatch.setattr(Serialization, "brotli", None)
+    app = Flask(__name__)
+    installJSONProvider(app)
+
+    @app.route("/large")
+    def large():
+        return jsonify({"recipes": ["x" * 50] * COMPRESSION_MIN_BYTES})
+
+    @app.route("/small")
+    def small():
+        return jsonify({"recipes": []})
+
+    @app.route("/stream")
+    def stream():
+        return Response((line for line in ["{}\n"] * COMPRESSION_MIN_BYTES), mimetype="application/x-ndjson")
+
+    @app.after_request
+    def compress(response):
+        return compressResponse(response, request)
+
+    return app.test_client()
+
+
+def test_large_responses_are_compressed(client):
+    response = client.get("/large", headers={"Accept-Encoding": "br, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert json.loads(gzip.decompress(response.get_data())) == {"recipes": ["x" * 50] * COMPRESSION_MIN_BYTES}
+
+
+def test_uncompressed_responses(client):
+    # Not accepted by the client
+    assert "Content-Encoding" not in client.get("/large", headers={"Accept-Encoding": "identity"}).headers
+    assert "Content-Encoding" not in client.get("/large").headers
+    # Under the size threshold
+    assert "Content-Encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    # Streamed line by line
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data(as_text=True) == "{}\n" * COMPRESSION_MIN_BYTES
+
+
+def test_brotli_is_preferred_when_installed(client, monkeypatch):
+    brotli = pytest.importorskip("brotli")
+    monkeypatch.setattr(Serialization, "brotli", brotli)
+    response = client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+
+
+def test_json_provider_encodes_numpy_values():
+    pytest.importorskip("orjson")
+    app = Flask(__name__)
+    installJSONProvider(app)
+    assert isinstance(app.json, Serialization.OrjsonProvider)
+    assert json.loads(app.json.dumps({"score": np.float64(1.5), 2: [np.int64(3)]})) == {"score": 1.5, "2": [3]}
@@ -0,0 +1,122 @@
+import pytest
+
+import app
+from Neo4jQueries import MATCH_INGREDIENTS_AFTER
+from Streaming import (MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE, decodeCursor, encodeCursor, parseLimit, parsePageSize,
+                       streamElasticHits, streamNeo4jMatches)
+from tests.fixtureGraph import RECIPES
+
+
+class FakeRecord(dict):
+    def data(self):
+        return dict(self)
+
+
+class FakeSession:
+    """Evaluates MATCH_INGREDIENTS_AFTER on the fixture recipes."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, ingredients, afterScore, afterId, limit):
+        assert query.startswith(MATCH_INGREDIENTS_AFTER)
+        self.driver.parameters.append((afterScore, afterId, limit))
+        records = []
+        for recipe in RECIPES:
+            matching = [ingredient for ingredient in recipe["ingredients"] if ingredient in ingredients]
+            score = len(matching)
+            if score and (afterScore is None or score < afterScore or (score == afterScore and recipe["id"] > afterId)):
+                records.append(FakeRecord(r={"id": recipe["id"]}, matchingScore=score, matchingIngredients=matching))
+        records.sort(key=lambda record: (-record["matchingScore"], record["r"]["id"]))
+        return iter(records if limit is None else records[:limit])
+
+
+class FakeDriver:
+    def __init__(self):
+        self.parameters = []
+
+    def session(self):
+        return FakeSession(self)
+
+
+class FakeElasticsearch:
+    """Hits of decreasing score, sorted by score and RecipeId, paged with search_after."""
+
+    def __init__(self, numHits):
+        self.hits = [{"_score": float(10 - position // 3), "_source": {"RecipeId": position}} for position in range(numHits)]
+        self.sizes = []
+
+    def search(self, index, body):
+        self.sizes.append(body["size"])
+        assert body["sort"] == [{"_score": "desc"}, {"RecipeId": "asc"}]
+        hits = [{**hit, "sort": [hit["_score"], hit["_source"]["RecipeId"]]} for hit in self.hits]
+        if "search_after" in body:
+            score, recipeId = body["search_after"]
+            hits = [hit for hit in hits if hit["_score"] < score or (hit["_score"] == score and hit["_source"]["RecipeId"] > recipeId)]
+        return {"hits": {"hits": hits[:body["size"]]}}
+
+
+def test_cursor_round_trip():
+    assert decodeCursor(encodeCursor([3, 42])) == [3, 42]
+    assert decodeCursor(encodeCursor([3, 42]), length=2) == [3, 42]
+    for token in ("not a cursor", encodeCursor({"score": 3}), encodeCursor([3])):
+        with pytest.raises(ValueError):
+            decodeCursor(token, length=2)
+
+
+def test_parse_page_size_and_limit():
+    assert parsePageSize(None) == DEFAULT_PAGE_SIZE
+    assert parsePageSize("20") == 20
+    assert parsePageSize(10 ** 9) == MAX_PAGE_SIZE
+    assert parseLimit("5") == 5
+    assert parseLimit(None, required=False) is None
+    for value in (0, -1, "x", [5]):
+        with pytest.raises(ValueError):
+            parsePageSize(value)
+    for value in (None, -1, "abc", True, {}):
+        with pytest.raises(ValueError):
+            parseLimit(value)
+
+
+def test_neo4j_keyset_paging():
+    ingredients = ["salt", "pepper", "chicken"]
+    driver = FakeDriver()
+    everything = list(streamNeo4jMatches(driver, ingredients))
+    assert [line["recipe"]["id"] for line in everything] == [1, 6, 2, 7, 8, 5]
+
+    pages, after = [], None
+    while True:
+        page = list(streamNeo4jMatches(driver, ingredients, limit=2, after=after))
+        pages.append([line["recipe"]["id"] for line in page if "cursor" not in line])
+        if "cursor" not in page[-1]:
+            break
+        after = decodeCursor(page[-1]["cursor"], length=2)
+    assert pages == [[1, 6], [2, 7], [8, 5]]
+    # One more recipe than the limit is read to know if the listing continues
+    assert driver.parameters[-1][2] == 3
+
+
+def test_elastic_pages_end_with_a_cursor_only_when_there_are_more_hits():
+    es = FakeElasticsearch(10)
+    lines = list(streamElasticHits(es, {"query": {"match_all": {}}}, limit=7, pageSize=3))
+    assert [line["recipe"]["RecipeId"] for line in lines[:-1]] == list(range(7))
+    assert es.sizes == [3, 3, 2]
+
+    rest = list(streamElasticHits(es, {"query": {"match_all": {}}}, limit=7, after=decodeCursor(lines[-1]["cursor"])))
+    assert [line["recipe"]["RecipeId"] for line in rest] == [7, 8, 9]
+
+    assert "cursor" not in list(streamElasticHits(FakeElasticsearch(7), {}, limit=7, pageSize=3))[-1]
+    assert list(streamElasticHits(es, {}, limit=0)) == []
+
+
+@pytest.mark.parametrize("route", ["/api/elasticsearch/matchIngredients", "/api/elasticsearch/matchIngredientsAnd"])
+@pytest.mark.parametrize("body", [{"limit": "abc"}, {"limit": -1}, {"limit": 5, "pageSize": 0}, {"limit": 5, "cursor": "x"}])
+def test_streamed_routes_reject_bad_parameters(route, body):
+    response = app.app.test_client().post(route + "?stream=true", json={"ingredients": ["salt"], **body})
+    assert response.status_code == 400
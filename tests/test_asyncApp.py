@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+import asyncApp
+from benchmarks.fakeBackends import AsyncFakeElasticsearch, AsyncFakeNeo4jDriver, graphHandler
+from tests.fixtureGraph import fixtureGraph
+
+
+@pytest.fixture(autouse=True)
+def backends(monkeypatch):
+    monkeypatch.setattr(asyncApp, "driver", AsyncFakeNeo4jDriver(graphHandler(fixtureGraph())))
+    monkeypatch.setattr(asyncApp, "es", AsyncFakeElasticsearch(20))
+    monkeypatch.setattr(asyncApp, "queryCache", None)
+    monkeypatch.setattr(asyncApp, "materializedQueries", None)
+    monkeypatch.setattr(asyncApp, "use_local_indexes", False)
+
+
+def call(method, path, body=None):
+    """Send a request to the async app, and return its status and body (a list of lines for NDJSON)."""
+    async def send():
+        client = asyncApp.app.test_client()
+        response = await getattr(client, method)(path, json=body) if body is not None else await getattr(client, method)(path)
+        data = await response.get_data(as_text=True)
+        if response.mimetype == "application/x-ndjson":
+            return response.status_code, [json.loads(line) for line in data.splitlines()]
+        return response.status_code, json.loads(data)
+
+    return asyncio.run(send())
+
+
+def test_neo4j_match_ingredients():
+    status, data = call("post", "/api/neo4j/matchIngredients", {"ingredients": ["salt", "pepper"], "limit": 2})
+    assert status == 200
+    assert [match["matchingScore"] for match in data["recipes"]] == [2, 2]
+
+    status, lines = call("post", "/api/neo4j/matchIngredients?stream=true", {"ingredients": ["salt", "pepper"], "limit": 2})
+    assert status == 200
+    assert len(lines) == 3 and "cursor" in lines[-1]
+
+
+@pytest.mark.parametrize("path", ["/api/neo4j/matchIngredients", "/api/neo4j/matchIngredients?stream=true"])
+@pytest.mark.parametrize("body", [{"limit": 2}, {"ingredients": "salt"}, {"ingredients": ["salt"], "limit": "x"}, [1]])
+def test_neo4j_match_ingredients_rejects_bad_bodies(path, body):
+    assert call("post", path, body)[0] == 400
+
+
+def test_elastic_match_ingredients_streams_pages():
+    status, lines = call("post", "/api/elasticsearch/matchIngredients?stream=true&pageSize=3",
+                         {"ingredients": ["salt"], "limit": 7})
+    assert status == 200
+    assert [line["recipe"]["RecipeId"] for line in lines[:-1]] == list(range(7))
+    assert "cursor" in lines[-1]
+
+    for body in ({"ingredients": ["salt"]}, {"ingredients": ["salt"], "limit": "abc"}):
+        assert call("post", "/api/elasticsearch/matchIngredients?stream=true", body)[0] == 400
+
+
+@pytest.mark.parametrize("query", ["queryNumber=x&limit=5", "queryNumber=1&limit=5.5", "queryNumber=99&limit=5",
+                                   "queryNumber=1&limit=-1", "limit=5", "queryNumber=1"])
+def test_elastic_queries_rejects_bad_parameters(query):
+    assert call("get", f"/api/elasticsearch/queries?{query}")[0] == 400
+
+
+def test_streamed_aggregations_are_one_line():
+    status, lines = call("get", "/api/elasticsearch/queries?queryNumber=6&limit=5&stream=true")
+    assert status == 200
+    assert len(lines) == 1 and "aggregations" in lines[0]
+
+    status, lines = call("get", "/api/elasticsearch/queries?queryNumber=1&limit=5&stream=true")
+    assert status == 200
+    assert len(lines) == 6 and "cursor" in lines[-1]
+
+
+def test_mix_and_max_and_hybrid_validate_their_bodies():
+    assert call("post", "/api/neo4j/mixAndMax", {"ingredients": ["salt"], "limit": "x"})[0] == 400
+    assert call("post", "/api/hybrid/matchIngredients", {"ingredients": ["salt"], "deadline": 0})[0] == 400
+    status, data = call("post", "/api/hybrid/matchIngredients", {"ingredients": ["salt", "pepper"], "limit": 3})
+    assert status == 200
+    assert not data["partial"] and len(data["recipes"]) == 3
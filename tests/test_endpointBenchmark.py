@@ -0,0 +1,89 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import app
+from benchmarks.elasticStub import ElasticStub
+from benchmarks.endpointBenchmark import compare, drive, percentiles, phaseMedians, routes, send
+from benchmarks.fakeBackends import FakeNeo4jDriver, graphHandler
+from benchmarks.syntheticData import sampleQueries, syntheticRecipeGraph
+from LocalIndexes import buildLocalIndexes, buildAutocompleteIndex, buildSimilarityIndex
+from Metrics import InstrumentedDriver, InstrumentedElasticsearch
+from RecipeGraph import RefreshableIndex
+
+
+@pytest.fixture(scope="module")
+def stub():
+    stub = ElasticStub(50, numReviews=2).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def es(stub):
+    elasticsearch = pytest.importorskip("elasticsearch")
+    return elasticsearch.Elasticsearch(stub.url)
+
+
+def test_the_stub_answers_the_real_client(es):
+    response = es.search(index="recipeswithreviews", body={"query": {"match_all": {}}, "_source": ["RecipeId"]},
+                         size=3)
+    assert [hit["_source"] for hit in response["hits"]["hits"]] == [{"RecipeId": 0}, {"RecipeId": 1},
+                                                                    {"RecipeId": 2}]
+
+    responses = es.msearch(body=[{"index": "recipeswithreviews"}, {"query": {"match_all": {}}, "size": 1},
+                                 {"index": "recipeswithreviews"}, {"query": {"match_all": {}}, "size": 2}])
+    assert [len(response["hits"]["hits"]) for response in responses["responses"]] == [1, 2]
+
+
+def test_the_stub_rejects_the_other_apis(stub):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f"{stub.url}/recipeswithreviews/_doc/1")
+    assert error.value.code == 404
+    assert json.loads(error.value.read())["error"]["type"] == "unsupported"
+
+
+def test_every_route_is_answered_by_the_stand_ins(monkeypatch, es):
+    graph = syntheticRecipeGraph(200, 50)
+    driver = InstrumentedDriver(FakeNeo4jDriver(graphHandler(graph)))
+    localIndexes = RefreshableIndex(lambda: buildLocalIndexes(driver))
+    similarityIndex = RefreshableIndex(lambda: buildSimilarityIndex(driver, localIndexes))
+    similarityIndex.refresh()
+    monkeypatch.setattr(app, "driver", driver)
+    monkeypatch.setattr(app, "es", InstrumentedElasticsearch(es))
+    monkeypatch.setattr(app, "localIndexes", localIndexes)
+    monkeypatch.setattr(app, "similarityIndex", similarityIndex)
+    monkeypatch.setattr(app, "autocompleteIndex", RefreshableIndex(lambda: buildAutocompleteIndex(driver)))
+    monkeypatch.setattr(app, "materializedQueries", None)
+
+    client = app.app.test_client()
+    for route, request in routes(sampleQueries(graph, 3, 10)).items():
+        response = send(client, request(1))
+        assert response.status_code == 200, (route, response.get_data()[:200])
+
+    # Concurrent clients, with a Server-Timing header on every response
+    elapsed, latencies, sizes, serverTimings, errors = drive(app.app, routes(sampleQueries(graph, 3, 10))["batch"], 12, 3)
+    assert errors == 0
+    assert len(latencies) == len(sizes) == len(serverTimings) == 12
+    assert all(size > 0 for size in sizes)
+
+
+def test_percentiles_and_phase_medians():
+    assert percentiles([1.0, 2.0, 3.0, 4.0, 5.0]) == {"p50": 3.0, "p95": 4.8, "p99": 4.96, "mean": 3.0}
+    assert phaseMedians(["neo4j;dur=1.00, app;dur=2.00", "neo4j;dur=3.00, app;dur=4.00, encode;dur=1.50",
+                         "neo4j;dur=5.00, app;dur=6.00"]) == {"neo4j": 3.0, "app": 4.0, "encode": 1.5}
+
+
+def test_compare_with_a_baseline(capsys):
+    baseline = {"results": [
+        {"route": "batch", "concurrency": 1, "latencyMs": {"p50": 2.0, "p95": 4.0, "p99": 0.0}, "throughput": 100.0},
+    ]}
+    compare([{"route": "batch", "concurrency": 1, "latencyMs": {"p50": 1.0, "p95": 5.0, "p99": 1.0}, "throughput": 150.0},
+             {"route": "batch", "concurrency": 8, "latencyMs": {"p50": 1.0, "p95": 1.0, "p99": 1.0}, "throughput": 1.0}],
+            baseline)
+    lines = capsys.readouterr().out.strip().splitlines()
+    # Only the runs found in the baseline are compared, a zero baseline gives no change
+    assert len(lines) == 2
+    assert lines[1].split() == ["batch", "1", "-50.0%", "+25.0%", "+0.0%", "+50.0%"]